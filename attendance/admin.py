@@ -1,11 +1,60 @@
 from django.contrib import admin
-from .models import Teacher, Student, Subject, Attendance
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections, transaction
+from django.utils.functional import cached_property
+from .models import Teacher, Student, Subject, Attendance, DailyAttendanceSummary, StudentTermSummary
+
+
+def estimated_row_count(model, using):
+    """The planner's row estimate for ``model``'s table, or None if there isn't one.
+
+    Reads pg_class on PostgreSQL and the ANALYZE statistics on SQLite, so it
+    costs one tiny lookup instead of a full COUNT(*).
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    if connection.vendor == 'postgresql':
+        sql = "SELECT reltuples::bigint FROM pg_class WHERE relname = %s"
+    elif connection.vendor == 'sqlite':
+        # The first number of each sqlite_stat1 row is the table's row count
+        sql = "SELECT CAST(stat AS INTEGER) FROM sqlite_stat1 WHERE tbl = %s LIMIT 1"
+    else:
+        return None
+    try:
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            cursor.execute(sql, [table])
+            row = cursor.fetchone()
+    except DatabaseError:  # e.g. sqlite_stat1 doesn't exist before the first ANALYZE
+        return None
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return row[0]
+
+
+class EstimatedCountPaginator(Paginator):
+    # COUNT(*) over millions of attendance rows takes longer than the page
+    # itself; an unfiltered changelist uses the table statistics instead.
+    # Filtered lists still count exactly (the filters hit indexed columns).
+    estimate_threshold = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if hasattr(queryset, 'query') and not queryset.query.where:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= self.estimate_threshold:
+                return estimate
+        return super().count
 
 
 class TeacherAdmin(admin.ModelAdmin):
     list_display = ('name', 'get_subjects')  # Use a method to display subjects
     list_filter = ('subjects',)  # Use the ManyToManyField for filtering
 
+    def get_queryset(self, request):
+        # One extra query for every row's subjects instead of one per row
+        return super().get_queryset(request).prefetch_related('subjects')
+
     def get_subjects(self, obj):
         return ", ".join([subject.name for subject in obj.subjects.all()])
     get_subjects.short_description = 'Subjects'
@@ -15,6 +64,13 @@ class StudentAdmin(admin.ModelAdmin):
     list_display = ('name', 'rollno', 'get_subjects')  
     list_filter = ('subjects',)  # Use the ManyToManyField for filtering
 
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request).prefetch_related('subjects')
+        if request.resolver_match and request.resolver_match.url_name.endswith('_changelist'):
+            # The list never shows the encoding blob; the change form still loads it
+            queryset = queryset.defer('facial_encoding')
+        return queryset
+
     def get_subjects(self, obj):
         return ", ".join([subject.name for subject in obj.subjects.all()])
     get_subjects.short_description = 'Subjects'
@@ -26,7 +82,41 @@ class SubjectAdmin(admin.ModelAdmin):
 
 class AttendanceAdmin(admin.ModelAdmin):
     list_display = ('student', 'subject', 'date', 'status')
-    list_filter = ('subject', 'status', 'date')
+    # DateFieldListFilter offers fixed ranges (today, past 7 days, ...) and
+    # never queries for distinct dates; the ranges use the date indexes
+    list_filter = ('subject', 'status', ('date', admin.DateFieldListFilter))
+    date_hierarchy = 'date'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False  # skip the second, unfiltered COUNT(*) on filtered pages
+    raw_id_fields = ('student',)  # the change form would otherwise list every student
+
+    def get_queryset(self, request):
+        return (
+            super().get_queryset(request)
+            .select_related('student', 'subject')
+            .defer('student__facial_encoding')
+        )
+
+
+class DailyAttendanceSummaryAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'date', 'present', 'absent')
+    list_filter = ('subject',)
+    list_select_related = ('subject',)
+    date_hierarchy = 'date'
+
+
+class StudentTermSummaryAdmin(admin.ModelAdmin):
+    list_display = ('student', 'subject', 'term_start', 'present', 'absent')
+    list_filter = ('subject', 'term_start')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return (
+            super().get_queryset(request)
+            .select_related('student', 'subject')
+            .defer('student__facial_encoding')
+        )
 
 
 # Register models with the admin site
@@ -34,3 +124,5 @@ admin.site.register(Teacher, TeacherAdmin)
 admin.site.register(Student, StudentAdmin)
 admin.site.register(Subject, SubjectAdmin)
 admin.site.register(Attendance, AttendanceAdmin)
+admin.site.register(DailyAttendanceSummary, DailyAttendanceSummaryAdmin)
+admin.site.register(StudentTermSummary, StudentTermSummaryAdmin)
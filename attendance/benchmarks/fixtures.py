@@ -0,0 +1,163 @@
+import contextlib
+import os
+import shutil
+import tempfile
+from datetime import date, timedelta
+
+import cv2
+import numpy as np
+from django.db import connection, transaction
+
+from attendance.gallery import ENCODING_DIM, encode_encoding
+from attendance.models import Attendance, Student, Subject, Teacher
+from attendance.stub_models import DESCRIPTOR_SHAPE, describe
+
+
+@contextlib.contextmanager
+def scratch_database(on_disk=False):
+    """Run the block against a throwaway copy of the schema (like the test runner).
+
+    Benchmarks generate hundreds of thousands of rows; they must never touch
+    the real database. SQLite test databases live in memory unless
+    ``on_disk`` is set, which write benchmarks need to see real locking.
+    """
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    old_name, old_test_name = connection.settings_dict['NAME'], test_settings.get('NAME')
+    directory = None
+    if on_disk and connection.vendor == 'sqlite':
+        directory = tempfile.mkdtemp()
+        test_settings['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        test_settings['NAME'] = old_test_name
+        if directory:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def synthetic_encodings(size, seed=0):
+    # dlib descriptors of different people sit roughly 0.8-1.0 apart; spread
+    # identities around "lookalike" centres so the data has the cluster
+    # structure real galleries have.
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(scale=0.09, size=(max(1, size // 500), ENCODING_DIM))
+    return centres[rng.integers(len(centres), size=size)] + rng.normal(scale=0.06, size=(size, ENCODING_DIM))
+
+
+def face_patch(seed, size=96):
+    """A random blocky grey patch the stub models (attendance.stub_models) detect as a face.
+
+    Blocks line up with the stub descriptor grid, so JPEG noise barely moves
+    the descriptor.
+    """
+    rows, cols = DESCRIPTOR_SHAPE
+    blocks = np.random.default_rng(seed).integers(48, 256, size=(rows, cols), dtype=np.uint8)
+    patch = cv2.resize(blocks, (size, size), interpolation=cv2.INTER_NEAREST)
+    return cv2.cvtColor(patch, cv2.COLOR_GRAY2BGR)
+
+
+def face_frame(seeds, width=640, height=480, size=96):
+    """A dark frame with one face patch per seed, left to right."""
+    frame = np.zeros((height, width, 3), dtype=np.uint8)
+    step = width // max(1, len(seeds))
+    for i, seed in enumerate(seeds):
+        left = i * step + (step - size) // 2
+        top = (height - size) // 2
+        frame[top:top + size, left:left + size] = face_patch(seed, size)
+    return frame
+
+
+DEFECTS = ('too_small', 'too_dark', 'too_bright', 'blurry')
+
+
+def degraded_face_frame(seed, defect=None, width=640, height=480):
+    """face_frame([seed]) with a defect the quality checks (attendance.quality) reject, named by its reason."""
+    if defect == 'too_small':
+        return face_frame([seed], width, height, size=40)
+    frame = face_frame([seed], width, height)
+    if defect == 'too_dark':
+        frame[frame > 0] = frame[frame > 0] // 4 + 17  # still above the stub detection level
+    elif defect == 'too_bright':
+        frame[frame > 0] = np.clip(frame[frame > 0].astype(np.int16) // 4 + 200, 0, 255)
+    elif defect == 'blurry':
+        frame = cv2.GaussianBlur(frame, (0, 0), 4)
+    elif defect is not None:
+        raise ValueError(f'Unknown defect {defect!r}')
+    return frame
+
+
+def face_video(seeds, frames, width=320, height=240, size=64, speed=2):
+    """``frames`` frames of face_frame(seeds) with the faces drifting side to side by ``speed`` px a frame."""
+    step = width // max(1, len(seeds))
+    reach = max(0, (step - size) // 2 - 1)
+    video = []
+    for n in range(frames):
+        # Triangle wave: -reach .. reach and back
+        phase = (n * speed) % (4 * reach) if reach else 0
+        shift = phase - reach if phase < 2 * reach else 3 * reach - phase
+        frame = np.zeros((height, width, 3), dtype=np.uint8)
+        for i, seed in enumerate(seeds):
+            left = i * step + (step - size) // 2 + shift
+            top = (height - size) // 2
+            frame[top:top + size, left:left + size] = face_patch(seed, size)
+        video.append(frame)
+    return video
+
+
+def jpeg(frame, quality=90):
+    return cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+
+
+@transaction.atomic
+def generate_school(subjects=10, students=1000, days=100, teachers=None, with_encodings=False, start=date(2025, 1, 6), batch_size=5000):
+    """Create Subjects, Teachers, Students and one Attendance row per enrollment per day.
+
+    Every student takes two subjects, so ``students * 2 * days`` attendance rows
+    are created. ``with_encodings='stub'`` enrolls student i with the stub
+    descriptor of ``face_patch(i)``; any other true value uses random encodings.
+    """
+    teachers = teachers or subjects
+    subject_objs = Subject.objects.bulk_create([Subject(name=f'Subject {i}') for i in range(subjects)])
+    teacher_objs = Teacher.objects.bulk_create([Teacher(name=f'Teacher {i}', password='x') for i in range(teachers)])
+    Teacher.subjects.through.objects.bulk_create([
+        Teacher.subjects.through(teacher_id=teacher.id, subject_id=subject_objs[i % subjects].id)
+        for i, teacher in enumerate(teacher_objs)
+    ])
+
+    if with_encodings == 'stub':
+        encodings = [describe(face_patch(i)) for i in range(students)]
+    elif with_encodings:
+        encodings = synthetic_encodings(students)
+    student_objs = Student.objects.bulk_create([
+        Student(
+            name=f'Student {i}', rollno=f'R{i:07d}', photo=f'students/{i}.jpg',
+            facial_encoding=encode_encoding(encodings[i]) if with_encodings else b'',
+        )
+        for i in range(students)
+    ], batch_size=batch_size)
+    enrollments = [
+        (student.id, subject_objs[(i + offset) % subjects].id)
+        for i, student in enumerate(student_objs)
+        for offset in (0, 1) if subjects > offset
+    ]
+    Student.subjects.through.objects.bulk_create([
+        Student.subjects.through(student_id=student_id, subject_id=subject_id) for student_id, subject_id in enrollments
+    ], batch_size=batch_size)
+
+    rng = np.random.default_rng(0)
+    batch = []
+    for day in range(days):
+        current = start + timedelta(days=day)
+        present = rng.random(len(enrollments)) < 0.85
+        for (student_id, subject_id), is_present in zip(enrollments, present):
+            batch.append(Attendance(
+                student_id=student_id, subject_id=subject_id, date=current,
+                status='Present' if is_present else 'Absent',
+            ))
+            if len(batch) >= batch_size:
+                Attendance.objects.bulk_create(batch)
+                batch = []
+    Attendance.objects.bulk_create(batch)
+    return subject_objs, teacher_objs, student_objs
@@ -0,0 +1,298 @@
+"""Benchmarks of the recognition and attendance hot paths.
+
+Each case is a function taking ``quick`` (smaller sizes for CI) and returning
+a flat dict of metrics. Metric names say which way is better: ``*_per_s`` is
+higher-is-better, everything else (``*_ms``, ``*_queries``, ...) lower-is-better.
+Cases that need data build it in their own scratch database with fixed seeds,
+so runs are comparable between machines and commits.
+"""
+import asyncio
+import platform
+import time
+from datetime import date, timedelta
+from io import StringIO
+
+import django
+import numpy as np
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from attendance import gallery as gallery_module
+from attendance.capture_cache import get_marked_cache
+from attendance.gallery import best_match
+from attendance.metrics import collect_stages
+from attendance.quality import RejectedFace
+from attendance.streaming import CaptureStream, StreamProcessor
+from attendance.utils import get_face_encoding_from_frame
+
+from .fixtures import (
+    DEFECTS, degraded_face_frame, face_frame, face_video, generate_school, jpeg, scratch_database, synthetic_encodings,
+)
+
+
+CASES = {}
+
+
+def case(fn):
+    CASES[fn.__name__] = fn
+    return fn
+
+
+def percentiles(samples, prefix):
+    p50, p95 = np.percentile(samples, [50, 95]) * 1000
+    return {f'{prefix}_p50_ms': round(float(p50), 3), f'{prefix}_p95_ms': round(float(p95), 3)}
+
+
+def timed(fn, repeat):
+    samples = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - start)
+    return np.array(samples)
+
+
+def teacher_client(teacher, subject, user=None):
+    client = Client()
+    if user is not None:
+        client.force_login(user)  # before the teacher session: logging in starts a fresh session
+    session = client.session
+    session['teacher_id'] = teacher.id
+    session['subject'] = subject.name
+    session.save()
+    return client
+
+
+@case
+def capture(quick=False):
+    """End-to-end POST /capture/ of one-face JPEG frames through the test client."""
+    students, requests = (50, 50) if quick else (500, 300)
+    results = {}
+    with scratch_database():
+        gallery_module._gallery = None  # the gallery must be built from this database
+        try:
+            subjects, teachers, _ = generate_school(subjects=1, students=students, days=0, with_encodings='stub')
+            client = teacher_client(teachers[0], subjects[0])
+            frames = [jpeg(face_frame([i % students])) for i in range(requests)]
+            client.post(reverse('capture_face'), frames[0], content_type='image/jpeg')  # load the gallery
+
+            responses = []
+
+            def post(i):
+                responses.append(client.post(reverse('capture_face'), frames[i], content_type='image/jpeg'))
+
+            samples = timed(post, requests)
+        finally:
+            gallery_module._gallery = None
+    recognised = sum(response.json()['message'].startswith('Attendance Done') for response in responses)
+    results.update(percentiles(samples, 'request'))
+    results['requests_per_s'] = round(requests / samples.sum(), 1)
+    results['recognised_ratio'] = round(recognised / requests, 3)
+    return results
+
+
+@case
+def matcher(quick=False):
+    """Exact matching throughput against N synthetic 128-d encodings."""
+    results = {}
+    probes = synthetic_encodings(64, seed=1).astype(np.float32)
+    for size in (1_000, 10_000) if quick else (1_000, 10_000, 100_000):
+        encodings = synthetic_encodings(size).astype(np.float32)
+        sq_norms = np.einsum('ij,ij->i', encodings, encodings)
+        repeat = max(5, 200_000 // size)
+
+        single = timed(lambda i: best_match(probes[i % len(probes)], encodings, sq_norms=sq_norms), repeat)
+        batch = timed(lambda i: best_match(probes[:16], encodings, sq_norms=sq_norms), max(3, repeat // 16))
+        results[f'n{size}_single_per_s'] = round(repeat / single.sum(), 1)
+        results[f'n{size}_batch16_faces_per_s'] = round(16 * len(batch) / batch.sum(), 1)
+    return results
+
+
+@case
+def mark_absent(quick=False):
+    """The nightly mark_absent command over a backfill range."""
+    students, days = (500, 3) if quick else (5000, 5)
+    with scratch_database():
+        generate_school(subjects=10, students=students, days=0)
+        first = date(2025, 3, 3)
+        start = time.perf_counter()
+        call_command(
+            'mark_absent', '--from', first.isoformat(), '--to', (first + timedelta(days=days - 1)).isoformat(),
+            stdout=StringIO(),
+        )
+        elapsed = time.perf_counter() - start
+    return {
+        'rows_per_s': round(students * 2 * days / elapsed, 1),
+        'total_ms': round(elapsed * 1000, 1),
+    }
+
+
+@case
+def attendance_by_subject(quick=False):
+    """view_attendance_by_subject for a teacher with a large history."""
+    students, days, pages = (200, 20, 5) if quick else (2000, 60, 20)
+    from django.contrib.auth.models import User
+
+    with scratch_database():
+        subjects, teachers, _ = generate_school(subjects=4, students=students, days=days, start=date.today() - timedelta(days=days))
+        client = teacher_client(teachers[0], subjects[0], User.objects.create_user('benchmark'))
+        url = reverse('attendance_by_subject')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        assert response.status_code == 200, f'attendance_by_subject returned {response.status_code}'
+        page_queries = len(queries)
+        next_query = [None]
+
+        def get_page(i):
+            # Walk forward through the history; start over after the last page
+            response = client.get(f'{url}?{next_query[0]}' if next_query[0] else url)
+            next_query[0] = response.context['next_query']
+
+        samples = timed(get_page, pages)
+    results = percentiles(samples, 'page')
+    results['pages_per_s'] = round(pages / samples.sum(), 1)
+    results['page_queries'] = page_queries
+    return results
+
+
+@case
+def quality(quick=False):
+    """Face quality gate: share of frames rejected and the recognition CPU it saves.
+
+    Four in ten frames carry one of the defects the gate rejects. With the stub
+    models the descriptor is nearly free, so the saving is only representative
+    with dlib.
+    """
+    repeat = 4 if quick else 20
+    defects = [None] * 6 + list(DEFECTS)
+    frames = [degraded_face_frame(i, defect) for i in range(repeat) for defect in defects]
+
+    def recognise_all():
+        results, stages = [], {}
+        cpu_start = time.process_time()
+        for frame in frames:
+            result, timings = collect_stages(get_face_encoding_from_frame, frame)
+            results.append(result)
+            for name, seconds in timings.items():
+                stages[name] = stages.get(name, 0.0) + seconds
+        return results, stages, time.process_time() - cpu_start
+
+    get_face_encoding_from_frame(frames[0])  # load the models
+    results, stages, gated_cpu = recognise_all()
+    with override_settings(FACE_QUALITY_CHECKS=False):
+        _, ungated_stages, ungated_cpu = recognise_all()
+
+    rejected = sum(isinstance(result, RejectedFace) for result in results)
+    return {
+        'rejected_fraction': round(rejected / len(frames), 3),
+        'quality_check_ms_per_frame': round(stages.get('quality', 0.0) * 1000 / len(frames), 3),
+        'gated_cpu_ms_per_frame': round(gated_cpu * 1000 / len(frames), 3),
+        'ungated_cpu_ms_per_frame': round(ungated_cpu * 1000 / len(frames), 3),
+        'descriptor_saved_ratio': round(1 - stages.get('descriptor', 0.0) / ungated_stages['descriptor'], 3),
+        'cpu_saved_ratio': round(1 - gated_cpu / ungated_cpu, 3) if ungated_cpu else 0.0,
+    }
+
+
+def play(video, subject, processor):
+    """Push ``video`` through a CaptureStream as a client that sends its next frame once the previous result arrives."""
+    frames = iter(video)
+    sent = asyncio.Event()
+    sent.set()
+
+    async def receive():
+        await sent.wait()
+        sent.clear()
+        data = next(frames, None)
+        return {'type': 'websocket.disconnect'} if data is None else {'type': 'websocket.receive', 'bytes': data}
+
+    async def send(message):
+        sent.set()
+
+    return CaptureStream(receive, send, subject, processor).run()
+
+
+@case
+def stream(quick=False):
+    """Sustained WebSocket check-in: frames/s and CPU per stream with 1 and 4 concurrent streams."""
+    frames = 100 if quick else 300
+    results = {}
+    with scratch_database():
+        gallery_module._gallery = None
+        get_marked_cache().clear()
+        try:
+            subjects, _, _ = generate_school(subjects=1, students=8, days=0, with_encodings='stub')
+            # Stream i shows students 2i and 2i + 1 walking about
+            videos = [[jpeg(frame, 70) for frame in face_video([2 * i, 2 * i + 1], frames)] for i in range(4)]
+
+            def measure(streams, detect_every=None):
+                processors = [StreamProcessor(detect_every=detect_every) for _ in range(streams)]
+
+                async def run_all():
+                    await asyncio.gather(*(play(videos[i], subjects[0], processors[i]) for i in range(streams)))
+
+                start, cpu_start = time.perf_counter(), time.process_time()
+                asyncio.run(run_all())
+                elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu_start
+                return processors, elapsed, cpu
+
+            for streams in (1, 4):
+                processors, elapsed, cpu = measure(streams)
+                results[f'streams{streams}_frames_per_s'] = round(frames / elapsed, 1)
+                results[f'streams{streams}_cpu_ms_per_frame'] = round(cpu * 1000 / (frames * streams), 3)
+                recognised = {track.student_id for p in processors for track in p.tracks if track.student_id is not None}
+                results[f'streams{streams}_recognised_ratio'] = round(len(recognised) / (2 * streams), 3)
+                results[f'streams{streams}_descriptors_per_100_frames'] = round(
+                    100 * sum(p.descriptors for p in processors) / (frames * streams), 2,
+                )
+            # The same single stream detecting on every frame, for comparison
+            # (only meaningful with dlib: the stub detector is cheaper than tracking)
+            _, elapsed, cpu = measure(1, detect_every=1)
+            results['detect_every_frame_frames_per_s'] = round(frames / elapsed, 1)
+            results['detect_every_frame_cpu_ms_per_frame'] = round(cpu * 1000 / frames, 3)
+        finally:
+            gallery_module._gallery = None
+    return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'django': django.get_version(),
+        'machine': platform.machine(),
+        'database': connection.vendor,
+        'stub_models': settings.FACE_MODELS_STUB,
+    }
+
+
+def run(names=None, quick=False, progress=None):
+    results = {}
+    for name in names or CASES:
+        if progress:
+            progress(name)
+        results[name] = CASES[name](quick=quick)
+    return {'environment': environment(), 'quick': quick, 'results': results}
+
+
+def higher_is_better(metric):
+    return metric.endswith('_per_s') or metric.endswith('_ratio')
+
+
+def compare(report, baseline, tolerance):
+    """Return a list of (case, metric, baseline, current, change) that regressed by more than ``tolerance``."""
+    regressions = []
+    for name, metrics in report['results'].items():
+        for metric, value in metrics.items():
+            old = baseline.get('results', {}).get(name, {}).get(metric)
+            if not old or value is None:
+                continue
+            change = (value - old) / old
+            worse = -change if higher_is_better(metric) else change
+            if worse > tolerance:
+                regressions.append((name, metric, old, value, change))
+    return regressions
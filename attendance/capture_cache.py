@@ -0,0 +1,124 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from .metrics import Counter, Gauge, register
+
+
+CACHE_LOOKUPS = register(Counter(
+    'attendance_capture_cache_lookups_total', 'Capture cache lookups by cache and result (hit/miss).', ('cache', 'result'),
+))
+CACHE_EVICTIONS = register(Counter(
+    'attendance_capture_cache_evictions_total', 'Entries dropped from a capture cache to stay within its size.', ('cache',),
+))
+
+
+class TTLCache:
+    """A thread-safe LRU map whose entries also expire ``ttl`` seconds after being stored.
+
+    Holds at most ``maxsize`` entries; the least recently used one is evicted
+    first. ``maxsize=0`` disables the cache (every lookup misses).
+    """
+
+    def __init__(self, name, maxsize, ttl, clock=time.monotonic):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= self.clock():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        CACHE_LOOKUPS.inc(self.name, 'miss' if entry is None else 'hit')
+        return default if entry is None else entry[1]
+
+    def put(self, key, value):
+        if not self.maxsize:
+            return
+        evicted = 0
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                evicted += 1
+            self.evictions += evicted
+        if evicted:
+            CACHE_EVICTIONS.inc(self.name, amount=evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def image_digest(data):
+    """Digest of the uploaded image bytes, as the frame cache key.
+
+    Only a byte-identical resend (double click, kiosk retry) hits. A
+    perceptual hash of the whole frame is not safe here: with a static
+    background two different people can hash the same, and the second would
+    get the first one's encoding.
+    """
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+_frame_cache = None
+_marked_cache = None
+_caches_lock = threading.Lock()
+
+
+def _build_caches():
+    global _frame_cache, _marked_cache
+    from django.conf import settings
+
+    with _caches_lock:
+        if _frame_cache is None:
+            _frame_cache = TTLCache('frame', settings.CAPTURE_FRAME_CACHE_SIZE, settings.CAPTURE_FRAME_CACHE_TTL)
+        if _marked_cache is None:
+            _marked_cache = TTLCache('marked', settings.CAPTURE_MARKED_CACHE_SIZE, settings.CAPTURE_MARKED_CACHE_TTL)
+
+
+def get_frame_cache():
+    """Recent recognition results keyed by (kind, image digest), so resent frames skip dlib."""
+    if _frame_cache is None:
+        _build_caches()
+    return _frame_cache
+
+
+def get_marked_cache():
+    """(student id, subject id, date) keys already marked present, so repeats skip the database."""
+    if _marked_cache is None:
+        _build_caches()
+    return _marked_cache
+
+
+register(Gauge(
+    'attendance_capture_frame_cache_size', 'Entries in the recent-frame cache.',
+    lambda: len(_frame_cache) if _frame_cache is not None else 0,
+))
+register(Gauge(
+    'attendance_capture_marked_cache_size', 'Entries in the already-marked cache.',
+    lambda: len(_marked_cache) if _marked_cache is not None else 0,
+))
@@ -0,0 +1,237 @@
+import concurrent.futures
+import csv
+import io
+import os
+import posixpath
+from collections import namedtuple
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+
+from .gallery import encode_encoding
+from .models import Student
+from .recognition import RecognitionBusy, RecognitionTimeout, _init_worker
+from .signals import log_gallery_change
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+# One student to enroll; ``data`` is the raw photo file, or None if it is missing
+EnrollmentRow = namedtuple('EnrollmentRow', 'rollno name filename data')
+
+
+def encode_photo(data):
+    """Return the face encoding of a photo as bytes, ready for Student.facial_encoding.
+
+    Raises ValueError if the photo can't be decoded, shows no face, or the
+    face fails the quality checks.
+    """
+    from .quality import RejectedFace
+    from .utils import get_face_encoding_from_frame
+
+    frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        raise ValueError("Could not decode the image.")
+    encoding = get_face_encoding_from_frame(frame)
+    if encoding is None:
+        raise ValueError("No face detected in the photo.")
+    if isinstance(encoding, RejectedFace):
+        raise ValueError(encoding.message)
+    return encode_encoding(encoding)
+
+
+def _encode_or_error(data):
+    try:
+        return encode_photo(data), None
+    except ValueError as e:
+        return None, str(e)
+
+
+def encode_photos(photos, workers=None):
+    """Encode many photos, spread over ``workers`` processes. Returns [(encoding, error)]."""
+    workers = settings.ENROLLMENT_WORKERS if workers is None else workers
+    if workers <= 1 or len(photos) <= 1:
+        return [_encode_or_error(data) for data in photos]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(photos)), initializer=_init_worker) as executor:
+        return list(executor.map(_encode_or_error, photos, chunksize=max(1, len(photos) // (workers * 4))))
+
+
+def encode_photos_on_pool(photos, pool):
+    """Encode many photos on the shared recognition pool (the web upload path). Returns [(encoding, error)].
+
+    At most one job per worker is in flight, so a class upload never fills
+    the queue that captures need. Raises RecognitionBusy if the pool has no
+    room at all, and RecognitionTimeout if a photo takes too long.
+    """
+    results = [None] * len(photos)
+    in_flight = {}
+    position = 0
+    while position < len(photos) or in_flight:
+        while position < len(photos) and len(in_flight) < max(1, pool.workers):
+            try:
+                future = pool.submit(_encode_or_error, photos[position])
+            except RecognitionBusy:
+                if not in_flight:
+                    raise
+                break
+            in_flight[future] = position
+            position += 1
+        done, _ = concurrent.futures.wait(in_flight, timeout=pool.timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+        if not done:
+            raise RecognitionTimeout()
+        for future in done:
+            results[in_flight.pop(future)] = future.result()
+    return results
+
+
+def read_roster(text):
+    """Parse a CSV roster with ``rollno``, ``name`` and an optional ``photo`` column."""
+    return [
+        {key.strip().lower(): (value or '').strip() for key, value in row.items() if key}
+        for row in csv.DictReader(io.StringIO(text))
+    ]
+
+
+def _photo_for(row, names):
+    # An explicit photo column wins; otherwise look for "<rollno>.<image ext>"
+    if row.get('photo'):
+        return row['photo'] if row['photo'] in names else None
+    for name in names:
+        stem, extension = posixpath.splitext(posixpath.basename(name))
+        if stem == row.get('rollno') and extension.lower() in IMAGE_EXTENSIONS:
+            return name
+    return None
+
+
+def rows_from_zip(zip_file, roster_text):
+    names = set(zip_file.namelist())
+    rows = []
+    for row in read_roster(roster_text):
+        name = _photo_for(row, names)
+        rows.append(EnrollmentRow(
+            row.get('rollno', ''), row.get('name', ''),
+            posixpath.basename(name or row.get('photo', '')), zip_file.read(name) if name else None,
+        ))
+    return rows
+
+
+def rows_from_directory(directory, roster_text=None):
+    """Rows for the photos in ``directory``.
+
+    Without a roster every image is enrolled with its file name (minus the
+    extension) as both roll number and name.
+    """
+    names = {
+        name for name in os.listdir(directory)
+        if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+    }
+    if roster_text is None:
+        roster = [{'rollno': os.path.splitext(name)[0], 'name': os.path.splitext(name)[0], 'photo': name} for name in sorted(names)]
+    else:
+        roster = read_roster(roster_text)
+
+    rows = []
+    for row in roster:
+        name = _photo_for(row, names)
+        data = None
+        if name:
+            with open(os.path.join(directory, name), 'rb') as f:
+                data = f.read()
+        rows.append(EnrollmentRow(row.get('rollno', ''), row.get('name', ''), name or row.get('photo', ''), data))
+    return rows
+
+
+def _insert_students(students):
+    """Bulk insert ``students``; returns the ones created.
+
+    The roll numbers were checked before encoding, but a concurrent
+    registration may have taken one since. Then the rows are inserted one by
+    one to find out which; those are left without a pk.
+    """
+    try:
+        with transaction.atomic():
+            return Student.objects.bulk_create(students)
+    except IntegrityError:
+        pass
+    created = []
+    for student in students:
+        try:
+            with transaction.atomic():
+                created += Student.objects.bulk_create([student])
+        except IntegrityError:
+            pass
+    return created
+
+
+def enroll_students(rows, subjects=(), workers=None, pool=None):
+    """Create Students for ``rows`` and enroll them (and any existing ones) in ``subjects``.
+
+    Encodings are computed before anything is written, on ``pool`` (a
+    RecognitionPool) if given, else in ``workers`` processes; Students,
+    subject links and gallery change-log entries are then inserted in bulk,
+    and only then are the photos saved.
+    Returns one report dict (rollno, status, message) per row, in order, with
+    status 'enrolled', 'existing' or 'error'.
+    """
+    report = [None] * len(rows)
+    rollnos = [row.rollno for row in rows]
+    existing = dict(Student.objects.filter(rollno__in=rollnos).values_list('rollno', 'id'))
+
+    seen = set()
+    to_encode = []
+    for position, row in enumerate(rows):
+        if not row.rollno or not row.name:
+            report[position] = ('error', "Missing roll number or name.")
+        elif row.rollno in seen:
+            report[position] = ('error', "Duplicate roll number in this upload.")
+        elif row.rollno in existing:
+            report[position] = ('existing', "Already registered; subjects added.")
+        elif row.data is None:
+            report[position] = ('error', f"Photo {row.filename!r} not found." if row.filename else "No photo found.")
+        else:
+            to_encode.append(position)
+        seen.add(row.rollno)
+
+    students = []
+    photo_field = Student._meta.get_field('photo')
+    photos = [rows[position].data for position in to_encode]
+    encodings = encode_photos_on_pool(photos, pool) if pool is not None else encode_photos(photos, workers)
+    for position, (encoding, error) in zip(to_encode, encodings):
+        row = rows[position]
+        if error:
+            report[position] = ('error', error)
+            continue
+        photo = photo_field.generate_filename(None, row.filename)
+        students.append((position, Student(name=row.name, rollno=row.rollno, photo=photo, facial_encoding=encoding)))
+
+    with transaction.atomic():
+        # bulk_create skips post_save, so the gallery change log is written here
+        created = _insert_students([student for _, student in students])
+        student_ids = [student.pk for student in created] + list(existing.values())
+        Student.subjects.through.objects.bulk_create(
+            [
+                Student.subjects.through(student_id=student_id, subject_id=subject.pk)
+                for student_id in student_ids for subject in subjects
+            ],
+            ignore_conflicts=True,
+        )
+        log_gallery_change(student_ids)
+
+    # Photos are only written for students that now exist, so a failed
+    # insert leaves no orphaned files behind
+    for position, student in students:
+        if student.pk is None:
+            report[position] = ('error', "Roll number was registered meanwhile by another upload.")
+            continue
+        student.photo = default_storage.save(student.photo.name, ContentFile(rows[position].data))
+        report[position] = ('enrolled', "Enrolled.")
+    Student.objects.bulk_update(created, ['photo'])
+
+    return [
+        {'rollno': row.rollno, 'status': status, 'message': message}
+        for row, (status, message) in zip(rows, report)
+    ]
@@ -0,0 +1,128 @@
+import csv
+import zipfile
+from xml.sax.saxutils import escape
+
+from .models import Attendance
+
+
+EXPORT_COLUMNS = ('Date', 'Subject', 'Roll No', 'Student', 'Status')
+EXPORT_CHUNK_SIZE = 2000
+
+
+def export_rows(subject=None, teacher=None, date_from=None, date_to=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield attendance rows as tuples, streamed from the database in chunks."""
+    queryset = Attendance.objects.all()
+    if subject:
+        queryset = queryset.filter(subject__name=subject)
+    if teacher:
+        queryset = queryset.filter(subject__teachers=teacher)
+    if date_from:
+        queryset = queryset.filter(date__gte=date_from)
+    if date_to:
+        queryset = queryset.filter(date__lte=date_to)
+    # values_list skips building model instances; iterator() keeps only one
+    # chunk of rows in memory however large the range is
+    return (
+        queryset.order_by('date', 'id')
+        .values_list('date', 'subject__name', 'student__rollno', 'student__name', 'status')
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+class _Buffer:
+    # Write target that hands back whatever was written since the last drain
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(chunk.encode() if isinstance(chunk, str) else chunk for chunk in self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_csv(rows, batch=1000):
+    buffer = _Buffer()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % batch == 0:
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Attendance" sheetId="1" r:id="rId1"/></sheets></workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+
+def _xlsx_row(values):
+    cells = ''.join(f'<c t="inlineStr"><is><t>{escape(str(value))}</t></is></c>' for value in values)
+    return f'<row>{cells}</row>'
+
+
+def stream_xlsx(rows, batch=1000):
+    """Write a minimal single-sheet workbook as a zip stream.
+
+    The zip is written to a non-seekable buffer, so entries use data
+    descriptors and each batch of rows can be sent as soon as it is compressed.
+    """
+    buffer = _Buffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as workbook:
+        for name, content in XLSX_PARTS.items():
+            workbook.writestr(name, content)
+        with workbook.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'.encode()
+            )
+            sheet.write(_xlsx_row(EXPORT_COLUMNS).encode())
+            pending = []
+            for count, row in enumerate(rows, 1):
+                pending.append(_xlsx_row(row))
+                if count % batch == 0:
+                    sheet.write(''.join(pending).encode())
+                    pending = []
+                    yield buffer.drain()
+            sheet.write(''.join(pending).encode())
+            sheet.write(b'</sheetData></worksheet>')
+    yield buffer.drain()
+
+
+EXPORT_FORMATS = {
+    'csv': (stream_csv, 'text/csv'),
+    'xlsx': (stream_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
@@ -0,0 +1,343 @@
+import struct
+import threading
+
+import numpy as np
+
+from .metrics import Gauge, register
+
+
+ENCODING_DIM = 128
+MATCH_THRESHOLD = 0.6
+
+
+def pairwise_distances(probes, encodings, sq_norms=None):
+    # Euclidean distances between every probe (M x D) and every gallery row (N x D)
+    # using |a - b|^2 = |a|^2 + |b|^2 - 2 a.b, so the whole scan is a single matmul.
+    probes = np.atleast_2d(probes)
+    if sq_norms is None:
+        sq_norms = np.einsum('ij,ij->i', encodings, encodings)
+    probe_norms = np.einsum('ij,ij->i', probes, probes)
+    sq = probe_norms[:, None] + sq_norms[None, :] - 2.0 * (probes @ encodings.T)
+    np.maximum(sq, 0, out=sq)  # rounding can push exact matches slightly below zero
+    return np.sqrt(sq)
+
+
+def best_match(probes, encodings, threshold=MATCH_THRESHOLD, sq_norms=None):
+    """Return (row indices, distances) of the closest gallery row for each probe.
+
+    Rows whose best distance is not below ``threshold`` get index -1.
+    """
+    probes = np.atleast_2d(probes)
+    if len(encodings) == 0:
+        return np.full(len(probes), -1), np.full(len(probes), np.inf)
+    distances = pairwise_distances(probes, encodings, sq_norms)
+    rows = distances.argmin(axis=1)
+    best = distances[np.arange(len(probes)), rows]
+    rows[best >= threshold] = -1
+    return rows, best
+
+
+# Stored encoding format (Student.facial_encoding), version 1:
+#
+#   magic b'FE' | version u8 | kind u8 | dim u16 | model u8 | pad | scale f32 | payload
+#
+# all little-endian; the payload is ``dim`` float32 values (kind 1), or
+# ``dim`` int8 values that are multiplied by ``scale`` (kind 2). The 12-byte
+# header keeps the float32 payload aligned, so decoding is a view on the blob.
+# ``model`` identifies the network that produced the descriptor; encodings from
+# any other model are not comparable and are ignored.
+ENCODING_HEADER = struct.Struct('<2sBBHBxf')
+ENCODING_MAGIC = b'FE'
+ENCODING_VERSION = 1
+ENCODING_FLOAT32 = 1
+ENCODING_INT8 = 2
+ENCODING_KINDS = {'float32': ENCODING_FLOAT32, 'int8': ENCODING_INT8}
+ENCODING_MODEL_DLIB_RESNET_V1 = 1
+ENCODING_MODEL = ENCODING_MODEL_DLIB_RESNET_V1
+LEGACY_ENCODING_SIZE = ENCODING_DIM * 8  # headerless float64, before version 1
+
+
+def encode_encoding(encoding, kind=None):
+    """Serialise a descriptor for storage; ``kind`` is 'float32' or 'int8' (default FACE_ENCODING_FORMAT)."""
+    if kind is None:
+        from django.conf import settings
+        kind = settings.FACE_ENCODING_FORMAT
+    encoding = np.asarray(encoding, dtype=np.float32).reshape(-1)
+    if kind == 'int8':
+        # Symmetric per-descriptor scale: the rounding error (scale / 2 per
+        # component) is far below the distances that separate people
+        scale = float(np.abs(encoding).max()) / 127 or 1.0
+        payload = np.clip(np.rint(encoding / scale), -127, 127).astype(np.int8)
+    elif kind == 'float32':
+        scale = 1.0
+        payload = encoding
+    else:
+        raise ValueError(f"Unknown encoding format {kind!r}")
+    header = ENCODING_HEADER.pack(ENCODING_MAGIC, ENCODING_VERSION, ENCODING_KINDS[kind], encoding.size, ENCODING_MODEL, scale)
+    return header + payload.tobytes()
+
+
+def decode_encoding(blob):
+    """Return the stored descriptor as a 1-D array, or None if it is missing or unusable.
+
+    float32 payloads come back as a read-only view on ``blob`` (no copy).
+    """
+    if not blob:
+        return None
+    if len(blob) == LEGACY_ENCODING_SIZE:
+        return np.frombuffer(blob, dtype=np.float64)
+    if len(blob) < ENCODING_HEADER.size:
+        return None
+    magic, version, kind, dim, model, scale = ENCODING_HEADER.unpack_from(blob)
+    if magic != ENCODING_MAGIC or version != ENCODING_VERSION or model != ENCODING_MODEL or dim != ENCODING_DIM:
+        return None
+    if kind == ENCODING_FLOAT32 and len(blob) == ENCODING_HEADER.size + dim * 4:
+        return np.frombuffer(blob, dtype='<f4', count=dim, offset=ENCODING_HEADER.size)
+    if kind == ENCODING_INT8 and len(blob) == ENCODING_HEADER.size + dim:
+        return np.frombuffer(blob, dtype=np.int8, count=dim, offset=ENCODING_HEADER.size) * np.float32(scale)
+    return None
+
+
+class FaceGallery:
+    """All known student encodings as one contiguous N x 128 matrix.
+
+    ``ids[i]`` is the primary key of the student whose encoding is ``encodings[i]``.
+    The gallery is built lazily from the database on first use and then kept
+    current by replaying ``GalleryChange`` entries, so adding, editing or
+    deleting a student only touches that student's row. Searches go through
+    ``index`` (see ``attendance.index``), which defaults to an exact scan.
+
+    Rows are also partitioned by the subjects each student is enrolled in, so
+    a capture for one subject only has to search that subject's students.
+    """
+
+    def __init__(self, dtype=np.float32, index=None):
+        if index is None:
+            from .index import BruteForceIndex
+            index = BruteForceIndex()
+        self.dtype = dtype
+        self.index = index
+        self.version = 0
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._reset(0)
+
+    def __len__(self):
+        self.refresh()
+        return self._size
+
+    # Rows live in over-allocated buffers so appends are amortised O(1) and
+    # removals swap the last row into the hole.
+    def _reset(self, capacity):
+        capacity = max(capacity, 16)
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._encodings = np.zeros((capacity, ENCODING_DIM), dtype=self.dtype)
+        self._sq_norms = np.zeros(capacity, dtype=self.dtype)
+        self._rows = {}
+        self._size = 0
+        self._subjects = {}  # student id -> subject ids
+        self._partitions = {}  # subject id -> student ids
+        self._partition_rows = {}  # subject id -> cached row indices
+
+    def _grow(self):
+        capacity = len(self._ids) * 2
+        self._ids = np.resize(self._ids, capacity)
+        encodings = np.zeros((capacity, ENCODING_DIM), dtype=self.dtype)
+        encodings[:self._size] = self._encodings[:self._size]
+        self._encodings = encodings
+        self._sq_norms = np.resize(self._sq_norms, capacity)
+
+    @property
+    def ids(self):
+        return self._ids[:self._size]
+
+    @property
+    def encodings(self):
+        return self._encodings[:self._size]
+
+    @property
+    def sq_norms(self):
+        return self._sq_norms[:self._size]
+
+    def upsert(self, student_id, encoding):
+        with self._lock:
+            row = self._rows.get(student_id)
+            if row is None:
+                if self._size == len(self._ids):
+                    self._grow()
+                row = self._size
+                self._size += 1
+                self._rows[student_id] = row
+                self._ids[row] = student_id
+                self._forget_partition_rows(student_id)
+            self._encodings[row] = encoding
+            self._sq_norms[row] = np.dot(self._encodings[row], self._encodings[row])
+            self.index.add(row, self._encodings[row])
+
+    def remove(self, student_id):
+        with self._lock:
+            row = self._rows.pop(student_id, None)
+            if row is None:
+                return
+            self.set_subjects(student_id, ())
+            last = self._size - 1
+            if row != last:
+                moved_id = int(self._ids[last])
+                self._ids[row] = moved_id
+                self._encodings[row] = self._encodings[last]
+                self._sq_norms[row] = self._sq_norms[last]
+                self._rows[moved_id] = row
+                self.index.move(last, row)
+                self._forget_partition_rows(moved_id)
+            else:
+                self.index.remove(row)
+            self._size = last
+
+    def set_subjects(self, student_id, subject_ids):
+        with self._lock:
+            old = self._subjects.pop(student_id, set())
+            new = set(subject_ids)
+            if new:
+                self._subjects[student_id] = new
+            for subject_id in old - new:
+                self._partitions[subject_id].discard(student_id)
+            for subject_id in new - old:
+                self._partitions.setdefault(subject_id, set()).add(student_id)
+            for subject_id in old ^ new:
+                self._partition_rows.pop(subject_id, None)
+
+    def _forget_partition_rows(self, student_id):
+        for subject_id in self._subjects.get(student_id, ()):
+            self._partition_rows.pop(subject_id, None)
+
+    def partition_rows(self, subject_id):
+        """Gallery rows of the students enrolled in ``subject_id``."""
+        with self._lock:
+            rows = self._partition_rows.get(subject_id)
+            if rows is None:
+                student_ids = self._partitions.get(subject_id, ())
+                rows = np.array(sorted(self._rows[student_id] for student_id in student_ids), dtype=np.intp)
+                self._partition_rows[subject_id] = rows
+            return rows
+
+    def load(self):
+        # Imported here so the gallery module stays importable before apps are ready
+        from .models import GalleryChange, Student
+
+        # Read the version first: changes made while loading are replayed by the
+        # next refresh(), and replaying an up-to-date row is harmless.
+        version = GalleryChange.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        enrollments = Student.subjects.through.objects.values_list('student_id', 'subject_id')
+        subjects = {}
+        for student_id, subject_id in enrollments.iterator():
+            subjects.setdefault(student_id, set()).add(subject_id)
+
+        # Each stored descriptor is decoded as a view on its blob and copied
+        # straight into its row of a fresh buffer; no per-row arrays are kept
+        ids = np.zeros(16, dtype=np.int64)
+        encodings = np.zeros((16, ENCODING_DIM), dtype=self.dtype)
+        size = 0
+        for student_id, blob in Student.objects.values_list('id', 'facial_encoding').iterator():
+            encoding = decode_encoding(blob)
+            if encoding is None:  # Skip invalid or empty encodings
+                continue
+            if size == len(ids):
+                ids = np.resize(ids, 2 * size)
+                encodings = np.resize(encodings, (2 * size, ENCODING_DIM))
+            ids[size] = student_id
+            encodings[size] = encoding
+            size += 1
+
+        with self._lock:
+            self._reset(0)
+            self._ids, self._encodings, self._size = ids, encodings, size
+            self._sq_norms = np.zeros(len(ids), dtype=self.dtype)
+            self._sq_norms[:size] = np.einsum('ij,ij->i', self.encodings, self.encodings)
+            self._rows = {student_id: row for row, student_id in enumerate(self.ids.tolist())}
+            for student_id in self._rows:
+                if student_id in subjects:
+                    self.set_subjects(student_id, subjects[student_id])
+            self.index.reset(self.encodings)
+            self.version = version
+            self._loaded = True
+
+    def sync(self):
+        """Apply the changes logged since ``version`` row by row."""
+        from .models import GalleryChange, Student
+
+        changes = list(GalleryChange.objects.filter(id__gt=self.version).order_by('id').values_list('id', 'student_id'))
+        if not changes:
+            return 0
+        student_ids = {student_id for _, student_id in changes}
+        blobs = dict(Student.objects.filter(pk__in=student_ids).values_list('id', 'facial_encoding'))
+        subjects = {}
+        enrollments = Student.subjects.through.objects.filter(student_id__in=student_ids)
+        for student_id, subject_id in enrollments.values_list('student_id', 'subject_id'):
+            subjects.setdefault(student_id, set()).add(subject_id)
+
+        with self._lock:
+            for student_id in student_ids:
+                encoding = decode_encoding(blobs.get(student_id))
+                if encoding is None:  # Deleted, or no usable encoding any more
+                    self.remove(student_id)
+                else:
+                    self.upsert(student_id, encoding)
+                    self.set_subjects(student_id, subjects.get(student_id, ()))
+            self.version = changes[-1][0]
+        return len(student_ids)
+
+    def refresh(self):
+        if self._loaded:
+            self.sync()
+        else:
+            self.load()
+
+    def invalidate(self):
+        # Force a full reload from the database on the next match
+        with self._lock:
+            self._loaded = False
+
+    def match(self, encoding, threshold=MATCH_THRESHOLD, subject_id=None):
+        """Return (student_id, distance) of the closest student, or (None, distance).
+
+        With ``subject_id`` only students enrolled in that subject are considered.
+        """
+        ids, distances = self.match_many(encoding, threshold, subject_id)
+        return ids[0], distances[0]
+
+    def match_many(self, encodings, threshold=MATCH_THRESHOLD, subject_id=None):
+        self.refresh()
+        probes = np.atleast_2d(np.asarray(encodings, dtype=self.dtype))
+        with self._lock:
+            candidates = None if subject_id is None else self.partition_rows(subject_id)
+            rows, distances = self.index.search(probes, self.encodings, self.sq_norms, threshold, candidates)
+            matched = [int(self._ids[row]) if row >= 0 else None for row in rows]
+        return matched, distances.tolist()
+
+
+_gallery = None
+_gallery_lock = threading.Lock()
+
+
+def get_gallery():
+    global _gallery
+    if _gallery is None:
+        with _gallery_lock:
+            if _gallery is None:
+                from django.conf import settings
+                from .index import build_index
+
+                index = build_index(
+                    settings.FACE_INDEX_BACKEND,
+                    nlist=settings.FACE_INDEX_NLIST,
+                    nprobe=settings.FACE_INDEX_NPROBE,
+                    path=settings.FACE_INDEX_PATH,
+                )
+                _gallery = FaceGallery(index=index)
+    return _gallery
+
+
+register(Gauge(
+    'attendance_gallery_size', 'Student encodings loaded in the face gallery.',
+    lambda: len(_gallery.ids) if _gallery is not None else 0,
+))
@@ -0,0 +1,200 @@
+import logging
+import os
+
+import numpy as np
+
+from .gallery import MATCH_THRESHOLD, best_match, pairwise_distances
+
+
+logger = logging.getLogger(__name__)
+
+
+class BruteForceIndex:
+    """Exact search: one batched distance computation over every gallery row."""
+
+    name = 'exact'
+
+    def reset(self, encodings):
+        pass
+
+    def add(self, row, encoding):
+        pass
+
+    def move(self, src, dst):
+        pass
+
+    def remove(self, row):
+        pass
+
+    def search(self, probes, encodings, sq_norms, threshold=MATCH_THRESHOLD, rows=None):
+        return search_rows(probes, encodings, sq_norms, threshold, rows)
+
+    def save(self, path):
+        pass
+
+
+def search_rows(probes, encodings, sq_norms, threshold=MATCH_THRESHOLD, rows=None):
+    # Exact search, optionally restricted to a subset of gallery rows
+    if rows is None:
+        return best_match(probes, encodings, threshold, sq_norms)
+    found, distances = best_match(probes, encodings[rows], threshold, sq_norms[rows])
+    return np.where(found >= 0, rows[found], -1), distances
+
+
+def nearest_centroid(encodings, centroids, chunk_size=8192):
+    # Chunked so assigning 100k+ rows never materialises a full N x nlist matrix
+    centroid_norms = np.einsum('ij,ij->i', centroids, centroids)
+    labels = np.empty(len(encodings), dtype=np.int32)
+    for start in range(0, len(encodings), chunk_size):
+        chunk = encodings[start:start + chunk_size]
+        labels[start:start + chunk_size] = pairwise_distances(chunk, centroids, centroid_norms).argmin(axis=1)
+    return labels
+
+
+def kmeans(encodings, k, iterations=20, seed=0):
+    """Plain Lloyd's k-means; returns a (k, dim) centroid matrix."""
+    rng = np.random.default_rng(seed)
+    centroids = encodings[rng.choice(len(encodings), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = nearest_centroid(encodings, centroids)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, encodings)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # Re-seed empty clusters from random points so every list stays useful
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = encodings[rng.choice(len(encodings), size=len(empty), replace=False)]
+    return centroids
+
+
+class IVFIndex:
+    """Inverted-file ANN index with a k-means coarse quantizer.
+
+    Every gallery row is filed under its nearest centroid; a probe only scans
+    the rows filed under its ``nprobe`` nearest centroids. The centroids are
+    trained offline by the build_face_index command and loaded from ``path``;
+    until then, and for galleries too small to be worth partitioning, search
+    falls back to an exact scan.
+    """
+
+    name = 'ivf'
+
+    def __init__(self, nlist=None, nprobe=8, min_train_size=2048, path=None):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.path = path
+        self.centroids = None
+        self.labels = np.zeros(0, dtype=np.int32)  # row -> list, -1 for rows not filed
+        self.lists = []  # list -> array of its rows
+        if path and os.path.exists(path):
+            self.centroids = np.load(path)['centroids']
+
+    def train(self, encodings):
+        nlist = self.nlist or max(1, int(np.sqrt(len(encodings))))
+        # A few dozen points per list is plenty to place the centroids
+        sample_size = min(len(encodings), nlist * 64)
+        sample = encodings[np.random.default_rng(0).choice(len(encodings), size=sample_size, replace=False)]
+        self.centroids = kmeans(np.asarray(sample, dtype=np.float64), nlist)
+
+    def reset(self, encodings):
+        if self.centroids is not None and self.centroids.shape[1] != encodings.shape[1]:
+            logger.warning("Face index centroids don't match the encodings; searching exactly until build_face_index is run.")
+            self.centroids = None
+        if self.centroids is None:
+            if len(encodings) >= self.min_train_size:
+                logger.warning("The face index is not trained; searching exactly. Run build_face_index.")
+            self.labels = np.zeros(0, dtype=np.int32)
+            self.lists = []
+            return
+        self.labels = nearest_centroid(encodings, self.centroids)
+        order = np.argsort(self.labels, kind='stable')
+        bounds = np.searchsorted(self.labels[order], np.arange(len(self.centroids) + 1))
+        self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(self.centroids))]
+
+    def _unlink(self, row):
+        if row < len(self.labels) and self.labels[row] >= 0:
+            rows = self.lists[self.labels[row]]
+            self.lists[self.labels[row]] = rows[rows != row]
+            self.labels[row] = -1
+
+    def add(self, row, encoding):
+        if self.centroids is None:
+            return
+        label = nearest_centroid(np.atleast_2d(encoding), self.centroids)[0]
+        if row < len(self.labels) and self.labels[row] == label:
+            return
+        self._unlink(row)
+        if row >= len(self.labels):
+            labels = np.full(max(row + 1, len(self.labels) * 2), -1, dtype=np.int32)
+            labels[:len(self.labels)] = self.labels
+            self.labels = labels
+        self.labels[row] = label
+        self.lists[label] = np.append(self.lists[label], row)
+
+    def move(self, src, dst):
+        # Row ``dst`` was removed and the gallery moved row ``src`` into its place
+        if self.centroids is None:
+            return
+        self._unlink(dst)
+        label = self.labels[src]
+        if label >= 0:
+            rows = self.lists[label]
+            rows[rows == src] = dst
+            self.labels[dst] = label
+            self.labels[src] = -1
+
+    def remove(self, row):
+        if self.centroids is not None:
+            self._unlink(row)
+
+    def search(self, probes, encodings, sq_norms, threshold=MATCH_THRESHOLD, rows=None):
+        probes = np.atleast_2d(probes)
+        # Subsets that are small anyway (e.g. one subject's students) are cheaper
+        # and more accurate to scan exactly
+        subset_size = len(encodings) if rows is None else len(rows)
+        if self.centroids is None or subset_size < self.min_train_size:
+            return search_rows(probes, encodings, sq_norms, threshold, rows)
+
+        nprobe = min(self.nprobe, len(self.centroids))
+        probe_lists = np.argsort(pairwise_distances(probes, self.centroids), axis=1)[:, :nprobe]
+        in_subset = None
+        if rows is not None:
+            in_subset = np.zeros(len(encodings), dtype=bool)
+            in_subset[rows] = True
+        matched = np.full(len(probes), -1)
+        distances = np.full(len(probes), np.inf)
+        for i, lists in enumerate(probe_lists):
+            candidates = np.concatenate([self.lists[label] for label in lists])
+            if in_subset is not None:
+                candidates = candidates[in_subset[candidates]]
+            if len(candidates) == 0:
+                continue
+            found, best = search_rows(probes[i], encodings, sq_norms, threshold, candidates)
+            matched[i] = found[0]
+            distances[i] = best[0]
+        return matched, distances
+
+    def save(self, path):
+        if path and self.centroids is not None:
+            # np.savez appends .npz unless given a file object
+            with open(path, 'wb') as f:
+                np.savez(f, centroids=self.centroids)
+
+
+INDEX_BACKENDS = {
+    BruteForceIndex.name: BruteForceIndex,
+    IVFIndex.name: IVFIndex,
+}
+
+
+def build_index(backend='exact', **options):
+    try:
+        index_class = INDEX_BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown face index backend {backend!r}; expected one of {sorted(INDEX_BACKENDS)}")
+    if index_class is BruteForceIndex:
+        return index_class()
+    return index_class(**options)
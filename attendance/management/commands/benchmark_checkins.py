@@ -0,0 +1,103 @@
+import threading
+import time
+from datetime import date
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections, connection, connections, transaction
+
+from attendance.benchmarks.fixtures import generate_school, scratch_database
+from attendance.models import Attendance, Student
+from attendance.rollups import record_attendance
+
+
+# SQLite connection options compared by --sqlite-modes
+SQLITE_MODES = {
+    # Django's defaults: rollback journal, full sync, 5 s busy timeout, deferred transactions
+    'default': {},
+    # What settings.py configures
+    'tuned': {
+        'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+        'timeout': 20,
+        'transaction_mode': 'IMMEDIATE',
+    },
+}
+
+
+def check_in(student_id, subject_id, day):
+    # The write path of capture_face
+    with transaction.atomic():
+        attendance, created = Attendance.objects.get_or_create(
+            student_id=student_id, subject_id=subject_id, date=day, defaults={'status': 'Present'},
+        )
+        if created:
+            record_attendance([attendance])
+
+
+class Command(BaseCommand):
+    help = 'Measure concurrent check-in (attendance write) throughput on a scratch database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16, help='Concurrent check-in clients')
+        parser.add_argument('--students', type=int, default=2000)
+        parser.add_argument('--sqlite-modes', nargs='+', choices=sorted(SQLITE_MODES), default=sorted(SQLITE_MODES),
+                            help='SQLite configurations to compare (ignored on other databases)')
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite':
+            modes = options['sqlite_modes']
+        else:
+            modes = [None]  # run once with the configured backend (e.g. PostgreSQL with pooling)
+
+        settings_dict = connection.settings_dict
+        original_options = settings_dict.get('OPTIONS', {})
+        try:
+            for mode in modes:
+                if mode is not None:
+                    settings_dict['OPTIONS'] = dict(SQLITE_MODES[mode])
+                connection.close()
+                with scratch_database(on_disk=True):
+                    generate_school(subjects=10, students=options['students'], days=0)
+                    self.report(mode or connection.vendor, self.run(options['threads']))
+        finally:
+            settings_dict['OPTIONS'] = original_options
+            connection.close()
+
+    def run(self, threads):
+        enrollments = list(Student.subjects.through.objects.values_list('student_id', 'subject_id'))
+        connection.close()  # every client thread opens its own connection
+        day = date.today()
+        latencies = [[] for _ in range(threads)]
+        errors = [0] * threads
+
+        def client(worker):
+            for student_id, subject_id in enrollments[worker::threads]:
+                start = time.perf_counter()
+                try:
+                    check_in(student_id, subject_id, day)
+                except OperationalError:  # "database is locked"
+                    errors[worker] += 1
+                    continue
+                latencies[worker].append(time.perf_counter() - start)
+            connections.close_all()
+
+        workers = [threading.Thread(target=client, args=(worker,)) for worker in range(threads)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+        close_old_connections()
+        return np.concatenate([np.array(worker_latencies) for worker_latencies in latencies]), sum(errors), elapsed
+
+    def report(self, label, result):
+        latencies, errors, elapsed = result
+        if len(latencies):
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+        else:
+            p50 = p95 = p99 = float('nan')
+        self.stdout.write(
+            f'{label}: {len(latencies) / elapsed:.0f} check-ins/s, {errors} failed with "database is locked", '
+            f'latency p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms'
+        )
@@ -0,0 +1,50 @@
+import os
+import time
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from attendance.utils import detect_faces
+
+
+class Command(BaseCommand):
+    help = 'Report face detection latency and detection rate at several detection widths'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', default=os.path.join(settings.BASE_DIR, 'students'), help='Directory of sample photos')
+        parser.add_argument('--widths', type=int, nargs='+', default=[0, 1280, 960, 640, 480, 320], help='Max detection widths; 0 = full resolution')
+        parser.add_argument('--upsample', type=int, nargs='+', default=[0, 1])
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        frames = []
+        for name in sorted(os.listdir(options['images'])):
+            frame = cv2.imread(os.path.join(options['images'], name))
+            if frame is None:  # Not an image (or a git-lfs pointer that was never fetched)
+                self.stderr.write(f'Skipping unreadable file {name}')
+                continue
+            frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+
+        if not frames:
+            self.stdout.write(self.style.WARNING('No readable images found.'))
+            return
+        self.stdout.write(f'{len(frames)} images, median width {int(np.median([f.shape[1] for f in frames]))}px')
+
+        for upsample in options['upsample']:
+            for width in options['widths']:
+                timings = []
+                detected = 0
+                for gray in frames:
+                    for _ in range(options['repeat']):
+                        start = time.perf_counter()
+                        faces = detect_faces(gray, max_width=width or None, upsample=upsample)
+                        timings.append(time.perf_counter() - start)
+                    detected += bool(faces)
+                timings = np.array(timings) * 1000
+                self.stdout.write(
+                    f'width={width or "full":>5} upsample={upsample}: '
+                    f'mean {timings.mean():7.1f} ms, p95 {np.percentile(timings, 95):7.1f} ms, '
+                    f'detection rate {detected / len(frames):.0%}'
+                )
@@ -0,0 +1,36 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from attendance.benchmarks.fixtures import generate_school, scratch_database
+from attendance.export import EXPORT_FORMATS, export_rows
+
+
+class Command(BaseCommand):
+    help = 'Measure export throughput and peak memory on a generated dataset in a scratch database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help='Approximate number of attendance rows')
+        parser.add_argument('--formats', nargs='+', choices=sorted(EXPORT_FORMATS), default=sorted(EXPORT_FORMATS))
+
+    def handle(self, *args, **options):
+        days = 100
+        students = max(1, options['rows'] // (2 * days))
+        with scratch_database():
+            start = time.perf_counter()
+            generate_school(subjects=20, students=students, days=days)
+            self.stdout.write(f'Generated {students * 2 * days} rows in {time.perf_counter() - start:.0f} s')
+
+            for export_format in options['formats']:
+                stream, _ = EXPORT_FORMATS[export_format]
+                tracemalloc.start()
+                start = time.perf_counter()
+                size = sum(len(chunk) for chunk in stream(export_rows()))
+                elapsed = time.perf_counter() - start
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                self.stdout.write(
+                    f'{export_format}: {students * 2 * days / elapsed:,.0f} rows/s, '
+                    f'{size / 2 ** 20:.0f} MB written, peak Python memory {peak / 2 ** 20:.1f} MB'
+                )
@@ -0,0 +1,49 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from attendance.benchmarks.fixtures import synthetic_encodings
+from attendance.gallery import ENCODING_DIM
+from attendance.index import BruteForceIndex, IVFIndex
+
+
+def time_search(index, probes, encodings, sq_norms):
+    start = time.perf_counter()
+    rows = [index.search(probe, encodings, sq_norms)[0][0] for probe in probes]
+    elapsed = time.perf_counter() - start
+    return np.array(rows), elapsed / len(probes) * 1000
+
+
+class Command(BaseCommand):
+    help = 'Compare recall and latency of the IVF face index against the exact backend on synthetic encodings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 8, 16])
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(1)
+        for size in options['sizes']:
+            encodings = synthetic_encodings(size)
+            sq_norms = np.einsum('ij,ij->i', encodings, encodings)
+            # Probes are re-captures of enrolled faces: the same person plus camera noise
+            targets = rng.choice(size, size=options['queries'], replace=False)
+            probes = encodings[targets] + rng.normal(scale=0.02, size=(len(targets), ENCODING_DIM))
+
+            exact_rows, exact_ms = time_search(BruteForceIndex(), probes, encodings, sq_norms)
+            self.stdout.write(f'N={size}: exact {exact_ms:.2f} ms/query')
+
+            index = IVFIndex(min_train_size=1)
+            start = time.perf_counter()
+            index.train(encodings)
+            index.reset(encodings)
+            build_s = time.perf_counter() - start
+            self.stdout.write(f'  ivf build ({len(index.centroids)} lists): {build_s:.1f} s')
+
+            for nprobe in options['nprobe']:
+                index.nprobe = nprobe
+                rows, ms = time_search(index, probes, encodings, sq_norms)
+                recall = np.mean(rows == exact_rows)
+                self.stdout.write(f'  ivf nprobe={nprobe}: {ms:.2f} ms/query, recall@1 {recall:.3f}, speed-up {exact_ms / ms:.1f}x')
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from attendance.gallery import FaceGallery
+from attendance.index import IVFIndex
+
+
+class Command(BaseCommand):
+    help = 'Train the IVF face index on the current student encodings and save it next to the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--nlist', type=int, default=settings.FACE_INDEX_NLIST, help='Number of k-means clusters (default sqrt(N))')
+
+    def handle(self, *args, **options):
+        # Training happens here only: servers load the saved centroids (or scan
+        # exactly until there are some)
+        gallery = FaceGallery()
+        gallery.load()
+
+        if len(gallery.encodings) == 0:
+            self.stdout.write(self.style.WARNING('No student encodings to index.'))
+            return
+
+        index = IVFIndex(nlist=options['nlist'])
+        index.train(gallery.encodings)
+        index.save(settings.FACE_INDEX_PATH)
+        self.stdout.write(self.style.SUCCESS(
+            f'Trained {len(index.centroids)} clusters over {len(gallery.encodings)} encodings; saved to {settings.FACE_INDEX_PATH}.'
+        ))
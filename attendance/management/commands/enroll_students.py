@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from attendance.enrollment import enroll_students, rows_from_directory
+from attendance.models import Subject, Teacher
+
+
+class Command(BaseCommand):
+    help = 'Enroll every student photo in a directory, computing face encodings in parallel'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Directory of student photos')
+        parser.add_argument('--roster', help='CSV with rollno,name[,photo] columns (default: one student per photo, named after the file)')
+        parser.add_argument('--subject', action='append', default=[], help='Subject name to enroll in (repeatable)')
+        parser.add_argument('--teacher', type=int, help="Enroll in all of this teacher's subjects")
+        parser.add_argument('--workers', type=int, help='Encoding processes (default ENROLLMENT_WORKERS)')
+
+    def handle(self, *args, **options):
+        subjects = list(Subject.objects.filter(name__in=options['subject']))
+        missing = set(options['subject']) - {subject.name for subject in subjects}
+        if missing:
+            raise CommandError(f"Unknown subject(s): {', '.join(sorted(missing))}")
+        if options['teacher']:
+            teacher = Teacher.objects.filter(pk=options['teacher']).first()
+            if teacher is None:
+                raise CommandError(f"Unknown teacher id {options['teacher']}")
+            subjects += list(teacher.subjects.all())
+
+        roster = None
+        if options['roster']:
+            with open(options['roster'], newline='') as f:
+                roster = f.read()
+        try:
+            rows = rows_from_directory(options['directory'], roster)
+        except OSError as e:
+            raise CommandError(str(e))
+
+        start = time.perf_counter()
+        report = enroll_students(rows, subjects, workers=options['workers'])
+        elapsed = time.perf_counter() - start
+
+        for entry in report:
+            line = f"{entry['rollno'] or '-'}: {entry['message']}"
+            self.stdout.write(self.style.ERROR(line) if entry['status'] == 'error' else line)
+        enrolled = sum(entry['status'] == 'enrolled' for entry in report)
+        errors = sum(entry['status'] == 'error' for entry in report)
+        self.stdout.write(self.style.SUCCESS(
+            f'Enrolled {enrolled} new students ({errors} errors) in {elapsed:.1f} s.'
+        ))
@@ -0,0 +1,35 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from attendance.export import EXPORT_FORMATS, export_rows
+from attendance.management.commands.mark_absent import parse_date
+
+
+class Command(BaseCommand):
+    help = 'Stream attendance records to a CSV or XLSX file with constant memory use'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--output', help='File to write (default: stdout)')
+        parser.add_argument('--subject', help='Subject name')
+        parser.add_argument('--teacher', type=int, help='Only subjects taught by this teacher id')
+        parser.add_argument('--from', dest='from_date', type=parse_date)
+        parser.add_argument('--to', dest='to_date', type=parse_date)
+
+    def handle(self, *args, **options):
+        stream, _ = EXPORT_FORMATS[options['format']]
+        rows = export_rows(
+            subject=options['subject'],
+            teacher=options['teacher'],
+            date_from=options['from_date'],
+            date_to=options['to_date'],
+        )
+
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in stream(rows):
+                output.write(chunk)
+        finally:
+            if options['output']:
+                output.close()
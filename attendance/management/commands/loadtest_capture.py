@@ -0,0 +1,74 @@
+import http.cookiejar
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Load-test capture endpoints of a running server and compare requests/second and latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('image', help='JPEG frame to post on every request')
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--paths', nargs='+', default=['/capture/', '/capture/async/'],
+                            help='Endpoints to compare, e.g. the WSGI and ASGI capture views')
+        parser.add_argument('--teacher', help='Teacher name to log in as (needed to mark attendance)')
+        parser.add_argument('--password', default='')
+        parser.add_argument('--subject', default='')
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--requests', type=int, default=200)
+
+    def handle(self, *args, **options):
+        with open(options['image'], 'rb') as f:
+            image = f.read()
+        base_url = options['base_url'].rstrip('/')
+
+        cookies = http.cookiejar.CookieJar()
+        opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(cookies))
+        # The login page sets the CSRF cookie the capture POSTs have to echo back
+        try:
+            opener.open(base_url + '/').read()
+        except urllib.error.URLError as e:
+            raise CommandError(f'Cannot reach {base_url}: {e}')
+        csrf_token = next((c.value for c in cookies if c.name == 'csrftoken'), '')
+        if options['teacher']:
+            form = urllib.parse.urlencode({
+                'name': options['teacher'], 'password': options['password'],
+                'subject': options['subject'], 'csrfmiddlewaretoken': csrf_token,
+            }).encode()
+            opener.open(base_url + '/', form).read()
+
+        for path in options['paths']:
+            self.run_path(opener, base_url + path, image, csrf_token, options['concurrency'], options['requests'])
+
+    def run_path(self, opener, url, image, csrf_token, concurrency, total):
+        def post(_):
+            request = urllib.request.Request(url, data=image, method='POST', headers={
+                'Content-Type': 'image/jpeg', 'X-CSRFToken': csrf_token, 'Referer': url,
+            })
+            start = time.perf_counter()
+            try:
+                with opener.open(request) as response:
+                    response.read()
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                status = e.code
+            return time.perf_counter() - start, status
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(post, range(total)))
+        elapsed = time.perf_counter() - start
+
+        latencies = np.array([latency for latency, _ in results]) * 1000
+        statuses = Counter(status for _, status in results)
+        self.stdout.write(
+            f'{url}: {total / elapsed:.1f} req/s, p50 {np.percentile(latencies, 50):.0f} ms, '
+            f'p99 {np.percentile(latencies, 99):.0f} ms, statuses {dict(sorted(statuses.items()))}'
+        )
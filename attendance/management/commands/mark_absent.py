@@ -1,19 +1,85 @@
-from django.core.management.base import BaseCommand
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
 from attendance.models import Student, Attendance
-from datetime import date
+from attendance.rollups import create_attendance
+
+
+def parse_date(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"Invalid date {value!r}; expected YYYY-MM-DD.")
+
+
+def missing_enrollments(day):
+    # Anti-join: every (student, subject) enrollment without an attendance row
+    # for ``day``, computed by the database in one query.
+    recorded = Attendance.objects.filter(
+        student_id=OuterRef('student_id'), subject_id=OuterRef('subject_id'), date=day,
+    )
+    return (
+        Student.subjects.through.objects
+        .filter(~Exists(recorded))
+        .values_list('student_id', 'subject_id')
+    )
+
 
 class Command(BaseCommand):
     help = 'Mark absent for students without attendance records for the day'
-    
-    def handle(self, *args, **kwargs):
-        today = date.today()
-        students = Student.objects.all()
-        
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=parse_date, help='Day to mark (default today)')
+        parser.add_argument('--from', dest='from_date', type=parse_date, help='First day of a backfill range')
+        parser.add_argument('--to', dest='to_date', type=parse_date, help='Last day of a backfill range (default today)')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if options['date'] and (options['from_date'] or options['to_date']):
+            raise CommandError('Use either --date or --from/--to, not both.')
+        if options['from_date']:
+            first, last = options['from_date'], options['to_date'] or date.today()
+        else:
+            first = last = options['date'] or options['to_date'] or date.today()
+        if first > last:
+            raise CommandError('--from must not be after --to.')
+
+        start = time.perf_counter()
         absent_count = 0
-        for student in students:
-            if not Attendance.objects.filter(student=student, date=today).exists():
-                Attendance.objects.create(student=student, date=today, status='Absent')
-                absent_count += 1
-                
-        self.stdout.write(self.style.SUCCESS(f'Default absences marked for {absent_count} students.'))
-        
\ No newline at end of file
+        with transaction.atomic():
+            day = first
+            while day <= last:
+                absent_count += self.mark_day(day, options['batch_size'])
+                day += timedelta(days=1)
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Default absences marked for {absent_count} student-subject pairs '
+            f'from {first} to {last} ({absent_count / max(elapsed, 1e-9):.0f} rows/s).'
+        ))
+
+    def mark_day(self, day, batch_size):
+        # Each chunk is read in full before it is inserted: on SQLite, writing
+        # to Attendance while a cursor over the anti-join on it is still open
+        # has undefined results. Chunks are keyed on the enrollment row id.
+        count = 0
+        last_id = 0
+        missing = missing_enrollments(day).order_by('pk')
+        while True:
+            chunk = list(missing.filter(pk__gt=last_id).values_list('pk', 'student_id', 'subject_id')[:batch_size])
+            if not chunk:
+                return count
+            last_id = chunk[-1][0]
+            count += self.insert([
+                Attendance(student_id=student_id, subject_id=subject_id, date=day, status='Absent')
+                for _, student_id, subject_id in chunk
+            ])
+
+    def insert(self, batch):
+        # A capture racing with this command may already have marked the student
+        # present; only the rows actually inserted count (and reach the rollups)
+        return len(create_attendance(batch))
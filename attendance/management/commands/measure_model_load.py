@@ -0,0 +1,48 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+# Runs in a fresh interpreter so every measurement starts from a cold process
+PROBE = '''
+import json, os, resource, time
+start = time.perf_counter()
+import django
+django.setup()
+import attendance.views
+if {warm_up!r}:
+    from attendance.utils import warm_up
+    warm_up()
+print(json.dumps({{
+    'seconds': time.perf_counter() - start,
+    'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}}))
+'''
+
+
+class Command(BaseCommand):
+    help = 'Measure start-up time and memory of a process with lazily loaded vs. warmed-up dlib models'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=3)
+
+    def measure(self, warm_up):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'attendance_system.settings'))
+        result = subprocess.run(
+            [sys.executable, '-c', PROBE.format(warm_up=warm_up)],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        if result.returncode:
+            raise CommandError(result.stderr.strip().splitlines()[-1])
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+    def handle(self, *args, **options):
+        for label, warm_up in (('lazy (start-up only)', False), ('models loaded', True)):
+            runs = [self.measure(warm_up) for _ in range(options['runs'])]
+            seconds = min(run['seconds'] for run in runs)
+            rss = min(run['max_rss_mb'] for run in runs)
+            self.stdout.write(f'{label:>22}: {seconds:.2f} s, max RSS {rss:.0f} MB')
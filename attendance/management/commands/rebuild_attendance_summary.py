@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Min
+
+from attendance.management.commands.mark_absent import parse_date
+from attendance.models import Attendance
+from attendance.rollups import rebuild_summaries
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily and per-term attendance rollups from the Attendance table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='from_date', type=parse_date, help='First day to rebuild (default: earliest record)')
+        parser.add_argument('--to', dest='to_date', type=parse_date, help='Last day to rebuild (default: latest record)')
+
+    def handle(self, *args, **options):
+        bounds = Attendance.objects.aggregate(first=Min('date'), last=Max('date'))
+        first = options['from_date'] or bounds['first']
+        last = options['to_date'] or bounds['last']
+        if first is None or last is None:
+            self.stdout.write(self.style.WARNING('No attendance records to summarise.'))
+            return
+
+        daily, terms = rebuild_summaries(first, last)
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {daily} daily and {terms} per-term summaries from {first} to {last}.'
+        ))
@@ -0,0 +1,57 @@
+import json
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from attendance import utils
+from attendance.benchmarks import suite
+
+
+class Command(BaseCommand):
+    help = 'Run the benchmark suite, write the results as JSON and compare them with a baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('cases', nargs='*', choices=[[]] + sorted(suite.CASES), help='Cases to run (default all)')
+        parser.add_argument('--quick', action='store_true', help='Smaller data sets, for CI')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--baseline', help='Compare with the results in this JSON file')
+        parser.add_argument('--tolerance', type=float, default=0.15, help='Allowed relative regression (default 0.15)')
+        parser.add_argument('--stub-models', choices=('auto', 'yes', 'no'), default='auto',
+                            help='Use the stub face models; auto = when dlib or its model files are missing')
+
+    def handle(self, *args, **options):
+        stub = options['stub_models'] == 'yes' or (options['stub_models'] == 'auto' and not utils.dlib_models_available())
+        try:
+            setup_test_environment()  # lets the test client talk to the views
+            set_up_here = True
+        except RuntimeError:  # already set up, e.g. when called from the test runner
+            set_up_here = False
+        request_log = logging.getLogger('attendance.requests')
+        log_level = request_log.level
+        request_log.setLevel(logging.WARNING)  # one line per benchmarked capture would drown the report
+        utils._models = None
+        try:
+            with override_settings(FACE_MODELS_STUB=stub, RECOGNITION_WORKERS=0):
+                report = suite.run(options['cases'], options['quick'], progress=lambda name: self.stderr.write(f'Running {name}...'))
+        finally:
+            utils._models = None
+            request_log.setLevel(log_level)
+            if set_up_here:
+                teardown_test_environment()
+
+        self.stdout.write(json.dumps(report, indent=2))
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+                f.write('\n')
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            regressions = suite.compare(report, baseline, options['tolerance'])
+            for name, metric, old, new, change in regressions:
+                self.stderr.write(self.style.ERROR(f'{name}.{metric}: {old} -> {new} ({change:+.0%})'))
+            if regressions:
+                raise CommandError(f'{len(regressions)} metric(s) regressed by more than {options["tolerance"]:.0%}.')
+            self.stderr.write(self.style.SUCCESS('No regressions against the baseline.'))
@@ -0,0 +1,219 @@
+import asyncio
+import bisect
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger('attendance.requests')
+
+# Latency buckets in seconds, from a cached gallery lookup to a slow dlib pass
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{value}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Histogram:
+    """A Prometheus histogram with fixed buckets, kept in this process.
+
+    Observing is a bisect and a few additions under a lock, cheap enough for
+    every request. Each server process exposes its own series, so scrape every
+    process (or add a ``process`` label in the scrape config).
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)  # first bucket with value <= bound
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 3)
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        for labelvalues, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                yield f'{self.name}_bucket', self.labelnames + ('le',), labelvalues + (bound,), cumulative
+            yield f'{self.name}_sum', self.labelnames, labelvalues, series[-2]
+            yield f'{self.name}_count', self.labelnames, labelvalues, series[-1]
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for labelvalues, value in values:
+            yield self.name, self.labelnames, labelvalues, value
+
+
+class Gauge:
+    """A gauge read from ``callback`` at scrape time, so updating it costs nothing."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, callback):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+
+    def samples(self):
+        yield self.name, (), (), self.callback()
+
+
+REGISTRY = []
+
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+def render():
+    """All registered metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for name, labelnames, labelvalues, value in metric.samples():
+            lines.append(f'{name}{_labels(labelnames, labelvalues)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+STAGE_SECONDS = register(Histogram(
+    'attendance_stage_seconds', 'Time spent in each stage of the recognition pipeline.', ('stage',),
+))
+REQUEST_SECONDS = register(Histogram(
+    'attendance_request_seconds', 'End-to-end latency of the capture views.', ('view', 'status'),
+))
+CAPTURES = register(Counter(
+    'attendance_captures_total', 'Capture requests by view and HTTP status.', ('view', 'status'),
+))
+
+
+# Stage timings of the request being handled. Views start a trace; stages
+# record into it and the totals are observed once when the request ends.
+_trace = contextvars.ContextVar('attendance_trace', default=None)
+
+
+def record_stage(name, seconds):
+    trace = _trace.get()
+    if trace is None:
+        STAGE_SECONDS.observe(seconds, name)
+    else:
+        trace[name] = trace.get(name, 0.0) + seconds
+
+
+def record_stages(stages):
+    for name, seconds in stages.items():
+        record_stage(name, seconds)
+
+
+@contextlib.contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def collect_stages(fn, *args):
+    """Call ``fn(*args)`` in a fresh trace and return (result, stage timings).
+
+    Used by the recognition pool so timings taken in a worker process travel
+    back with the result.
+    """
+    token = _trace.set({})
+    try:
+        result = fn(*args)
+        return result, _trace.get()
+    finally:
+        _trace.reset(token)
+
+
+def _finish(view, start, stages, status):
+    total = time.perf_counter() - start
+    for name, seconds in stages.items():
+        STAGE_SECONDS.observe(seconds, name)
+    REQUEST_SECONDS.observe(total, view, str(status))
+    CAPTURES.inc(view, str(status))
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps({
+            'event': 'capture',
+            'view': view,
+            'status': status,
+            'total_ms': round(total * 1000, 2),
+            'stages_ms': {name: round(seconds * 1000, 2) for name, seconds in stages.items()},
+        }))
+
+
+def instrumented(view_func):
+    """Time a capture view: per-stage histograms, a request histogram and one JSON log line."""
+    view = view_func.__name__
+
+    if asyncio.iscoroutinefunction(view_func):
+        @functools.wraps(view_func)
+        async def wrapper(request, *args, **kwargs):
+            stages = {}
+            token = _trace.set(stages)
+            start = time.perf_counter()
+            status = 500
+            try:
+                response = await view_func(request, *args, **kwargs)
+                status = response.status_code
+                return response
+            finally:
+                _trace.reset(token)
+                _finish(view, start, stages, status)
+    else:
+        @functools.wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            stages = {}
+            token = _trace.set(stages)
+            start = time.perf_counter()
+            status = 500
+            try:
+                response = view_func(request, *args, **kwargs)
+                status = response.status_code
+                return response
+            finally:
+                _trace.reset(token)
+                _finish(view, start, stages, status)
+    return wrapper
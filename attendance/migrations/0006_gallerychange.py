@@ -0,0 +1,21 @@
+# Generated by Django 5.1.3 on 2026-10-18 03:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0005_alter_attendance_subject'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GalleryChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('student_id', models.BigIntegerField()),
+                ('changed_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
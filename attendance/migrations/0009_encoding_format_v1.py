@@ -0,0 +1,53 @@
+import struct
+
+import numpy as np
+from django.db import migrations
+
+
+# Frozen copy of the version 1 layout (see attendance.gallery), so this
+# migration keeps working if the format evolves.
+HEADER = struct.Struct('<2sBBHBxf')
+DIM = 128
+FLOAT32_SIZE = HEADER.size + DIM * 4
+LEGACY_SIZE = DIM * 8
+
+
+def to_v1(apps, schema_editor):
+    Student = apps.get_model('attendance', 'Student')
+    converted = []
+    for student in Student.objects.only('id', 'facial_encoding').iterator(chunk_size=1000):
+        blob = bytes(student.facial_encoding or b'')
+        if len(blob) != LEGACY_SIZE:
+            continue
+        encoding = np.frombuffer(blob, dtype=np.float64).astype('<f4')
+        student.facial_encoding = HEADER.pack(b'FE', 1, 1, DIM, 1, 1.0) + encoding.tobytes()
+        converted.append(student)
+    Student.objects.bulk_update(converted, ['facial_encoding'], batch_size=1000)
+
+
+def to_legacy(apps, schema_editor):
+    Student = apps.get_model('attendance', 'Student')
+    converted = []
+    for student in Student.objects.only('id', 'facial_encoding').iterator(chunk_size=1000):
+        blob = bytes(student.facial_encoding or b'')
+        if len(blob) < HEADER.size or blob[:2] != b'FE':
+            continue
+        _, _, kind, dim, _, scale = HEADER.unpack_from(blob)
+        if kind == 1:
+            encoding = np.frombuffer(blob, dtype='<f4', count=dim, offset=HEADER.size)
+        else:
+            encoding = np.frombuffer(blob, dtype=np.int8, count=dim, offset=HEADER.size) * scale
+        student.facial_encoding = encoding.astype(np.float64).tobytes()
+        converted.append(student)
+    Student.objects.bulk_update(converted, ['facial_encoding'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0008_attendance_summaries'),
+    ]
+
+    operations = [
+        migrations.RunPython(to_v1, to_legacy),
+    ]
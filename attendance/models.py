@@ -38,6 +38,56 @@ class Attendance(models.Model):
     class Meta:
         unique_together = ('student', 'subject', 'date')
         ordering = ['-date']
+        indexes = [
+            # Per-subject history, newest first (attendance by subject)
+            models.Index(fields=['subject', 'date'], name='attendance_subject_date_idx'),
+            # Per-student history across subjects (view_attendance)
+            models.Index(fields=['student', 'date'], name='attendance_student_date_idx'),
+            # Covers present/absent counts per day and subject without touching the table
+            models.Index(fields=['date', 'subject', 'status'], name='attendance_report_idx'),
+        ]
 
     def __str__(self):
         return f"{self.student.name} - {self.subject.name} - {self.date} - {self.status}"
+
+
+class DailyAttendanceSummary(models.Model):
+    # Present/absent totals per subject per day, kept up to date as attendance
+    # is marked so dashboards read one row per day instead of every record.
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE, related_name='daily_summaries')
+    date = models.DateField()
+    present = models.PositiveIntegerField(default=0)
+    absent = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('subject', 'date')
+        ordering = ['-date']
+
+    def __str__(self):
+        return f"{self.subject_id} - {self.date} - {self.present}/{self.present + self.absent}"
+
+
+class StudentTermSummary(models.Model):
+    # Present/absent totals per student per subject for one term
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='term_summaries')
+    subject = models.ForeignKey(Subject, on_delete=models.CASCADE, related_name='term_summaries')
+    term_start = models.DateField()
+    present = models.PositiveIntegerField(default=0)
+    absent = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('student', 'subject', 'term_start')
+
+    def __str__(self):
+        return f"{self.student_id} - {self.subject_id} - {self.term_start} - {self.present}/{self.present + self.absent}"
+
+
+class GalleryChange(models.Model):
+    # Append-only log of students whose encoding or enrollment changed. The
+    # latest id acts as the gallery version: each process replays the entries
+    # it has not seen yet instead of reloading every student.
+    student_id = models.BigIntegerField()
+    changed_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"#{self.id} student {self.student_id}"
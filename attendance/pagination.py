@@ -0,0 +1,71 @@
+import base64
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(record):
+    raw = f"{record.date.isoformat()}|{record.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        day, pk = raw.split('|')
+        return date.fromisoformat(day), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidCursor(f"Invalid cursor {cursor!r}")
+
+
+def parse_date(value):
+    try:
+        return date.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+
+def history_window(params):
+    """Return the (from, to) dates requested in ``params``.
+
+    Without an explicit start the window covers the last
+    ATTENDANCE_HISTORY_DAYS days, so a plain page load never reads a whole
+    term of rows.
+    """
+    date_to = parse_date(params.get('to'))
+    date_from = parse_date(params.get('from'))
+    if date_from is None:
+        date_from = (date_to or date.today()) - timedelta(days=settings.ATTENDANCE_HISTORY_DAYS)
+    return date_from, date_to
+
+
+def keyset_page(queryset, cursor=None, page_size=None):
+    """Return (records, next_cursor) for one page, newest first.
+
+    Seeks past the (date, id) of the last row of the previous page instead of
+    using OFFSET, so every page costs the same however deep it is.
+    """
+    page_size = page_size or settings.ATTENDANCE_PAGE_SIZE
+    queryset = queryset.order_by('-date', '-id')
+    if cursor:
+        day, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(date__lt=day) | Q(date=day, id__lt=pk))
+
+    records = list(queryset[:page_size + 1])
+    if len(records) <= page_size:
+        return records, None
+    records = records[:page_size]
+    return records, encode_cursor(records[-1])
+
+
+def filter_window(queryset, date_from, date_to):
+    if date_from:
+        queryset = queryset.filter(date__gte=date_from)
+    if date_to:
+        queryset = queryset.filter(date__lte=date_to)
+    return queryset
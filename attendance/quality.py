@@ -0,0 +1,132 @@
+"""Cheap checks that turn away faces not worth describing.
+
+The ResNet descriptor is by far the most expensive stage of recognition, and
+a tiny, blurred, badly lit or turned-away face gives a descriptor that either
+matches nobody or, worse, sits near the threshold of a wrong student. These
+checks run between detection and the descriptor: size, brightness and blur
+need only the detection box; head pose needs the 68 landmarks, which are
+computed for the descriptor anyway.
+"""
+from collections import namedtuple
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+from .metrics import Counter, register
+
+
+FACE_QUALITY = register(Counter(
+    'attendance_face_quality_total', 'Detected faces by quality check result (accepted or the rejection reason).', ('result',),
+))
+
+MESSAGES = {
+    'too_small': "Face too small. Please move closer to the camera.",
+    'too_dark': "Face too dark. Please improve the lighting.",
+    'too_bright': "Face overexposed. Please avoid direct light.",
+    'blurry': "Image too blurry. Please hold still.",
+    'off_angle': "Please look straight at the camera.",
+}
+
+SHARPNESS_SIZE = 96  # faces are scaled to this before measuring blur, so the threshold is size-independent
+
+# A generic head in camera coordinates (x right, y down, z away from the
+# camera; arbitrary units, nose tip at the origin) and the 68-point landmarks
+# they correspond to
+MODEL_POINTS = np.array([
+    (0.0, 0.0, 0.0),  # 30: nose tip
+    (0.0, 330.0, 65.0),  # 8: chin
+    (-225.0, -170.0, 135.0),  # 36: outer corner of the eye on the image's left
+    (225.0, -170.0, 135.0),  # 45: outer corner of the other eye
+    (-150.0, 150.0, 125.0),  # 48: mouth corner on the image's left
+    (150.0, 150.0, 125.0),  # 54: other mouth corner
+])
+MODEL_LANDMARKS = (30, 8, 36, 45, 48, 54)
+
+
+class RejectedFace(namedtuple('RejectedFace', 'reason')):
+    """Returned in place of an encoding for a face that failed a quality check."""
+
+    __slots__ = ()
+
+    @property
+    def message(self):
+        return MESSAGES[self.reason]
+
+
+def check_face(gray, face):
+    """Size, brightness and blur checks on a detected face; returns a rejection reason or None."""
+    if not settings.FACE_QUALITY_CHECKS:
+        return None
+    height, width = gray.shape[:2]
+    if min(face.right() - face.left(), face.bottom() - face.top()) < min_face_size(width):
+        return 'too_small'
+
+    crop = gray[max(0, face.top()):min(height, face.bottom()), max(0, face.left()):min(width, face.right())]
+    if not crop.size:
+        return 'too_small'
+    low, high = settings.FACE_QUALITY_BRIGHTNESS
+    brightness = crop.mean()
+    if brightness < low:
+        return 'too_dark'
+    if brightness > high:
+        return 'too_bright'
+    if sharpness(crop) < settings.FACE_QUALITY_MIN_SHARPNESS:
+        return 'blurry'
+    return None
+
+
+def min_face_size(width):
+    """FACE_QUALITY_MIN_SIZE for a frame ``width`` px wide.
+
+    Scaled down for frames narrower than FACE_QUALITY_REFERENCE_WIDTH, but
+    never up: a face in a large classroom photo has enough pixels at 60 px.
+    """
+    return settings.FACE_QUALITY_MIN_SIZE * min(1, width / settings.FACE_QUALITY_REFERENCE_WIDTH)
+
+
+def sharpness(crop):
+    """Variance of the Laplacian: low when the face has no crisp edges."""
+    crop = cv2.resize(crop, (SHARPNESS_SIZE, SHARPNESS_SIZE), interpolation=cv2.INTER_AREA)
+    return cv2.Laplacian(crop, cv2.CV_64F).var()
+
+
+def head_pose(shape, image_shape):
+    """(yaw, pitch) of the head in degrees from 68-point landmarks; 0, 0 is facing the camera."""
+    height, width = image_shape[:2]
+    image_points = np.array([(shape.part(i).x, shape.part(i).y) for i in MODEL_LANDMARKS], dtype=np.float64)
+    camera = np.array([[width, 0, width / 2], [0, width, height / 2], [0, 0, 1]], dtype=np.float64)
+    ok, rotation, _ = cv2.solvePnP(MODEL_POINTS, image_points, camera, None)
+    if not ok:
+        return None
+    angles = cv2.RQDecomp3x3(cv2.Rodrigues(rotation)[0])[0]
+    return angles[1], angles[0]
+
+
+def check_pose(shape, image_shape):
+    """Head pose check; returns 'off_angle' or None.
+
+    Skipped for shapes without the 68 landmarks (e.g. the stub models).
+    """
+    if not settings.FACE_QUALITY_CHECKS or getattr(shape, 'num_parts', 0) != 68:
+        return None
+    pose = head_pose(shape, image_shape)
+    if pose is None:
+        return None
+    yaw, pitch = pose
+    if abs(yaw) > settings.FACE_QUALITY_MAX_YAW or abs(pitch) > settings.FACE_QUALITY_MAX_PITCH:
+        return 'off_angle'
+    return None
+
+
+def record_results(result):
+    """Count the faces in a recognition result (an encoding, a RejectedFace, None, or a list of (box, either))."""
+    if result is None:
+        return
+    if isinstance(result, list):
+        for _, encoding in result:
+            record_results(encoding)
+    elif isinstance(result, RejectedFace):
+        FACE_QUALITY.inc(result.reason)
+    else:
+        FACE_QUALITY.inc('accepted')
@@ -0,0 +1,142 @@
+import asyncio
+import concurrent.futures
+import os
+import threading
+import time
+
+from .metrics import Gauge, collect_stages, record_stages, register
+
+
+class RecognitionBusy(Exception):
+    """Every worker is busy and the submission queue is full."""
+
+
+class RecognitionTimeout(Exception):
+    """A recognition job did not finish within its deadline."""
+
+
+def _init_worker():
+    # Runs once in each worker process: make sure Django is configured (spawned
+    # workers start from scratch) and load the dlib models before the first job.
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'attendance_system.settings')
+    import django
+    django.setup()
+    from .utils import warm_up
+    warm_up()
+
+
+def _traced(fn, submitted_at, *args):
+    # Runs where the job runs (possibly a worker process): the stage timings
+    # are returned with the result so the request that submitted it sees them
+    queue_wait = time.time() - submitted_at
+    result, stages = collect_stages(fn, *args)
+    stages['queue_wait'] = queue_wait
+    return result, stages
+
+
+class RecognitionPool:
+    """Runs dlib work off the request thread in a bounded process pool.
+
+    At most ``workers + queue_size`` jobs are admitted at once; further
+    submissions fail fast with ``RecognitionBusy`` instead of piling up behind
+    the workers. With ``workers=0`` jobs run inline on the calling thread.
+    """
+
+    def __init__(self, workers, queue_size, timeout):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.pending = 0  # jobs admitted and not yet finished (running or queued)
+        self._lock = threading.Lock()
+        self._executor = None
+        if workers:
+            self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+
+    def has_room(self):
+        """Whether a submission would be admitted right now."""
+        return self._executor is None or self.pending < self.workers + self.queue_size
+
+    def submit(self, fn, *args):
+        if self._executor is None:
+            future = concurrent.futures.Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        with self._lock:
+            if self.pending >= self.workers + self.queue_size:
+                raise RecognitionBusy()
+            self.pending += 1
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, future=None):
+        with self._lock:
+            self.pending -= 1
+
+    def run(self, fn, *args, timeout=None):
+        """Submit ``fn(*args)`` and wait for its result."""
+        future = self.submit(_traced, fn, time.time(), *args)
+        try:
+            result, stages = future.result(timeout=self.timeout if timeout is None else timeout)
+        except concurrent.futures.TimeoutError:
+            # Drops the job if it is still queued; a running job finishes in the
+            # background but its slot stays taken until then.
+            future.cancel()
+            raise RecognitionTimeout()
+        record_stages(stages)
+        return result
+
+    async def arun(self, fn, *args, timeout=None):
+        """Async counterpart of ``run`` that never blocks the event loop."""
+        if self._executor is None:
+            # No worker processes: keep the CPU-bound call off the loop thread
+            future = asyncio.ensure_future(asyncio.to_thread(_traced, fn, time.time(), *args))
+        else:
+            future = asyncio.wrap_future(self.submit(_traced, fn, time.time(), *args))
+        try:
+            result, stages = await asyncio.wait_for(future, self.timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            raise RecognitionTimeout()
+        record_stages(stages)
+        return result
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_recognition_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                from django.conf import settings
+
+                _pool = RecognitionPool(
+                    settings.RECOGNITION_WORKERS,
+                    settings.RECOGNITION_QUEUE_SIZE,
+                    settings.RECOGNITION_TIMEOUT,
+                )
+    return _pool
+
+
+register(Gauge(
+    'attendance_recognition_pending', 'Recognition jobs running or queued in the worker pool.',
+    lambda: _pool.pending if _pool is not None else 0,
+))
+register(Gauge(
+    'attendance_recognition_workers', 'Recognition worker processes (0 = inline).',
+    lambda: _pool.workers if _pool is not None else 0,
+))
@@ -0,0 +1,138 @@
+from collections import defaultdict
+from datetime import date
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, Q
+
+from .models import Attendance, DailyAttendanceSummary, StudentTermSummary
+
+
+def term_start(day):
+    """First day of the term ``day`` falls in (terms start on ATTENDANCE_TERM_START_MONTHS)."""
+    months = sorted(settings.ATTENDANCE_TERM_START_MONTHS)
+    started = [month for month in months if month <= day.month]
+    if not started:
+        return date(day.year - 1, months[-1], 1)
+    return date(day.year, started[-1], 1)
+
+
+def term_end(start):
+    months = sorted(settings.ATTENDANCE_TERM_START_MONTHS)
+    later = [month for month in months if month > start.month]
+    if later:
+        return date(start.year, later[0], 1)
+    return date(start.year + 1, months[0], 1)
+
+
+def _increment(model, group_fields, member_field, counts):
+    """Add ``counts`` ({(*group, member): [present, absent]}) to the rollup rows.
+
+    Missing rows are created empty first; the additions are then applied with
+    F() expressions, one UPDATE per group and delta, so concurrent markers
+    never overwrite each other and a batch of N rows costs a handful of queries.
+    """
+    if not counts:
+        return
+    fields = group_fields + (member_field,)
+    model.objects.bulk_create(
+        [model(**dict(zip(fields, key))) for key in counts],
+        ignore_conflicts=True,
+    )
+
+    updates = defaultdict(list)
+    for key, (present, absent) in counts.items():
+        updates[key[:-1], present, absent].append(key[-1])
+    for (group, present, absent), members in updates.items():
+        model.objects.filter(**dict(zip(group_fields, group)), **{f'{member_field}__in': members}).update(
+            present=F('present') + present, absent=F('absent') + absent,
+        )
+
+
+def record_attendance(records):
+    """Fold newly created Attendance rows into the daily and per-term rollups."""
+    daily = defaultdict(lambda: [0, 0])
+    per_student = defaultdict(lambda: [0, 0])
+    for record in records:
+        column = 0 if record.status == 'Present' else 1
+        daily[record.date, record.subject_id][column] += 1
+        per_student[record.subject_id, term_start(record.date), record.student_id][column] += 1
+
+    with transaction.atomic():
+        _increment(DailyAttendanceSummary, ('date',), 'subject_id', daily)
+        _increment(StudentTermSummary, ('subject_id', 'term_start'), 'student_id', per_student)
+
+
+def create_attendance(records, batch_size=500):
+    """Insert Attendance rows, skipping any that already exist, and fold the new ones into the rollups.
+
+    Returns the rows actually inserted. ``INSERT ... ON CONFLICT DO NOTHING
+    RETURNING`` (PostgreSQL, SQLite 3.35+) reports exactly the rows this
+    statement wrote, so a row that a concurrent capture inserted first is
+    neither duplicated nor counted twice.
+    """
+    meta = Attendance._meta
+    date_field = meta.get_field('date')
+    columns = ('student_id', 'subject_id', 'date', 'status')
+    quote = connection.ops.quote_name
+    pending = {(record.student_id, record.subject_id, record.date): record for record in records}
+    inserted = []
+    with transaction.atomic():
+        records = list(pending.values())
+        for i in range(0, len(records), batch_size):
+            batch = records[i:i + batch_size]
+            sql = 'INSERT INTO {} ({}) VALUES {} ON CONFLICT DO NOTHING RETURNING {}, {}, {}, {}'.format(
+                quote(meta.db_table), ', '.join(map(quote, columns)), ', '.join(['(%s, %s, %s, %s)'] * len(batch)),
+                quote(meta.pk.column), quote('student_id'), quote('subject_id'), quote('date'),
+            )
+            params = []
+            for record in batch:
+                params += [record.student_id, record.subject_id, connection.ops.adapt_datefield_value(record.date), record.status]
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                rows = cursor.fetchall()
+            for pk, student_id, subject_id, day in rows:
+                record = pending[student_id, subject_id, date_field.to_python(day)]
+                record.pk = pk
+                inserted.append(record)
+        record_attendance(inserted)
+    return inserted
+
+
+def status_counts():
+    return {
+        'present': Count('id', filter=Q(status='Present')),
+        'absent': Count('id', filter=Q(status='Absent')),
+    }
+
+
+@transaction.atomic
+def rebuild_summaries(date_from, date_to):
+    """Recompute the rollups from the Attendance table.
+
+    Daily rows are rebuilt for exactly ``date_from``..``date_to``; term rows
+    for every term overlapping that range, in full.
+    """
+    DailyAttendanceSummary.objects.filter(date__range=(date_from, date_to)).delete()
+    daily = (
+        Attendance.objects.filter(date__range=(date_from, date_to))
+        .order_by().values('subject_id', 'date').annotate(**status_counts())
+    )
+    daily_rows = DailyAttendanceSummary.objects.bulk_create(
+        [DailyAttendanceSummary(**row) for row in daily.iterator()], batch_size=1000,
+    )
+
+    term_rows = []
+    start = term_start(date_from)
+    while start <= date_to:
+        end = term_end(start)
+        StudentTermSummary.objects.filter(term_start=start).delete()
+        per_student = (
+            Attendance.objects.filter(date__gte=start, date__lt=end)
+            .order_by().values('student_id', 'subject_id').annotate(**status_counts())
+        )
+        term_rows += StudentTermSummary.objects.bulk_create(
+            [StudentTermSummary(term_start=start, **row) for row in per_student.iterator()], batch_size=1000,
+        )
+        start = end
+    return len(daily_rows), len(term_rows)
@@ -0,0 +1,33 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .models import GalleryChange, Student
+
+
+def log_gallery_change(student_ids):
+    GalleryChange.objects.bulk_create([GalleryChange(student_id=student_id) for student_id in student_ids])
+
+
+@receiver(post_save, sender=Student)
+def student_saved(sender, instance, raw=False, **kwargs):
+    if raw:  # loaddata; the gallery is rebuilt on the next full load
+        return
+    log_gallery_change([instance.pk])
+
+
+@receiver(post_delete, sender=Student)
+def student_deleted(sender, instance, **kwargs):
+    log_gallery_change([instance.pk])
+
+
+@receiver(m2m_changed, sender=Student.subjects.through)
+def student_subjects_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            log_gallery_change([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        # subject.students.add(...): pk_set holds the affected students
+        log_gallery_change(pk_set)
+    elif action == 'pre_clear':
+        # pk_set is not provided for clear(), so collect the students before they are detached
+        log_gallery_change(instance.students.values_list('pk', flat=True))
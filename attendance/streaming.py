@@ -0,0 +1,339 @@
+import asyncio
+import json
+import logging
+from datetime import date
+from http.cookies import SimpleCookie
+from importlib import import_module
+from urllib.parse import urlsplit
+
+import cv2
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .metrics import Counter, Gauge, register, stage
+from .quality import FACE_QUALITY, MESSAGES, check_face, check_pose
+from .recognition import get_recognition_pool
+from .utils import detect_faces, get_models
+
+
+logger = logging.getLogger(__name__)
+
+STREAM_PATH = '/ws/capture/'
+
+STREAM_FRAMES = register(Counter(
+    'attendance_stream_frames_total', 'Frames received on capture streams, by result (processed/dropped).', ('result',),
+))
+_active_streams = 0
+register(Gauge('attendance_streams_active', 'Open capture streams.', lambda: _active_streams))
+
+
+def box_tuple(rect):
+    return (round(rect.left()), round(rect.top()), round(rect.right()), round(rect.bottom()))
+
+
+def overlap(a, b):
+    # Intersection over union of two (left, top, right, bottom) boxes
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union
+
+
+class Track:
+    """One person followed across frames of a stream."""
+
+    def __init__(self, track_id, tracker, box):
+        self.id = track_id
+        self.tracker = tracker
+        self.box = box
+        self.encoding = None
+        self.student_id = None
+        self.name = None
+        self.status = 'pending'  # then 'marked', 'already_marked' or 'unknown'
+
+    def as_dict(self):
+        return {
+            'track': self.id,
+            'box': dict(zip(('left', 'top', 'right', 'bottom'), self.box)),
+            'name': self.name,
+            'status': self.status,
+        }
+
+
+class StreamProcessor:
+    """Finds and follows the faces in one video stream.
+
+    The HOG detector runs on every ``detect_every``-th frame only; in between,
+    each face is followed by a correlation tracker, which costs a fraction of
+    a detection. A face gets its descriptor computed once, when its track is
+    created. Not thread-safe: feed it one frame at a time.
+    """
+
+    def __init__(self, detect_every=None, min_confidence=None, min_overlap=0.3):
+        self.detect_every = detect_every or settings.STREAM_DETECT_EVERY
+        self.min_confidence = settings.STREAM_TRACK_MIN_CONFIDENCE if min_confidence is None else min_confidence
+        self.min_overlap = min_overlap
+        self.models = get_models()
+        self.tracks = []
+        self.frames = 0
+        self.descriptors = 0
+        self.rejected = {}  # quality rejection reason -> faces
+        self.last_rejected = []  # reasons for the faces turned away at the latest detection
+        self._next_id = 1
+
+    def process(self, frame):
+        """Update the tracks with ``frame``; return the tracks created by it (still to be identified)."""
+        with stage('grayscale'):
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if self.frames % self.detect_every == 0:
+            new_tracks = self._detect(frame, gray)
+        else:
+            self._follow(gray)
+            new_tracks = []
+        self.frames += 1
+        return new_tracks
+
+    def process_jpeg(self, data):
+        with stage('imdecode'):
+            frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            raise ValueError("Could not decode the frame.")
+        return self.process(frame)
+
+    def _start_tracker(self, gray, face):
+        tracker = self.models.correlation_tracker()
+        tracker.start_track(gray, face)
+        return tracker
+
+    def _follow(self, gray):
+        with stage('track'):
+            kept = []
+            for track in self.tracks:
+                if track.tracker.update(gray) >= self.min_confidence:
+                    track.box = box_tuple(track.tracker.get_position())
+                    kept.append(track)
+            self.tracks = kept
+
+    def _detect(self, frame, gray):
+        faces = detect_faces(gray)
+        boxes = [box_tuple(face) for face in faces]
+
+        # Greedily pair detections with the tracks they overlap most; paired
+        # tracks are re-anchored on the detection, the rest have left the frame
+        pairs = sorted(
+            ((overlap(track.box, box), t, d) for t, track in enumerate(self.tracks) for d, box in enumerate(boxes)),
+            reverse=True,
+        )
+        matched_tracks, matched_faces = {}, set()
+        for score, t, d in pairs:
+            if score < self.min_overlap:
+                break
+            if t in matched_tracks or d in matched_faces:
+                continue
+            matched_tracks[t] = d
+            matched_faces.add(d)
+
+        kept = []
+        for t, track in enumerate(self.tracks):
+            if t in matched_tracks:
+                face = faces[matched_tracks[t]]
+                track.tracker = self._start_tracker(gray, face)
+                track.box = boxes[matched_tracks[t]]
+                kept.append(track)
+
+        # Faces that fail the quality checks are not tracked, so they are
+        # looked at again on the next detection frame
+        new_tracks = []
+        self.last_rejected = []
+        shapes = self.models.full_object_detections()
+        for d, face in enumerate(faces):
+            if d in matched_faces:
+                continue
+            with stage('quality'):
+                reason = check_face(gray, face)
+            if not reason:
+                with stage('landmarks'):
+                    shape = self.models.predictor(gray, face)
+                with stage('quality'):
+                    reason = check_pose(shape, gray.shape)
+            if reason:
+                self.rejected[reason] = self.rejected.get(reason, 0) + 1
+                self.last_rejected.append(reason)
+                FACE_QUALITY.inc(reason)
+                continue
+            FACE_QUALITY.inc('accepted')
+            track = Track(self._next_id, self._start_tracker(gray, face), boxes[d])
+            self._next_id += 1
+            new_tracks.append((track, face))
+            shapes.append(shape)
+        if new_tracks:
+            # One batched descriptor call for every face that appeared in this frame
+            with stage('descriptor'):
+                descriptors = self.models.face_rec_model.compute_face_descriptor(frame, shapes)
+            for (track, _), descriptor in zip(new_tracks, descriptors):
+                track.encoding = np.array(descriptor)
+            self.descriptors += len(new_tracks)
+
+        self.tracks = kept + [track for track, _ in new_tracks]
+        return [track for track, _ in new_tracks]
+
+
+def identify_tracks(tracks, subject):
+    """Match new tracks against the subject's students and mark the recognised ones present."""
+    from .gallery import get_gallery
+    from .models import Student
+    from .views import mark_present
+
+    with stage('gallery_match'):
+        student_ids, _ = get_gallery().match_many([track.encoding for track in tracks], subject_id=subject.id)
+    matched_ids = {student_id for student_id in student_ids if student_id is not None}
+    names = dict(Student.objects.filter(pk__in=matched_ids).values_list('id', 'name'))
+    marked = mark_present(matched_ids, subject, date.today())
+    for track, student_id in zip(tracks, student_ids):
+        track.student_id = student_id
+        track.name = names.get(student_id)
+        if student_id is None:
+            track.status = 'unknown'
+        else:
+            track.status = 'marked' if student_id in marked else 'already_marked'
+
+
+def session_subject(scope):
+    # The WebSocket handshake carries the browser's session cookie
+    from .models import Subject
+
+    cookies = SimpleCookie()
+    for name, value in scope.get('headers', ()):
+        if name == b'cookie':
+            cookies.load(value.decode('latin-1'))
+    morsel = cookies.get(settings.SESSION_COOKIE_NAME)
+    if morsel is None:
+        return None
+    session = import_module(settings.SESSION_ENGINE).SessionStore(morsel.value)
+    name = session.get('subject')
+    return Subject.objects.filter(name=name).first() if name else None
+
+
+def same_origin(scope):
+    # Browsers send Origin on WebSocket handshakes; refuse pages from other
+    # sites riding on the teacher's session cookie
+    headers = dict(scope.get('headers', ()))
+    origin = headers.get(b'origin')
+    if origin is None:
+        return True
+    return urlsplit(origin.decode('latin-1')).netloc == headers.get(b'host', b'').decode('latin-1')
+
+
+class CaptureStream:
+    """One WebSocket connection: binary JPEG frames in, a JSON message per processed frame out.
+
+    Frames are never queued. While a frame is being processed only the newest
+    arrival is kept and older ones are dropped, so a slow server falls back to
+    a lower frame rate instead of an ever-growing delay. Frames are dropped as
+    well while the recognition pool is full: the stream's own work doesn't go
+    through the pool, but it competes with it for the same CPUs.
+    """
+
+    def __init__(self, receive, send, subject, processor, pool=None):
+        self.receive = receive
+        self.send = send
+        self.subject = subject
+        self.processor = processor
+        self.pool = pool or get_recognition_pool()
+        self.received = 0
+        self.dropped = 0
+        self._latest = None
+        self._ready = asyncio.Event()
+        self._closed = False
+
+    async def run(self):
+        reader = asyncio.ensure_future(self._read())
+        worker = asyncio.ensure_future(self._work())
+        # Ends when the client disconnects, or early if processing fails
+        await asyncio.wait((reader, worker), return_when=asyncio.FIRST_COMPLETED)
+        self._closed = True
+        self._ready.set()
+        reader.cancel()
+        await worker
+
+    async def _read(self):
+        while True:
+            message = await self.receive()
+            if message['type'] == 'websocket.disconnect':
+                return
+            data = message.get('bytes')
+            if not data:
+                continue
+            self.received += 1
+            if self._latest is not None:
+                self.dropped += 1
+                STREAM_FRAMES.inc('dropped')
+            self._latest = data
+            self._ready.set()
+
+    async def _work(self):
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            if self._closed:
+                return
+            data, self._latest = self._latest, None
+            if data is None:
+                continue
+            if not self.pool.has_room():
+                self.dropped += 1
+                STREAM_FRAMES.inc('dropped')
+                continue
+            try:
+                new_tracks = await asyncio.to_thread(self.processor.process_jpeg, data)
+                if new_tracks:
+                    await sync_to_async(identify_tracks)(new_tracks, self.subject)
+            except ValueError as e:
+                await self.send_json({'error': str(e)})
+                continue
+            STREAM_FRAMES.inc('processed')
+            await self.send_json({
+                'frame': self.processor.frames,
+                'dropped': self.dropped,
+                'faces': [track.as_dict() for track in self.processor.tracks],
+                'rejected': [{'reason': reason, 'message': MESSAGES[reason]} for reason in self.processor.last_rejected],
+            })
+
+    async def send_json(self, data):
+        if not self._closed:
+            await self.send({'type': 'websocket.send', 'text': json.dumps(data)})
+
+
+async def capture_stream(scope, receive, send):
+    """ASGI application for STREAM_PATH (see attendance_system.asgi)."""
+    global _active_streams
+
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+    subject = await sync_to_async(session_subject)(scope) if same_origin(scope) else None
+    if subject is None:
+        # 4403: not logged in with a subject, or another site's page
+        await send({'type': 'websocket.close', 'code': 4403})
+        return
+    if _active_streams >= settings.STREAM_MAX_ACTIVE:
+        # Accepted first so the browser sees the code (a refused handshake is just 1006)
+        await send({'type': 'websocket.accept'})
+        await send({'type': 'websocket.close', 'code': 1013})
+        return
+
+    _active_streams += 1
+    try:
+        # Loading the models on a cold worker takes seconds: not on the loop
+        processor = await asyncio.to_thread(StreamProcessor)
+        await send({'type': 'websocket.accept'})
+        await CaptureStream(receive, send, subject, processor).run()
+    except Exception:
+        logger.exception("Capture stream failed")
+        await send({'type': 'websocket.close', 'code': 1011})
+    finally:
+        _active_streams -= 1
@@ -0,0 +1,138 @@
+"""CPU-cheap stand-ins for the dlib models, for benchmarks and tests.
+
+Enabled with FACE_MODELS_STUB when dlib or its .dat model files are not
+available. The stubs keep the dlib interfaces the pipeline uses but are
+deterministic image functions, not face recognition:
+
+* the detector returns the bounding box of each bright blob (pixels above
+  DETECTION_LEVEL on a dark background) of at least MIN_FACE_SIZE pixels;
+* the descriptor of a box is its area-averaged 16 x 8 thumbnail, centred and
+  scaled to unit length, so the same patch gives (nearly) the same descriptor
+  and different random patches are far apart;
+* the correlation tracker finds the box's template again with normalised
+  cross-correlation in a window around its last position.
+
+``attendance.benchmarks.fixtures.face_patch`` draws patches that survive
+JPEG compression well enough to be recognised again.
+"""
+import cv2
+import numpy as np
+
+
+DETECTION_LEVEL = 16
+MIN_FACE_SIZE = 20
+DESCRIPTOR_SHAPE = (16, 8)  # rows, columns: 128 values
+
+
+class rectangle:
+    def __init__(self, left, top, right, bottom):
+        self._box = (int(left), int(top), int(right), int(bottom))
+
+    def left(self):
+        return self._box[0]
+
+    def top(self):
+        return self._box[1]
+
+    def right(self):
+        return self._box[2]
+
+    def bottom(self):
+        return self._box[3]
+
+    def width(self):
+        return self._box[2] - self._box[0]
+
+    def height(self):
+        return self._box[3] - self._box[1]
+
+    def __eq__(self, other):
+        return isinstance(other, rectangle) and self._box == other._box
+
+    def __repr__(self):
+        return 'rectangle({}, {}, {}, {})'.format(*self._box)
+
+
+class full_object_detections(list):
+    pass
+
+
+def _grey(image):
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+
+class correlation_tracker:
+    SEARCH_MARGIN = 0.5  # search this fraction of the box size around the last position
+
+    def start_track(self, image, rect):
+        grey = _grey(image)
+        height, width = grey.shape
+        left, top = max(0, rect.left()), max(0, rect.top())
+        right, bottom = min(width, rect.right()), min(height, rect.bottom())
+        self._box = (left, top, right, bottom)
+        self._template = grey[top:bottom, left:right].copy()
+
+    def update(self, image):
+        """Move the box to the best match; returns a confidence on roughly dlib's PSR scale."""
+        grey = _grey(image)
+        height, width = grey.shape
+        left, top, right, bottom = self._box
+        margin = int(max(right - left, bottom - top) * self.SEARCH_MARGIN)
+        x0, y0 = max(0, left - margin), max(0, top - margin)
+        window = grey[y0:min(height, bottom + margin), x0:min(width, right + margin)]
+        if window.shape[0] < self._template.shape[0] or window.shape[1] < self._template.shape[1]:
+            return 0.0
+        scores = cv2.matchTemplate(window, self._template, cv2.TM_CCOEFF_NORMED)
+        _, best, _, (x, y) = cv2.minMaxLoc(scores)
+        self._box = (x0 + x, y0 + y, x0 + x + right - left, y0 + y + bottom - top)
+        return max(0.0, float(best)) * 20
+
+    def get_position(self):
+        return rectangle(*self._box)
+
+
+class StubShape:
+    # What the landmark predictor returns: here just the box it was given
+    def __init__(self, rect):
+        self.rect = rect
+
+
+def detect(gray, upsample=0):
+    _, mask = cv2.threshold(gray, DETECTION_LEVEL, 255, cv2.THRESH_BINARY)
+    count, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+    faces = []
+    for left, top, width, height, _ in stats[1:count]:
+        if width >= MIN_FACE_SIZE and height >= MIN_FACE_SIZE:
+            faces.append(rectangle(left, top, left + width, top + height))
+    return faces
+
+
+def describe(image):
+    """The stub descriptor of a face crop (BGR or grayscale)."""
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    thumbnail = cv2.resize(image, DESCRIPTOR_SHAPE[::-1], interpolation=cv2.INTER_AREA).astype(np.float64).ravel()
+    thumbnail -= thumbnail.mean()
+    norm = np.linalg.norm(thumbnail)
+    return thumbnail / norm if norm else thumbnail
+
+
+class StubRecognitionModel:
+    def compute_face_descriptor(self, frame, shapes):
+        if isinstance(shapes, list):
+            return [self.compute_face_descriptor(frame, shape) for shape in shapes]
+        rect = shapes.rect
+        return describe(frame[rect.top():rect.bottom(), rect.left():rect.right()])
+
+
+class StubFaceModels:
+    """Drop-in for ``attendance.utils.FaceModels``."""
+
+    rectangle = rectangle
+    full_object_detections = full_object_detections
+    correlation_tracker = correlation_tracker
+
+    def __init__(self):
+        self.detector = detect
+        self.predictor = lambda gray, rect: StubShape(rect)
+        self.face_rec_model = StubRecognitionModel()
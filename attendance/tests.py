@@ -1,3 +1,1548 @@
+import base64
+import io
+import json
+import logging
+import re
+import os
+import tempfile
+import time
+import unittest
+import zipfile
+from datetime import date
+from io import StringIO
+from unittest import mock
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.db.models import Count, Q
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from . import capture_cache, gallery as gallery_module, utils
+from .gallery import FaceGallery, best_match, decode_encoding, encode_encoding
+from .index import BruteForceIndex, IVFIndex, build_index, nearest_centroid, search_rows
+from .management.commands.mark_absent import missing_enrollments
+from .models import Attendance, DailyAttendanceSummary, GalleryChange, Student, StudentTermSummary, Subject, Teacher
+from .pagination import InvalidCursor, decode_cursor, filter_window, keyset_page
+from .rollups import record_attendance, term_start
+from .metrics import collect_stages, stage
+from .recognition import RecognitionBusy, RecognitionPool, RecognitionTimeout
+from .views import mark_present, teacher_attendance_records
+
+
+def setUpModule():
+    # Keep the per-request JSON log lines out of the test output (assertLogs still sees them)
+    logger = logging.getLogger('attendance.requests')
+    level = logger.level
+    logger.setLevel(logging.WARNING)
+    unittest.addModuleCleanup(logger.setLevel, level)
+
+    # Without dlib or its model files, recognition (including the pool's
+    # worker warm-up) runs on the stub models
+    if not utils.dlib_models_available():
+        stub = override_settings(FACE_MODELS_STUB=True)
+        stub.enable()
+        unittest.addModuleCleanup(stub.disable)
+        models = mock.patch.object(utils, '_models', None)
+        models.start()
+        unittest.addModuleCleanup(models.stop)
+
+
+def make_encoding(seed):
+    return np.random.default_rng(seed).normal(scale=0.1, size=128)
+
+
+def use_fresh_gallery(test_case):
+    # The process-wide gallery and capture caches would otherwise carry rows
+    # across test transactions
+    for module, name in ((gallery_module, '_gallery'), (capture_cache, '_frame_cache'), (capture_cache, '_marked_cache')):
+        patcher = mock.patch.object(module, name, None)
+        patcher.start()
+        test_case.addCleanup(patcher.stop)
+
+
+def make_student(rollno, encoding=None):
+    return Student.objects.create(
+        name=f"Student {rollno}",
+        rollno=str(rollno),
+        photo=f"students/{rollno}.jpg",
+        facial_encoding=b'' if encoding is None else encode_encoding(encoding),
+    )
+
+
+class FaceGalleryTests(TestCase):
+    def test_matches_closest_student(self):
+        students = [make_student(i, make_encoding(i)) for i in range(5)]
+        gallery = FaceGallery()
+
+        student_id, distance = gallery.match(make_encoding(3) + 0.001)
+
+        self.assertEqual(student_id, students[3].id)
+        self.assertLess(distance, 0.1)
+
+    def test_rejects_faces_above_threshold(self):
+        make_student(1, make_encoding(1))
+        gallery = FaceGallery()
+
+        student_id, _ = gallery.match(make_encoding(1) + 1.0)
+
+        self.assertIsNone(student_id)
+
+    def test_skips_students_without_encoding(self):
+        make_student(1)
+        make_student(2, make_encoding(2))
+
+        self.assertEqual(len(FaceGallery()), 1)
+
+    def test_match_many_is_batched(self):
+        students = [make_student(i, make_encoding(i)) for i in range(4)]
+        gallery = FaceGallery()
+
+        ids, _ = gallery.match_many([make_encoding(2), make_encoding(0), make_encoding(99) + 1.0])
+
+        self.assertEqual(ids, [students[2].id, students[0].id, None])
+
+    def test_best_match_agrees_with_brute_force(self):
+        rng = np.random.default_rng(0)
+        encodings = rng.normal(scale=0.1, size=(200, 128))
+        probes = encodings[:10] + rng.normal(scale=0.01, size=(10, 128))
+
+        rows, distances = best_match(probes, encodings)
+
+        expected = np.linalg.norm(encodings[None, :, :] - probes[:, None, :], axis=2)
+        np.testing.assert_array_equal(rows, expected.argmin(axis=1))
+        np.testing.assert_allclose(distances, expected.min(axis=1), atol=1e-6)
+
+
+class GalleryInvalidationTests(TestCase):
+    def test_registering_a_student_is_applied_incrementally(self):
+        for size in (5, 50):
+            with self.subTest(size=size):
+                Student.objects.all().delete()
+                for i in range(size):
+                    make_student(i, make_encoding(i))
+                gallery = FaceGallery()
+                gallery.refresh()
+
+                new_student = make_student('new', make_encoding(1000))
+                # Change log, changed row and its enrollments, whatever N is
+                with mock.patch.object(FaceGallery, 'load') as load, self.assertNumQueries(3):
+                    applied = gallery.sync()
+
+                load.assert_not_called()
+                self.assertEqual(applied, 1)
+                self.assertEqual(gallery._size, size + 1)
+                self.assertEqual(gallery.match(make_encoding(1000))[0], new_student.id)
+
+    def test_edit_and_delete_update_rows(self):
+        students = [make_student(i, make_encoding(i)) for i in range(3)]
+        gallery = FaceGallery()
+        gallery.refresh()
+
+        students[0].facial_encoding = make_encoding(500).tobytes()
+        students[0].save()
+        students[1].delete()
+
+        self.assertEqual(gallery.match(make_encoding(500))[0], students[0].id)
+        self.assertIsNone(gallery.match(make_encoding(1))[0])
+        self.assertEqual(gallery.match(make_encoding(2))[0], students[2].id)
+        self.assertEqual(len(gallery), 2)
+
+    def test_processes_pick_up_each_others_changes(self):
+        make_student(1, make_encoding(1))
+        worker_a, worker_b = FaceGallery(), FaceGallery()
+        worker_a.refresh()
+        worker_b.refresh()
+
+        student = make_student(2, make_encoding(2))
+
+        self.assertEqual(worker_a.match(make_encoding(2))[0], student.id)
+        self.assertEqual(worker_b.match(make_encoding(2))[0], student.id)
+        self.assertEqual(worker_a.version, worker_b.version)
+
+    def test_subject_enrollment_is_logged(self):
+        student = make_student(1, make_encoding(1))
+        subject = Subject.objects.create(name='Maths')
+        gallery = FaceGallery()
+        gallery.refresh()
+        version = gallery.version
+
+        student.subjects.add(subject)
+        subject.students.clear()
+
+        self.assertEqual(gallery.sync(), 1)
+        self.assertGreater(gallery.version, version)
+
+
+class FaceIndexTests(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.encodings = rng.normal(scale=0.1, size=(600, 128))
+        self.sq_norms = np.einsum('ij,ij->i', self.encodings, self.encodings)
+        self.probes = self.encodings[:50] + rng.normal(scale=0.01, size=(50, 128))
+
+    def test_ivf_agrees_with_exact_search(self):
+        exact_rows, _ = BruteForceIndex().search(self.probes, self.encodings, self.sq_norms)
+        index = IVFIndex(nlist=16, nprobe=4, min_train_size=1)
+        index.train(self.encodings)
+        index.reset(self.encodings)
+
+        with mock.patch('attendance.index.search_rows', wraps=search_rows) as scan:
+            rows, _ = index.search(self.probes, self.encodings, self.sq_norms)
+
+        self.assertGreaterEqual(np.mean(rows == exact_rows), 0.95)
+        # Each probe scans only the rows filed under its nearest lists
+        self.assertLess(np.mean([len(call.args[4]) for call in scan.call_args_list]), len(self.encodings) / 2)
+
+    def test_small_galleries_are_searched_exactly(self):
+        index = IVFIndex(min_train_size=10000)
+        index.reset(self.encodings)
+
+        self.assertIsNone(index.centroids)
+        rows, _ = index.search(self.probes, self.encodings, self.sq_norms)
+        np.testing.assert_array_equal(rows, np.arange(50))
+
+    def test_untrained_index_searches_exactly_instead_of_training(self):
+        index = IVFIndex(min_train_size=1)
+        with self.assertLogs('attendance.index', 'WARNING'):
+            index.reset(self.encodings)
+
+        self.assertIsNone(index.centroids)
+        rows, _ = index.search(self.probes, self.encodings, self.sq_norms)
+        np.testing.assert_array_equal(rows, np.arange(50))
+
+    def test_trained_index_is_persisted(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'face_index.npz')
+            index = IVFIndex(nlist=8, min_train_size=1, path=path)
+            index.train(self.encodings)
+            index.save(path)
+
+            reloaded = IVFIndex(path=path)
+
+            np.testing.assert_array_equal(reloaded.centroids, index.centroids)
+
+    def test_build_command_trains_once_and_saves(self):
+        for i in range(20):
+            make_student(i, make_encoding(i))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'face_index.npz')
+            with self.settings(FACE_INDEX_PATH=path), \
+                    mock.patch.object(IVFIndex, 'train', autospec=True, side_effect=IVFIndex.train) as train:
+                call_command('build_face_index', '--nlist', '4', stdout=StringIO())
+
+            train.assert_called_once()
+            self.assertEqual(IVFIndex(path=path).centroids.shape, (4, 128))
+
+    def test_gallery_updates_reach_the_index(self):
+        students = [make_student(i, make_encoding(i)) for i in range(40)]
+        index = IVFIndex(nlist=4, nprobe=1, min_train_size=1)
+        index.train(np.array([make_encoding(i) for i in range(40)]))
+        gallery = FaceGallery(index=index)
+        gallery.refresh()
+
+        new_student = make_student('new', make_encoding(1000))
+        students[0].delete()
+        students[39].facial_encoding = encode_encoding(make_encoding(2000))
+        students[39].save()
+        students[20].delete()
+
+        self.assertEqual(gallery.match(make_encoding(1000))[0], new_student.id)
+        self.assertEqual(gallery.match(make_encoding(2000))[0], students[39].id)
+        self.assertIsNone(gallery.match(make_encoding(0))[0])
+        # Every row is filed exactly once, under its nearest centroid
+        self.assertEqual(sorted(np.concatenate(index.lists).tolist()), list(range(len(gallery.ids))))
+        for label, rows in enumerate(index.lists):
+            np.testing.assert_array_equal(nearest_centroid(gallery.encodings[rows], index.centroids), label)
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            build_index('hnsw')
+
+
+class SubjectPartitionTests(TestCase):
+    def setUp(self):
+        self.maths = Subject.objects.create(name='Maths')
+        self.physics = Subject.objects.create(name='Physics')
+        self.students = [make_student(i, make_encoding(i)) for i in range(6)]
+        for student in self.students[:3]:
+            student.subjects.add(self.maths)
+        for student in self.students[2:]:
+            student.subjects.add(self.physics)
+
+    def test_only_enrolled_students_match(self):
+        gallery = FaceGallery()
+
+        self.assertEqual(gallery.match(make_encoding(1), subject_id=self.maths.id)[0], self.students[1].id)
+        self.assertIsNone(gallery.match(make_encoding(1), subject_id=self.physics.id)[0])
+        self.assertEqual(gallery.match(make_encoding(2), subject_id=self.physics.id)[0], self.students[2].id)
+        np.testing.assert_array_equal(np.sort(gallery.ids[gallery.partition_rows(self.maths.id)]),
+                                      [student.id for student in self.students[:3]])
+
+    def test_global_search_without_subject(self):
+        self.assertEqual(FaceGallery().match(make_encoding(5))[0], self.students[5].id)
+
+    def test_enrollment_changes_update_partitions(self):
+        gallery = FaceGallery()
+        gallery.refresh()
+
+        self.students[5].subjects.add(self.maths)
+        self.maths.students.remove(self.students[0])
+        self.students[1].delete()
+
+        self.assertEqual(gallery.match(make_encoding(5), subject_id=self.maths.id)[0], self.students[5].id)
+        self.assertIsNone(gallery.match(make_encoding(0), subject_id=self.maths.id)[0])
+        self.assertIsNone(gallery.match(make_encoding(1), subject_id=self.maths.id)[0])
+        self.assertEqual(gallery.match(make_encoding(2), subject_id=self.maths.id)[0], self.students[2].id)
+
+
+class BatchCaptureTests(TestCase):
+    def setUp(self):
+        use_fresh_gallery(self)
+        self.subject = Subject.objects.create(name='Maths')
+        self.students = [make_student(i, make_encoding(i)) for i in range(3)]
+        for student in self.students:
+            student.subjects.add(self.subject)
+        session = self.client.session
+        session['subject'] = self.subject.name
+        session.save()
+
+    def post_faces(self, faces):
+        image = base64.b64encode(cv2.imencode('.jpg', np.zeros((8, 8, 3), dtype=np.uint8))[1]).decode()
+        with mock.patch('attendance.views.get_face_encodings_from_frame', return_value=faces):
+            return self.client.post(reverse('capture_faces_batch'), {'image': f'data:image/jpeg;base64,{image}'},
+                                    content_type='application/json')
+
+    def test_marks_every_recognised_face(self):
+        Attendance.objects.create(student=self.students[1], subject=self.subject, status='Present')
+        faces = [
+            ((0, 0, 10, 10), make_encoding(0)),
+            ((20, 0, 30, 10), make_encoding(1)),
+            ((40, 0, 50, 10), make_encoding(99) + 1.0),
+            ((60, 0, 70, 10), make_encoding(2)),
+        ]
+
+        response = self.post_faces(faces)
+
+        results = response.json()['faces']
+        self.assertEqual([r['status'] for r in results], ['marked', 'already_marked', 'unknown', 'marked'])
+        self.assertEqual(results[3]['box'], {'left': 60, 'top': 0, 'right': 70, 'bottom': 10})
+        self.assertEqual(results[0]['name'], self.students[0].name)
+        self.assertEqual(Attendance.objects.filter(subject=self.subject, status='Present').count(), 3)
+
+    def test_requires_subject(self):
+        session = self.client.session
+        del session['subject']
+        session.save()
+
+        response = self.post_faces([])
+
+        self.assertEqual(response.status_code, 400)
+
+
+class CaptureUploadTests(TestCase):
+    def setUp(self):
+        use_fresh_gallery(self)
+        self.subject = Subject.objects.create(name='Maths')
+        self.student = make_student(1, make_encoding(1))
+        self.student.subjects.add(self.subject)
+        session = self.client.session
+        session['subject'] = self.subject.name
+        session.save()
+        ok, jpeg = cv2.imencode('.jpg', np.full((48, 64, 3), 127, dtype=np.uint8))
+        self.jpeg = jpeg.tobytes()
+
+    def capture(self, **kwargs):
+        with mock.patch('attendance.views.get_face_encoding_from_frame', return_value=make_encoding(1)) as encode:
+            response = self.client.post(reverse('capture_face'), **kwargs)
+        return response, encode
+
+    def assert_marked(self, response, encode):
+        self.assertEqual(response.json()['message'], f"Attendance Done for {self.student.name}!")
+        self.assertEqual(encode.call_args[0][0].shape, (48, 64, 3))
+        self.assertTrue(Attendance.objects.filter(student=self.student, subject=self.subject).exists())
+
+    def test_raw_jpeg_body(self):
+        self.assert_marked(*self.capture(data=self.jpeg, content_type='image/jpeg'))
+
+    def test_multipart_upload(self):
+        upload = SimpleUploadedFile('frame.jpg', self.jpeg, content_type='image/jpeg')
+        self.assert_marked(*self.capture(data={'image': upload}))
+
+    def test_legacy_base64_json(self):
+        data_url = 'data:image/jpeg;base64,' + base64.b64encode(self.jpeg).decode()
+        self.assert_marked(*self.capture(data={'image': data_url}, content_type='application/json'))
+
+    def test_empty_body(self):
+        response, encode = self.capture(data=b'', content_type='image/jpeg')
+
+        self.assertEqual(response.json()['message'], 'No image data provided.')
+        encode.assert_not_called()
+
+
+class DetectionScaleTests(TestCase):
+    def test_boxes_are_mapped_back_to_full_resolution(self):
+        from .stub_models import rectangle
+
+        gray = np.zeros((720, 1280), dtype=np.uint8)
+        detector = mock.Mock(return_value=[rectangle(10, 20, 110, 120)])
+        with mock.patch.object(utils, 'get_models', return_value=mock.Mock(detector=detector, rectangle=rectangle)):
+            faces = utils.detect_faces(gray, max_width=640, upsample=1)
+
+        small, upsample = detector.call_args[0]
+        self.assertEqual(small.shape, (360, 640))
+        self.assertEqual(upsample, 1)
+        self.assertEqual([(f.left(), f.top(), f.right(), f.bottom()) for f in faces], [(20, 40, 220, 240)])
+
+    def test_small_frames_are_not_resized(self):
+        gray = np.zeros((240, 320), dtype=np.uint8)
+        detector = mock.Mock(return_value=[])
+        with mock.patch.object(utils, 'get_models', return_value=mock.Mock(detector=detector)):
+            utils.detect_faces(gray, max_width=640, upsample=0)
+
+        self.assertIs(detector.call_args[0][0], gray)
+
+
+class RecognitionPoolTests(TestCase):
+    def test_inline_pool_runs_on_calling_thread(self):
+        pool = RecognitionPool(0, 0, timeout=1)
+
+        self.assertEqual(pool.run(sum, [1, 2, 3]), 6)
+
+    def test_rejects_jobs_beyond_queue_depth(self):
+        pool = RecognitionPool(1, 0, timeout=5)
+        self.addCleanup(pool.shutdown)
+
+        running = pool.submit(time.sleep, 0.5)
+        with self.assertRaises(RecognitionBusy):
+            pool.submit(time.sleep, 0)
+        running.result()
+
+        self.assertEqual(pool.pending, 0)
+        self.assertIsNone(pool.run(time.sleep, 0))
+
+    def test_job_timeout(self):
+        pool = RecognitionPool(1, 1, timeout=0.05)
+        self.addCleanup(pool.shutdown)
+
+        with self.assertRaises(RecognitionTimeout):
+            pool.run(time.sleep, 1)
+
+    def test_capture_reports_backpressure(self):
+        busy_pool = mock.Mock(run=mock.Mock(side_effect=RecognitionBusy))
+        jpeg = cv2.imencode('.jpg', np.zeros((8, 8, 3), dtype=np.uint8))[1].tobytes()
+        with mock.patch('attendance.views.get_recognition_pool', return_value=busy_pool):
+            response = self.client.post(reverse('capture_face'), jpeg, content_type='image/jpeg')
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+
+
+class AsyncCaptureTests(TestCase):
+    def setUp(self):
+        use_fresh_gallery(self)
+        self.subject = Subject.objects.create(name='Maths')
+        self.students = [make_student(i, make_encoding(i)) for i in range(2)]
+        for student in self.students:
+            student.subjects.add(self.subject)
+        session = self.client.session
+        session['subject'] = self.subject.name
+        session.save()
+        self.async_client.cookies = self.client.cookies
+        self.jpeg = cv2.imencode('.jpg', np.zeros((8, 8, 3), dtype=np.uint8))[1].tobytes()
+
+    async def test_marks_attendance(self):
+        with mock.patch('attendance.views.get_face_encoding_from_frame', return_value=make_encoding(1)):
+            response = await self.async_client.post(reverse('capture_face_async'), self.jpeg, content_type='image/jpeg')
+
+        self.assertEqual(response.json()['message'], f"Attendance Done for {self.students[1].name}!")
+        self.assertTrue(await Attendance.objects.filter(student=self.students[1], subject=self.subject).aexists())
+
+    async def test_decoding_and_hashing_stay_off_the_event_loop(self):
+        import threading
+
+        loop_thread = threading.current_thread()
+        threads = []
+
+        def record_thread(fn):
+            def wrapper(*args):
+                threads.append(threading.current_thread())
+                return fn(*args)
+            return wrapper
+
+        with mock.patch('attendance.utils.decode_image', side_effect=record_thread(utils.decode_image)), \
+                mock.patch('attendance.views.image_digest', side_effect=record_thread(capture_cache.image_digest)), \
+                mock.patch('attendance.views.get_face_encoding_from_frame', return_value=make_encoding(1)):
+            response = await self.async_client.post(reverse('capture_face_async'), self.jpeg, content_type='image/jpeg')
+
+        self.assertEqual(response.json()['message'], f"Attendance Done for {self.students[1].name}!")
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(loop_thread, threads)
+
+    def test_a_failed_rollup_update_leaves_no_attendance_row(self):
+        for view in ('capture_face', 'capture_face_async'):
+            capture_cache.get_marked_cache().clear()
+            with mock.patch('attendance.views.get_face_encoding_from_frame', return_value=make_encoding(1)), \
+                    mock.patch('attendance.rollups.record_attendance', side_effect=DatabaseError('rollup failed')), \
+                    self.assertLogs('attendance.views', 'ERROR'):
+                self.client.post(reverse(view), self.jpeg, content_type='image/jpeg')
+            self.assertFalse(Attendance.objects.exists(), view)
+
+    async def test_batch_marks_every_face(self):
+        faces = [((0, 0, 10, 10), make_encoding(0)), ((20, 0, 30, 10), make_encoding(1))]
+        with mock.patch('attendance.views.get_face_encodings_from_frame', return_value=faces):
+            response = await self.async_client.post(reverse('capture_faces_batch_async'), self.jpeg, content_type='image/jpeg')
+
+        self.assertEqual([r['status'] for r in response.json()['faces']], ['marked', 'marked'])
+        self.assertEqual(await Attendance.objects.filter(subject=self.subject).acount(), 2)
+
+
+class ModelLoadingTests(TestCase):
+    def test_models_are_loaded_once_on_demand(self):
+        with self.settings(FACE_MODELS_STUB=False), mock.patch.object(utils, '_models', None), \
+                mock.patch.object(utils, 'FaceModels') as face_models:
+            self.assertIs(utils.get_models(), utils.get_models())
+
+        face_models.assert_called_once_with()
+
+    def test_stub_models(self):
+        from .stub_models import StubFaceModels
+
+        with self.settings(FACE_MODELS_STUB=True), mock.patch.object(utils, '_models', None):
+            self.assertIsInstance(utils.get_models(), StubFaceModels)
+
+
+class MarkAbsentTests(TestCase):
+    def setUp(self):
+        self.maths = Subject.objects.create(name='Maths')
+        self.physics = Subject.objects.create(name='Physics')
+
+    def enroll(self, count):
+        for i in range(count):
+            student = make_student(f'{self.maths.id}-{i}')
+            student.subjects.add(self.maths, self.physics)
+        return Student.objects.order_by('id')
+
+    def mark_absent(self, *args):
+        call_command('mark_absent', *args, stdout=StringIO())
+
+    def test_marks_each_missing_enrollment(self):
+        students = self.enroll(3)
+        day = date(2025, 1, 20)
+        Attendance.objects.create(student=students[0], subject=self.maths, date=day, status='Present')
+
+        self.mark_absent('--date', '2025-01-20')
+
+        self.assertEqual(Attendance.objects.filter(date=day, status='Absent').count(), 5)
+        self.assertEqual(Attendance.objects.get(student=students[0], subject=self.maths).status, 'Present')
+
+    def test_query_count_does_not_grow_with_students(self):
+        counts = []
+        for size in (2, 20):
+            Student.objects.all().delete()
+            self.enroll(size)
+            with CaptureQueriesContext(connection) as queries:
+                self.mark_absent('--date', '2025-01-20')
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_marks_every_pair_across_chunks(self):
+        self.enroll(5)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.mark_absent('--date', '2025-01-20', '--batch-size', '3')
+
+        self.assertEqual(Attendance.objects.filter(status='Absent').count(), 2 * 5)
+        # Keyset chunks: each read picks up after the previous one's last enrollment
+        reads = [q['sql'] for q in queries if 'attendance_student_subjects' in q['sql'] and 'INSERT' not in q['sql']]
+        self.assertEqual(len(reads), 5)  # 3 + 3 + 3 + 1, then an empty read
+
+    def test_backfills_a_range_idempotently(self):
+        self.enroll(2)
+
+        self.mark_absent('--from', '2025-01-01', '--to', '2025-01-03')
+        self.mark_absent('--from', '2025-01-01', '--to', '2025-01-03')
+
+        self.assertEqual(Attendance.objects.count(), 2 * 2 * 3)
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is SQLite syntax')
+class AttendanceQueryPlanTests(TestCase):
+    """Every hot Attendance query must search an index, never scan the table."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.subject = Subject.objects.create(name='Maths')
+        cls.student = make_student(1)
+        cls.student.subjects.add(cls.subject)
+        Attendance.objects.create(student=cls.student, subject=cls.subject, status='Present')
+
+    def assert_no_table_scan(self, queryset):
+        plan = queryset.explain()
+        scans = re.findall(r'SCAN attendance_attendance\b.*', plan)
+        self.assertEqual(scans, [], f"Full scan of attendance_attendance:\n{plan}")
+        self.assertIn('attendance_attendance', plan)
+
+    def test_attendance_by_subject(self):
+        teacher = Teacher.objects.create(name='T', password='x')
+        teacher.subjects.add(self.subject)
+        self.assert_no_table_scan(teacher_attendance_records(teacher.id))
+        # A deep page of the paginated history seeks straight to its cursor
+        page = filter_window(teacher_attendance_records(teacher.id), date(2025, 1, 1), None).order_by('-date', '-id')
+        self.assert_no_table_scan(page.filter(Q(date__lt=date(2025, 3, 1)) | Q(date=date(2025, 3, 1), id__lt=10))[:101])
+
+    def test_student_history(self):
+        students = Student.objects.filter(subjects__in=[self.subject]).distinct()
+        self.assert_no_table_scan(Attendance.objects.filter(student__in=students).order_by('-date'))
+
+    def test_capture_lookup(self):
+        self.assert_no_table_scan(
+            Attendance.objects.filter(student=self.student, subject=self.subject, date=date.today())
+        )
+
+    def test_batch_already_marked(self):
+        self.assert_no_table_scan(
+            Attendance.objects.filter(subject=self.subject, date=date.today(), student_id__in=[self.student.id])
+            .values_list('student_id', flat=True)
+        )
+
+    def test_mark_absent_anti_join(self):
+        self.assert_no_table_scan(missing_enrollments(date.today()))
+        # One keyset chunk, as mark_absent reads them
+        self.assert_no_table_scan(missing_enrollments(date.today()).order_by('pk').filter(pk__gt=10)[:5000])
+
+    def test_daily_status_report(self):
+        self.assert_no_table_scan(
+            Attendance.objects.filter(date__range=(date(2025, 1, 1), date(2025, 6, 30)))
+            .order_by().values('date', 'subject', 'status').annotate(count=Count('*'))
+        )
+
+
+class AttendanceBySubjectViewTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+
+        self.client.force_login(User.objects.create_user('admin'))
+        self.teacher = Teacher.objects.create(name='T', password='x')
+        session = self.client.session
+        session['teacher_id'] = self.teacher.id
+        session.save()
+
+    def add_subject(self, name, students, days):
+        subject = Subject.objects.create(name=name)
+        self.teacher.subjects.add(subject)
+        for i in range(students):
+            student = make_student(f'{name}-{i}')
+            student.subjects.add(subject)
+            for day in range(1, days + 1):
+                Attendance.objects.create(student=student, subject=subject, date=date(2025, 1, day), status='Present')
+        return subject
+
+    def get_page(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('attendance_by_subject'), {'from': '2025-01-01'})
+        return response, len(queries)
+
+    def test_query_count_is_constant(self):
+        self.add_subject('Maths', students=1, days=1)
+        _, small = self.get_page()
+
+        self.add_subject('Physics', students=5, days=3)
+        self.add_subject('Chemistry', students=4, days=2)
+        response, large = self.get_page()
+
+        self.assertEqual(small, large)
+        self.assertContains(response, 'Physics-4 - Present')
+
+    def test_groups_by_subject_and_date(self):
+        maths = self.add_subject('Maths', students=2, days=2)
+        dropped = make_student('dropped')
+        Attendance.objects.create(student=dropped, subject=maths, date=date(2025, 1, 1), status='Absent')
+
+        with self.assertNumQueries(5):  # session, user, teacher, attendance, day totals
+            response = self.client.get(reverse('attendance_by_subject'), {'from': '2025-01-01'})
+
+        grouped = response.context['attendance_by_subject']
+        self.assertEqual(list(grouped), ['Maths'])
+        self.assertEqual(list(grouped['Maths']), [date(2025, 1, 2), date(2025, 1, 1)])
+        self.assertEqual(len(grouped['Maths'][date(2025, 1, 1)]['records']), 2)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.subject = Subject.objects.create(name='Maths')
+        self.teacher = Teacher.objects.create(name='T', password='x')
+        self.teacher.subjects.add(self.subject)
+        students = [make_student(i) for i in range(3)]
+        for student in students:
+            student.subjects.add(self.subject)
+            for day in range(1, 11):
+                Attendance.objects.create(student=student, subject=self.subject, date=date(2025, 1, day), status='Present')
+        session = self.client.session
+        session['teacher_id'] = self.teacher.id
+        session.save()
+
+    def test_pages_cover_every_record_once(self):
+        seen = []
+        cursor = None
+        while True:
+            records, cursor = keyset_page(Attendance.objects.all(), cursor, page_size=7)
+            seen.extend(records)
+            if cursor is None:
+                break
+
+        self.assertEqual(len(seen), 30)
+        self.assertEqual(len({record.id for record in seen}), 30)
+        self.assertEqual(seen, sorted(seen, key=lambda record: (record.date, record.id), reverse=True))
+
+    def test_deep_pages_cost_the_same_as_the_first(self):
+        _, cursor = keyset_page(Attendance.objects.all(), page_size=25)
+        with self.assertNumQueries(1):
+            records, next_cursor = keyset_page(Attendance.objects.all(), cursor, page_size=25)
+
+        self.assertEqual(len(records), 5)
+        self.assertIsNone(next_cursor)
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(InvalidCursor):
+            decode_cursor('not-a-cursor')
+
+    def test_api_follows_cursor_within_window(self):
+        url = reverse('attendance_api')
+        first = self.client.get(url, {'from': '2025-01-05', 'to': '2025-01-09', 'limit': 10}).json()
+        second = self.client.get(url, {'from': '2025-01-05', 'to': '2025-01-09', 'limit': 10, 'cursor': first['next']}).json()
+
+        self.assertEqual(len(first['results']), 10)
+        self.assertEqual(len(second['results']), 5)
+        self.assertIsNone(second['next'])
+        self.assertEqual(first['results'][0]['date'], '2025-01-09')
+        self.assertEqual(second['results'][-1]['date'], '2025-01-05')
+
+    def test_api_rejects_bad_cursor(self):
+        response = self.client.get(reverse('attendance_api'), {'cursor': '!!'})
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_history_page_links_to_older_records(self):
+        from django.test import RequestFactory
+        from .views import view_attendance
+
+        request = RequestFactory().get('/', {'from': '2025-01-01'})
+        request.session = self.client.session
+        with self.settings(ATTENDANCE_PAGE_SIZE=20):
+            response = view_attendance(request)
+
+        self.assertContains(response, 'Older records')
+        self.assertContains(response, 'cursor=')
+
+
+class AttendanceRollupTests(TestCase):
+    def setUp(self):
+        self.maths = Subject.objects.create(name='Maths')
+        self.students = [make_student(i) for i in range(4)]
+        for student in self.students:
+            student.subjects.add(self.maths)
+
+    def summaries(self):
+        daily = list(DailyAttendanceSummary.objects.order_by('date').values_list('date', 'present', 'absent'))
+        terms = sorted(StudentTermSummary.objects.values_list('student_id', 'term_start', 'present', 'absent'))
+        return daily, terms
+
+    def test_term_start(self):
+        with self.settings(ATTENDANCE_TERM_START_MONTHS=(1, 7)):
+            self.assertEqual(term_start(date(2025, 3, 14)), date(2025, 1, 1))
+            self.assertEqual(term_start(date(2025, 7, 1)), date(2025, 7, 1))
+        with self.settings(ATTENDANCE_TERM_START_MONTHS=(9,)):
+            self.assertEqual(term_start(date(2025, 3, 14)), date(2024, 9, 1))
+
+    def test_marking_updates_rollups_incrementally(self):
+        day = date(2025, 2, 3)
+        present = Attendance.objects.create(student=self.students[0], subject=self.maths, date=day, status='Present')
+        record_attendance([present])
+
+        call_command('mark_absent', '--date', day.isoformat(), stdout=StringIO())
+
+        daily, terms = self.summaries()
+        self.assertEqual(daily, [(day, 1, 3)])
+        self.assertEqual(terms[0], (self.students[0].id, date(2025, 1, 1), 1, 0))
+        self.assertEqual(terms[1], (self.students[1].id, date(2025, 1, 1), 0, 1))
+
+    def test_conflicting_inserts_are_not_counted(self):
+        from .management.commands.mark_absent import Command
+
+        use_fresh_gallery(self)  # mark_present consults the process-wide marked cache
+        day = date(2025, 2, 3)
+        present = Attendance.objects.create(student=self.students[0], subject=self.maths, date=day, status='Present')
+        record_attendance([present])
+
+        # mark_absent's anti-join ran before the capture above committed
+        stale = [Attendance(student=student, subject=self.maths, date=day, status='Absent') for student in self.students[:2]]
+        self.assertEqual(Command().insert(stale), 1)
+        self.assertEqual(mark_present([self.students[0].id, self.students[2].id], self.maths, day), {self.students[2].id})
+
+        daily, terms = self.summaries()
+        self.assertEqual(daily, [(day, 2, 1)])
+        self.assertEqual([term[2:] for term in terms], [(1, 0), (0, 1), (1, 0)])
+        self.assertEqual(Attendance.objects.get(student=self.students[0], date=day).status, 'Present')
+
+    def test_batch_update_query_count_is_constant(self):
+        counts = []
+        for day, students in ((date(2025, 2, 3), self.students[:1]), (date(2025, 2, 4), self.students)):
+            absences = [Attendance(student=student, subject=self.maths, date=day, status='Absent') for student in students]
+            with CaptureQueriesContext(connection) as queries:
+                record_attendance(absences)
+            counts.append(len(queries))
+
+        self.assertEqual(counts[0], counts[1])
+
+    def test_rebuild_matches_incremental_totals(self):
+        for day in (date(2025, 2, 3), date(2025, 8, 4)):
+            call_command('mark_absent', '--date', day.isoformat(), stdout=StringIO())
+        incremental = self.summaries()
+
+        DailyAttendanceSummary.objects.all().delete()
+        StudentTermSummary.objects.all().delete()
+        call_command('rebuild_attendance_summary', stdout=StringIO())
+
+        self.assertEqual(self.summaries(), incremental)
+
+    def test_dashboard_reads_term_rates(self):
+        today = date.today()
+        DailyAttendanceSummary.objects.create(subject=self.maths, date=today, present=3, absent=1)
+        teacher = Teacher.objects.create(name='T', password='x')
+        teacher.subjects.add(self.maths)
+        session = self.client.session
+        session['teacher_id'] = teacher.id
+        session.save()
+
+        response = self.client.get(reverse('teacher_dashboard'))
+
+        self.assertEqual(response.context['attendance_rates'][0]['rate'], 75)
+        self.assertContains(response, '75%')
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.maths = Subject.objects.create(name='Maths')
+        self.physics = Subject.objects.create(name='Physics')
+        self.teacher = Teacher.objects.create(name='T', password='x')
+        self.teacher.subjects.add(self.maths)
+        student = make_student(1)
+        Attendance.objects.create(student=student, subject=self.maths, date=date(2025, 2, 3), status='Present')
+        Attendance.objects.create(student=student, subject=self.maths, date=date(2025, 2, 4), status='Absent')
+        Attendance.objects.create(student=student, subject=self.physics, date=date(2025, 2, 3), status='Present')
+
+    def login_teacher(self):
+        session = self.client.session
+        session['teacher_id'] = self.teacher.id
+        session.save()
+
+    def test_csv_is_limited_to_teacher_subjects_and_window(self):
+        self.login_teacher()
+        response = self.client.get(reverse('export_attendance'), {'from': '2025-02-04'})
+
+        self.assertIn('attachment', response['Content-Disposition'])
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines, ['Date,Subject,Roll No,Student,Status', '2025-02-04,Maths,1,Student 1,Absent'])
+
+    def test_xlsx_is_a_readable_workbook(self):
+        self.login_teacher()
+        response = self.client.get(reverse('export_attendance'), {'format': 'xlsx'})
+
+        workbook = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertIsNone(workbook.testzip())
+        sheet = workbook.read('xl/worksheets/sheet1.xml').decode()
+        self.assertEqual(sheet.count('<row>'), 3)
+        self.assertNotIn('Physics', sheet)
+
+    def test_access(self):
+        self.assertEqual(self.client.get(reverse('export_attendance')).status_code, 302)
+
+        from django.contrib.auth.models import User
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+        response = self.client.get(reverse('export_attendance'))
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 4)
+        self.assertEqual(self.client.get(reverse('export_attendance'), {'format': 'pdf'}).status_code, 400)
+
+    def test_command_writes_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'attendance.csv')
+            call_command('export_attendance', '--subject', 'Physics', '--output', path)
+            with open(path) as f:
+                self.assertEqual(f.read().splitlines()[1:], ['2025-02-03,Physics,1,Student 1,Present'])
+
+
+def make_png(value):
+    ok, png = cv2.imencode('.png', np.full((32, 32, 3), value, dtype=np.uint8))
+    return png.tobytes()
+
+
+def encode_by_shade(frame):
+    # Stand-in for dlib: a uniform grey photo of shade N "shows" person N; black shows nobody
+    shade = int(frame.mean())
+    return make_encoding(shade) if shade else None
+
+
+@mock.patch('attendance.utils.get_face_encoding_from_frame', side_effect=encode_by_shade)
+class EnrollmentTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_settings = self.settings(MEDIA_ROOT=media.name, ENROLLMENT_WORKERS=1)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.maths = Subject.objects.create(name='Maths')
+        self.teacher = Teacher.objects.create(name='T', password='x')
+        self.teacher.subjects.add(self.maths)
+        session = self.client.session
+        session['teacher_id'] = self.teacher.id
+        session.save()
+
+    def test_register_student_stores_encoding(self, encode):
+        photo = SimpleUploadedFile('a.png', make_png(5), content_type='image/png')
+        response = self.client.post(reverse('register_student'), {'name': 'Ann', 'rollno': '7', 'photo': photo})
+
+        self.assertRedirects(response, reverse('teacher_dashboard'), fetch_redirect_response=False)
+        student = Student.objects.get(rollno='7')
+        np.testing.assert_allclose(decode_encoding(student.facial_encoding), make_encoding(5), rtol=1e-6)
+        self.assertEqual(list(student.subjects.all()), [self.maths])
+
+    def test_register_student_rejects_photo_without_face(self, encode):
+        photo = SimpleUploadedFile('a.png', make_png(0), content_type='image/png')
+        self.client.post(reverse('register_student'), {'name': 'Ann', 'rollno': '7', 'photo': photo})
+
+        self.assertFalse(Student.objects.exists())
+
+    def test_command_enrolls_directory_with_report(self, encode):
+        make_student('old').subjects.add(Subject.objects.create(name='Art'))
+        with tempfile.TemporaryDirectory() as photos:
+            for name, shade in (('1.png', 1), ('2.png', 2), ('nobody.png', 0)):
+                with open(os.path.join(photos, name), 'wb') as f:
+                    f.write(make_png(shade))
+            roster = os.path.join(photos, 'roster.csv')
+            with open(roster, 'w') as f:
+                f.write('rollno,name,photo\n1,One,\n2,Two,2.png\n2,Again,\n3,Three,nobody.png\n4,Four,\nold,Old,\n')
+            out = StringIO()
+
+            with CaptureQueriesContext(connection) as queries:
+                call_command('enroll_students', photos, '--roster', roster, '--subject', 'Maths', stdout=out)
+
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[:6], [
+            '1: Enrolled.',
+            '2: Enrolled.',
+            '2: Duplicate roll number in this upload.',
+            '3: No face detected in the photo.',
+            "4: No photo found.",
+            'old: Already registered; subjects added.',
+        ])
+        self.assertEqual(sorted(self.maths.students.values_list('rollno', flat=True)), ['1', '2', 'old'])
+        np.testing.assert_allclose(decode_encoding(Student.objects.get(rollno='2').facial_encoding), make_encoding(2), rtol=1e-6)
+        self.assertEqual(GalleryChange.objects.filter(student_id=Student.objects.get(rollno='1').id).count(), 1)
+        # Bulk writes: the query count doesn't grow with the number of students
+        self.assertLess(len(queries), 12)
+
+    def test_zip_upload(self, encode):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as photos:
+            photos.writestr('class/11.png', make_png(11))
+            photos.writestr('12.png', make_png(12))
+        roster = SimpleUploadedFile('roster.csv', b'\xef\xbb\xbfRollNo,Name\n11,Eleven\n12,Twelve\n')
+
+        response = self.client.post(reverse('enroll_students'), {
+            'photos': SimpleUploadedFile('photos.zip', archive.getvalue()), 'roster': roster,
+        })
+
+        self.assertEqual([entry['status'] for entry in response.context['report']], ['enrolled', 'enrolled'])
+        self.assertEqual(self.maths.students.count(), 2)
+
+    def test_roll_number_taken_during_encoding_is_reported_not_raised(self, encode):
+        def register_meanwhile(frame):
+            # Another registration of roll number 12 commits while the upload is being encoded
+            if not Student.objects.filter(rollno='12').exists():
+                make_student(12)
+            return encode_by_shade(frame)
+
+        encode.side_effect = register_meanwhile
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as photos:
+            photos.writestr('11.png', make_png(11))
+            photos.writestr('12.png', make_png(12))
+        response = self.client.post(reverse('enroll_students'), {
+            'photos': SimpleUploadedFile('photos.zip', archive.getvalue()),
+            'roster': SimpleUploadedFile('roster.csv', b'rollno,name\n11,Eleven\n12,Twelve\n'),
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([entry['status'] for entry in response.context['report']], ['enrolled', 'error'])
+        self.assertEqual(Student.objects.get(rollno='12').name, 'Student 12')
+        eleven = Student.objects.get(rollno='11')
+        self.assertEqual(list(eleven.subjects.all()), [self.maths])
+        # Only the enrolled student's photo was written, under the name stored on it
+        self.assertEqual(os.listdir(os.path.join(settings.MEDIA_ROOT, 'students')), [os.path.basename(eleven.photo.name)])
+
+    def test_zip_upload_uses_the_recognition_pool(self, encode):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as photos:
+            for rollno in (11, 12, 13):
+                photos.writestr(f'{rollno}.png', make_png(rollno))
+        upload = {
+            'photos': SimpleUploadedFile('photos.zip', archive.getvalue()),
+            'roster': SimpleUploadedFile('roster.csv', b'rollno,name\n11,Eleven\n12,Twelve\n13,Thirteen\n'),
+        }
+        pool = RecognitionPool(0, 0, 5)
+
+        with mock.patch('attendance.views.get_recognition_pool', return_value=pool), \
+                mock.patch.object(pool, 'submit', wraps=pool.submit) as submit, \
+                mock.patch('concurrent.futures.ProcessPoolExecutor') as executor:
+            self.client.post(reverse('enroll_students'), upload)
+        self.assertEqual(submit.call_count, 3)
+        executor.assert_not_called()
+
+        upload['photos'].seek(0)
+        upload['roster'].seek(0)
+        Student.objects.all().delete()
+        with mock.patch('attendance.views.get_recognition_pool', return_value=pool), \
+                mock.patch.object(pool, 'submit', side_effect=RecognitionBusy):
+            response = self.client.post(reverse('enroll_students'), upload)
+        self.assertEqual(response.status_code, 429)
+        self.assertFalse(Student.objects.exists())
+
+
+@override_settings(FACE_MODELS_STUB=True, ENROLLMENT_WORKERS=1)
+class EnrollmentPhotoQualityTests(TestCase):
+    # Runs the real encode_photo on the stub models (EnrollmentTests patch the encoder out)
+    def setUp(self):
+        patcher = mock.patch.object(utils, '_models', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_rejected_photos_report_the_quality_problem(self):
+        from .benchmarks.fixtures import degraded_face_frame, face_patch, jpeg
+        from .enrollment import encode_photo, encode_photos
+        from .quality import MESSAGES
+        from .stub_models import describe
+
+        photos = [jpeg(degraded_face_frame(1)), jpeg(degraded_face_frame(2, 'too_dark')), jpeg(degraded_face_frame(3, 'too_small'))]
+        with self.assertRaisesMessage(ValueError, MESSAGES['too_small']):
+            encode_photo(photos[2])
+
+        (encoding, error), *rejected = encode_photos(photos)
+        self.assertIsNone(error)
+        np.testing.assert_allclose(decode_encoding(encoding), describe(face_patch(1)), atol=0.05)
+        self.assertEqual(rejected, [(None, MESSAGES['too_dark']), (None, MESSAGES['too_small'])])
+
+
+class AdminChangelistQueryTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User
+        self.client.force_login(User.objects.create_superuser('admin'))
+        self.subjects = [Subject.objects.create(name=f'Subject {i}') for i in range(3)]
+
+    def add_rows(self, start, count):
+        for i in range(start, start + count):
+            student = make_student(i, make_encoding(i))
+            student.subjects.add(*self.subjects)
+            teacher = Teacher.objects.create(name=f'T{i}', password='x')
+            teacher.subjects.add(*self.subjects)
+            for subject in self.subjects:
+                Attendance.objects.create(student=student, subject=subject, date=date(2025, 2, 3), status='Present')
+                StudentTermSummary.objects.create(student=student, subject=subject, term_start=date(2025, 1, 1), present=1)
+
+    def changelist_queries(self, model):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(f'admin:attendance_{model}_changelist'))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        models = ('teacher', 'student', 'attendance', 'studenttermsummary', 'dailyattendancesummary')
+        self.add_rows(0, 1)
+        few = {model: self.changelist_queries(model) for model in models}
+        self.add_rows(1, 9)
+        many = {model: self.changelist_queries(model) for model in models}
+
+        self.assertEqual(few, many)
+
+    def test_large_unfiltered_attendance_count_is_estimated(self):
+        from .admin import EstimatedCountPaginator
+
+        self.add_rows(0, 2)
+        with mock.patch('attendance.admin.estimated_row_count', return_value=5_000_000):
+            response = self.client.get(reverse('admin:attendance_attendance_changelist'))
+            self.assertEqual(response.context['cl'].result_count, 5_000_000)
+
+            response = self.client.get(reverse('admin:attendance_attendance_changelist'), {'status__exact': 'Present'})
+            self.assertEqual(response.context['cl'].result_count, 6)
+
+        with mock.patch.object(EstimatedCountPaginator, 'estimate_threshold', 0):
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+            response = self.client.get(reverse('admin:attendance_attendance_changelist'))
+            self.assertEqual(response.context['cl'].result_count, 6)
+
+
+class EncodingFormatTests(TestCase):
+    def test_float32_decodes_as_view(self):
+        blob = encode_encoding(make_encoding(1), 'float32')
+
+        encoding = decode_encoding(blob)
+
+        self.assertEqual(len(blob), 12 + 128 * 4)
+        self.assertEqual(encoding.dtype, np.float32)
+        self.assertIs(encoding.base, blob)
+        np.testing.assert_allclose(encoding, make_encoding(1), rtol=1e-6)
+
+    def test_int8_is_close_enough_to_match(self):
+        blob = encode_encoding(make_encoding(1), 'int8')
+
+        self.assertEqual(len(blob), 12 + 128)
+        self.assertLess(np.linalg.norm(decode_encoding(blob) - make_encoding(1)), 0.02)
+
+    def test_legacy_and_foreign_blobs(self):
+        np.testing.assert_array_equal(decode_encoding(make_encoding(1).tobytes()), make_encoding(1))
+        other_model = bytearray(encode_encoding(make_encoding(1), 'float32'))
+        other_model[6] = 99
+        self.assertIsNone(decode_encoding(bytes(other_model)))
+        self.assertIsNone(decode_encoding(b'\x00' * 40))
+        self.assertIsNone(decode_encoding(b''))
+
+    def test_migration_converts_legacy_rows(self):
+        import importlib
+        from django.apps import apps
+        migration = importlib.import_module('attendance.migrations.0009_encoding_format_v1')
+        legacy = Student.objects.create(name='Old', rollno='1', photo='students/1.jpg', facial_encoding=make_encoding(1).tobytes())
+        make_student(2, make_encoding(2))
+
+        migration.to_v1(apps, None)
+        blob = bytes(Student.objects.get(pk=legacy.pk).facial_encoding)
+        self.assertEqual(len(blob), 12 + 128 * 4)
+        np.testing.assert_allclose(decode_encoding(blob), make_encoding(1), rtol=1e-6)
+
+        migration.to_legacy(apps, None)
+        self.assertEqual(len(Student.objects.get(pk=legacy.pk).facial_encoding), 128 * 8)
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'SQLite tuning')
+class SQLiteTuningTests(TestCase):
+    def test_connection_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+
+
+def timed_job():
+    with stage('test_stage'):
+        time.sleep(0.005)
+    return 'done'
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        use_fresh_gallery(self)
+        self.subject = Subject.objects.create(name='Maths')
+        self.student = make_student(1, make_encoding(1))
+        self.student.subjects.add(self.subject)
+        session = self.client.session
+        session['subject'] = self.subject.name
+        session.save()
+
+    def test_pool_returns_stage_timings_with_result(self):
+        result, stages = collect_stages(RecognitionPool(0, 0, 5).run, timed_job)
+
+        self.assertEqual(result, 'done')
+        self.assertGreaterEqual(stages['test_stage'], 0.005)
+        self.assertIn('queue_wait', stages)
+
+    def test_capture_is_logged_and_exported(self):
+        jpeg = cv2.imencode('.jpg', np.zeros((8, 8, 3), dtype=np.uint8))[1].tobytes()
+        with mock.patch('attendance.views.get_face_encoding_from_frame', return_value=make_encoding(1)), \
+                self.assertLogs('attendance.requests', 'INFO') as logs:
+            self.client.post(reverse('capture_face'), data=jpeg, content_type='image/jpeg')
+
+        line = json.loads(logs.records[-1].getMessage())
+        self.assertEqual((line['view'], line['status']), ('capture_face', 200))
+        self.assertEqual(set(line['stages_ms']), {'image_digest', 'imdecode', 'queue_wait', 'gallery_match', 'attendance_write'})
+
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('# TYPE attendance_stage_seconds histogram', body)
+        self.assertRegex(body, r'attendance_stage_seconds_count\{stage="gallery_match"\} [1-9]')
+        self.assertRegex(body, r'attendance_request_seconds_bucket\{view="capture_face",status="200",le="\+Inf"\} [1-9]')
+        self.assertIn('attendance_gallery_size 1\n', body)
+        self.assertIn('attendance_recognition_pending ', body)
+
+
+@override_settings(FACE_MODELS_STUB=True)
+class BenchmarkSuiteTests(TestCase):
+    def setUp(self):
+        use_fresh_gallery(self)
+        patcher = mock.patch.object(utils, '_models', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_stub_models_recognise_synthetic_faces_end_to_end(self):
+        from .benchmarks.fixtures import face_frame, face_patch, jpeg
+        from .stub_models import describe
+
+        subject = Subject.objects.create(name='Maths')
+        students = [make_student(i, describe(face_patch(i))) for i in range(3)]
+        for student in students:
+            student.subjects.add(subject)
+        session = self.client.session
+        session['subject'] = subject.name
+        session.save()
+
+        response = self.client.post(reverse('capture_faces_batch'), jpeg(face_frame([2, 0])), content_type='image/jpeg')
+
+        self.assertEqual([face['student_id'] for face in response.json()['faces']], [students[2].id, students[0].id])
+
+    def test_compare_flags_regressions_in_either_direction(self):
+        from .benchmarks.suite import compare
+
+        baseline = {'results': {'matcher': {'n1000_single_per_s': 1000.0, 'p50_ms': 10.0, 'new_per_s': None}}}
+        report = {'results': {'matcher': {'n1000_single_per_s': 800.0, 'p50_ms': 10.5, 'new_per_s': 5.0}}}
+
+        self.assertEqual([r[:2] for r in compare(report, baseline, 0.1)], [('matcher', 'n1000_single_per_s')])
+        report['results']['matcher']['p50_ms'] = 12.0
+        self.assertEqual(len(compare(report, baseline, 0.1)), 2)
+
+    def test_run_benchmarks_writes_json_and_checks_baseline(self):
+        from django.core.management.base import CommandError
+
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'results.json')
+            with mock.patch('attendance.benchmarks.suite.CASES', {'fake': lambda quick: {'work_per_s': 100.0}}):
+                call_command('run_benchmarks', '--quick', '--output', output, stdout=StringIO(), stderr=StringIO())
+                with open(output) as f:
+                    self.assertEqual(json.load(f)['results'], {'fake': {'work_per_s': 100.0}})
+
+                with open(output, 'w') as f:
+                    json.dump({'results': {'fake': {'work_per_s': 200.0}}}, f)
+                with self.assertRaises(CommandError):
+                    call_command('run_benchmarks', '--baseline', output, stdout=StringIO(), stderr=StringIO())
+
+
+class CaptureCacheTests(TestCase):
+    def setUp(self):
+        use_fresh_gallery(self)
+        self.subject = Subject.objects.create(name='Maths')
+        self.student = make_student(1, make_encoding(1))
+        self.student.subjects.add(self.subject)
+        session = self.client.session
+        session['subject'] = self.subject.name
+        session.save()
+
+    def test_lru_eviction_and_expiry(self):
+        now = [0.0]
+        cache = capture_cache.TTLCache('test', maxsize=2, ttl=10, clock=lambda: now[0])
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)  # evicts b, the least recently used
+
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+        now[0] = 10.0
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual((cache.hits, cache.misses, cache.evictions), (3, 2, 1))
+        self.assertEqual(cache.hit_rate, 0.6)
+
+        disabled = capture_cache.TTLCache('test', maxsize=0, ttl=10)
+        disabled.put('a', 1)
+        self.assertIsNone(disabled.get('a'))
+
+    @override_settings(FACE_MODELS_STUB=True)
+    def test_different_faces_on_the_same_background_do_not_share_a_cache_entry(self):
+        from .benchmarks.fixtures import face_patch, jpeg
+        from .stub_models import describe
+
+        patcher = mock.patch.object(utils, '_models', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.student.facial_encoding = encode_encoding(describe(face_patch(1, 100)))
+        self.student.save()
+        other = make_student(2, describe(face_patch(2, 100)))
+        other.subjects.add(self.subject)
+        # A kiosk: fixed (dark, noisy) background, the face always in the same spot
+        background = np.random.default_rng(0).integers(0, 12, size=(720, 1280, 3), dtype=np.uint8)
+        names = []
+        for seed in (1, 2):
+            frame = background.copy()
+            frame[300:400, 600:700] = face_patch(seed, 100)
+            response = self.client.post(reverse('capture_face'), jpeg(frame), content_type='image/jpeg')
+            names.append(response.json()['message'])
+
+        self.assertEqual(names, [f"Attendance Done for {self.student.name}!", f"Attendance Done for {other.name}!"])
+        self.assertEqual(capture_cache.get_frame_cache().hits, 0)
+        self.assertEqual(Attendance.objects.filter(subject=self.subject).count(), 2)
+
+    def test_repeated_capture_skips_recognition_and_database_write(self):
+        from .benchmarks.fixtures import face_frame, jpeg
+
+        frame = jpeg(face_frame([1]))
+        with mock.patch('attendance.views.get_face_encoding_from_frame', return_value=make_encoding(1)) as encode:
+            first = self.client.post(reverse('capture_face'), frame, content_type='image/jpeg')
+            with CaptureQueriesContext(connection) as queries:
+                second = self.client.post(reverse('capture_face'), frame, content_type='image/jpeg')
+
+        self.assertEqual(first.json(), second.json())
+        encode.assert_called_once()
+        self.assertFalse([q for q in queries if 'attendance_attendance' in q['sql']])
+        self.assertEqual(capture_cache.get_frame_cache().hits, 1)
+        self.assertEqual(capture_cache.get_marked_cache().hits, 1)
+
+
+@override_settings(FACE_MODELS_STUB=True)
+class StreamingTests(TestCase):
+    def setUp(self):
+        use_fresh_gallery(self)
+        patcher = mock.patch.object(utils, '_models', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        from .stub_models import describe
+        from .benchmarks.fixtures import face_patch
+
+        self.subject = Subject.objects.create(name='Maths')
+        self.students = [make_student(i, describe(face_patch(i, 64))) for i in range(2)]
+        for student in self.students:
+            student.subjects.add(self.subject)
+        session = self.client.session
+        session['subject'] = self.subject.name
+        session.save()
+        self.cookie = f'{settings.SESSION_COOKIE_NAME}={session.session_key}'.encode()
+
+    def connect(self, headers=None):
+        from asgiref.testing import ApplicationCommunicator
+        from attendance_system.asgi import application
+
+        if headers is None:
+            headers = [(b'host', b'testserver'), (b'cookie', self.cookie)]
+        return ApplicationCommunicator(application, {'type': 'websocket', 'path': '/ws/capture/', 'headers': headers})
+
+    def test_processor_detects_every_k_frames_and_describes_each_face_once(self):
+        from .benchmarks.fixtures import face_video
+        from .streaming import StreamProcessor
+
+        video = face_video([0, 1], 12, speed=3)
+        processor = StreamProcessor(detect_every=5)
+        with mock.patch('attendance.streaming.detect_faces', wraps=utils.detect_faces) as detect:
+            new_tracks = [processor.process(frame) for frame in video]
+
+        self.assertEqual(detect.call_count, 3)  # frames 0, 5 and 10
+        self.assertEqual([len(tracks) for tracks in new_tracks], [2] + [0] * 11)
+        self.assertEqual(processor.descriptors, 2)
+        self.assertEqual([track.id for track in processor.tracks], [1, 2])
+        # The trackers followed the faces to their last position
+        expected = utils.detect_faces(cv2.cvtColor(video[-1], cv2.COLOR_BGR2GRAY))
+        for track, face in zip(processor.tracks, expected):
+            self.assertLessEqual(abs(track.box[0] - face.left()), 2)
+
+        for _ in range(5):  # up to and including the next detection
+            processor.process(np.zeros_like(video[0]))
+        self.assertEqual(processor.tracks, [])
+
+    async def test_stream_marks_students_present(self):
+        from .benchmarks.fixtures import face_video, jpeg
+
+        communicator = self.connect()
+        await communicator.send_input({'type': 'websocket.connect'})
+        self.assertEqual(await communicator.receive_output(), {'type': 'websocket.accept'})
+
+        messages = []
+        for frame in face_video([1, 0], 6):
+            await communicator.send_input({'type': 'websocket.receive', 'bytes': jpeg(frame)})
+            messages.append(json.loads((await communicator.receive_output(5))['text']))
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(5)
+
+        first = messages[0]['faces']
+        self.assertEqual([face['name'] for face in first], [self.students[1].name, self.students[0].name])
+        self.assertEqual([face['status'] for face in first], ['marked', 'marked'])
+        self.assertEqual({tuple(face['track'] for face in m['faces']) for m in messages}, {(1, 2)})
+        self.assertEqual(await Attendance.objects.filter(subject=self.subject, status='Present').acount(), 2)
+
+    async def test_frames_arriving_while_busy_are_dropped_not_queued(self):
+        import asyncio
+        import threading
+
+        started, release = threading.Event(), threading.Event()
+        processed = []
+
+        class SlowProcessor:
+            frames, tracks, last_rejected = 0, [], []
+
+            def process_jpeg(self, data):
+                started.set()
+                release.wait(5)
+                processed.append(data)
+                self.frames += 1
+                return []
+
+        communicator = self.connect()
+        with mock.patch('attendance.streaming.StreamProcessor', SlowProcessor):
+            await communicator.send_input({'type': 'websocket.connect'})
+            await communicator.receive_output()
+            await communicator.send_input({'type': 'websocket.receive', 'bytes': b'a'})
+            await asyncio.to_thread(started.wait, 5)
+            for data in (b'b', b'c', b'd'):
+                await communicator.send_input({'type': 'websocket.receive', 'bytes': data})
+            await communicator.receive_nothing(0.1)  # let the reader take them
+            release.set()
+            messages = [json.loads((await communicator.receive_output(5))['text']) for _ in range(2)]
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(5)
+
+        self.assertEqual(processed, [b'a', b'd'])
+        self.assertEqual(messages[-1]['dropped'], 2)
+
+    async def test_frames_are_dropped_while_the_recognition_pool_is_full(self):
+        import threading
+
+        built_on = []
+
+        class CountingProcessor:
+            frames, tracks, last_rejected = 0, [], []
+
+            def __init__(self):
+                built_on.append(threading.get_ident())
+
+            def process_jpeg(self, data):
+                self.frames += 1
+                return []
+
+        full = {'value': True}
+        communicator = self.connect()
+        with mock.patch('attendance.streaming.StreamProcessor', CountingProcessor), \
+                mock.patch('attendance.recognition.RecognitionPool.has_room', lambda pool: not full['value']):
+            await communicator.send_input({'type': 'websocket.connect'})
+            self.assertEqual(await communicator.receive_output(), {'type': 'websocket.accept'})
+            await communicator.send_input({'type': 'websocket.receive', 'bytes': b'a'})
+            await communicator.receive_nothing(0.1)
+            full['value'] = False
+            await communicator.send_input({'type': 'websocket.receive', 'bytes': b'b'})
+            message = json.loads((await communicator.receive_output(5))['text'])
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(5)
+
+        self.assertEqual((message['frame'], message['dropped']), (1, 1))
+        # The processor (and so the models) was loaded off the event loop
+        self.assertNotEqual(built_on, [threading.get_ident()])
+
+    @override_settings(STREAM_MAX_ACTIVE=1)
+    async def test_connections_beyond_the_stream_limit_are_closed(self):
+        with mock.patch('attendance.streaming._active_streams', 1):
+            communicator = self.connect()
+            await communicator.send_input({'type': 'websocket.connect'})
+            self.assertEqual(await communicator.receive_output(), {'type': 'websocket.accept'})
+            self.assertEqual(await communicator.receive_output(), {'type': 'websocket.close', 'code': 1013})
+            await communicator.wait()
+
+    async def test_rejects_connections_without_a_subject_or_from_other_sites(self):
+        for headers in (
+            [(b'host', b'testserver')],
+            [(b'host', b'testserver'), (b'cookie', self.cookie), (b'origin', b'http://evil.example')],
+        ):
+            communicator = self.connect(headers)
+            await communicator.send_input({'type': 'websocket.connect'})
+            self.assertEqual(await communicator.receive_output(), {'type': 'websocket.close', 'code': 4403})
+            await communicator.wait()
+
+
+@override_settings(FACE_MODELS_STUB=True)
+class QualityGateTests(TestCase):
+    def setUp(self):
+        use_fresh_gallery(self)
+        patcher = mock.patch.object(utils, '_models', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.subject = Subject.objects.create(name='Maths')
+        session = self.client.session
+        session['subject'] = self.subject.name
+        session.save()
+
+    def test_defective_faces_are_rejected_before_the_descriptor(self):
+        from .benchmarks.fixtures import DEFECTS, degraded_face_frame
+        from .quality import RejectedFace
+
+        for defect in DEFECTS:
+            result, stages = collect_stages(utils.get_face_encoding_from_frame, degraded_face_frame(1, defect))
+            self.assertEqual(result, RejectedFace(defect))
+            self.assertNotIn('descriptor', stages)
+
+        result, stages = collect_stages(utils.get_face_encoding_from_frame, degraded_face_frame(1))
+        self.assertEqual(result.shape, (128,))
+        self.assertIn('quality', stages)
+        with override_settings(FACE_QUALITY_CHECKS=False):
+            self.assertEqual(utils.get_face_encoding_from_frame(degraded_face_frame(1, 'blurry')).shape, (128,))
+
+    def test_min_size_scales_with_narrow_stream_frames(self):
+        from .benchmarks.fixtures import face_frame
+        from .quality import RejectedFace
+        from .streaming import StreamProcessor
+
+        # A face at check-in distance: 96 px in a 640 px capture, 48 px in a 320 px stream frame
+        for width, size in ((640, 96), (320, 48)):
+            frame = face_frame([1], width=width, height=width * 3 // 4, size=size)
+            self.assertEqual(utils.get_face_encoding_from_frame(frame).shape, (128,))
+        processor = StreamProcessor()
+        self.assertEqual(len(processor.process(frame)), 1)
+        self.assertEqual(processor.rejected, {})
+
+        # Scaled down, not switched off
+        frame = face_frame([1], width=320, height=240, size=24)
+        self.assertEqual(utils.get_face_encoding_from_frame(frame), RejectedFace('too_small'))
+
+    def test_head_pose_from_landmarks(self):
+        from .quality import MODEL_LANDMARKS, MODEL_POINTS, check_pose, head_pose
+
+        class Shape:
+            num_parts = 68
+
+            def __init__(self, points):
+                self.points = dict(zip(MODEL_LANDMARKS, points))
+
+            def part(self, i):
+                return mock.Mock(x=self.points[i][0], y=self.points[i][1])
+
+        def landmarks(yaw, pitch):
+            rotation = cv2.Rodrigues(np.radians([0.0, yaw, 0.0]))[0] @ cv2.Rodrigues(np.radians([pitch, 0.0, 0.0]))[0]
+            camera = np.array([[640, 0, 320], [0, 640, 240], [0, 0, 1]], dtype=np.float64)
+            points, _ = cv2.projectPoints(MODEL_POINTS, cv2.Rodrigues(rotation)[0], np.array([0, 0, 3000.0]), camera, None)
+            return Shape(points.reshape(-1, 2).round())
+
+        yaw, pitch = head_pose(landmarks(20, 10), (480, 640))
+        self.assertAlmostEqual(yaw, 20, delta=2)
+        self.assertAlmostEqual(pitch, 10, delta=2)
+        self.assertIsNone(check_pose(landmarks(5, -5), (480, 640)))
+        self.assertEqual(check_pose(landmarks(50, 0), (480, 640)), 'off_angle')
+        self.assertEqual(check_pose(landmarks(0, 40), (480, 640)), 'off_angle')
+
+    def test_capture_tells_the_client_why_a_face_was_rejected(self):
+        from .benchmarks.fixtures import degraded_face_frame, jpeg
+        from .quality import FACE_QUALITY, MESSAGES
+
+        before = dict(FACE_QUALITY._values)
+        response = self.client.post(reverse('capture_face'), jpeg(degraded_face_frame(1, 'too_small')), content_type='image/jpeg')
+
+        self.assertEqual(response.json(), {'message': MESSAGES['too_small'], 'reason': 'too_small'})
+        self.assertEqual(FACE_QUALITY._values.get(('too_small',), 0) - before.get(('too_small',), 0), 1)
+
+    def test_batch_capture_marks_good_faces_and_lists_rejected_ones(self):
+        from .benchmarks.fixtures import face_frame, face_patch, jpeg
+        from .stub_models import describe
+
+        student = make_student(1, describe(face_patch(1)))
+        student.subjects.add(self.subject)
+        frame = face_frame([1])
+        frame[10:40, 10:40] = face_patch(2, 30)  # a face in the back row, too small to trust
+
+        response = self.client.post(reverse('capture_faces_batch'), jpeg(frame), content_type='image/jpeg')
 
-# Create your tests here.
+        faces = response.json()['faces']
+        self.assertEqual(sorted((face['status'], face.get('reason')) for face in faces), [('marked', None), ('rejected', 'too_small')])
+        self.assertTrue(Attendance.objects.filter(student=student, subject=self.subject).exists())
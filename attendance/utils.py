@@ -1,33 +1,195 @@
-import dlib
+import importlib.util
+import os
+import threading
+
 import cv2
 import numpy as np
 from django.conf import settings
-detector = dlib.get_frontal_face_detector()
-shape_predictor_path = settings.SHAPE_PREDICTOR_PATH
-predictor = dlib.shape_predictor(shape_predictor_path)
-face_rec_model = dlib.face_recognition_model_v1(settings.FACE_REC_MODEL_PATH)
+from .metrics import stage
+from .quality import RejectedFace, check_face, check_pose
+from .gallery import MATCH_THRESHOLD, best_match, decode_encoding, get_gallery
+
+
+class FaceModels:
+    """The dlib detector, landmark predictor and ResNet descriptor model."""
+
+    def __init__(self):
+        import dlib
+
+        self.rectangle = dlib.rectangle
+        self.full_object_detections = dlib.full_object_detections
+        self.correlation_tracker = dlib.correlation_tracker
+        self.detector = dlib.get_frontal_face_detector()
+        self.predictor = dlib.shape_predictor(settings.SHAPE_PREDICTOR_PATH)
+        self.face_rec_model = dlib.face_recognition_model_v1(settings.FACE_REC_MODEL_PATH)
+
+
+def dlib_models_available():
+    """Whether dlib is installed and both model files are present."""
+    return (
+        importlib.util.find_spec('dlib') is not None
+        and os.path.exists(settings.SHAPE_PREDICTOR_PATH)
+        and os.path.exists(settings.FACE_REC_MODEL_PATH)
+    )
+
+
+_models = None
+_models_lock = threading.Lock()
+
+
+def get_models():
+    # The models take seconds and ~100 MB to load, so only processes that
+    # actually recognise faces pay for them (not migrate, mark_absent, ...).
+    global _models
+    if _models is None:
+        with _models_lock:
+            if _models is None:
+                if settings.FACE_MODELS_STUB:
+                    from .stub_models import StubFaceModels
+                    _models = StubFaceModels()
+                else:
+                    _models = FaceModels()
+    return _models
+
+
+def warm_up():
+    """Load the models now instead of on the first capture.
+
+    Called from the WSGI/ASGI entry points when FACE_MODELS_WARMUP is set; with
+    gunicorn --preload that happens in the master, before workers are forked,
+    so every worker shares the loaded model pages copy-on-write.
+    """
+    get_models()
+
+
+def detect_faces(gray, max_width=None, upsample=None):
+    """Run the HOG detector on a downscaled copy of ``gray``.
+
+    Frames wider than ``max_width`` are shrunk before detection and the boxes
+    are mapped back to full-resolution coordinates, so the landmark and
+    descriptor passes still see every pixel.
+    """
+    if max_width is None:
+        max_width = settings.FACE_DETECTION_MAX_WIDTH
+    if upsample is None:
+        upsample = settings.FACE_DETECTION_UPSAMPLE
+
+    models = get_models()
+    height, width = gray.shape[:2]
+    if not max_width or width <= max_width:
+        with stage('detect'):
+            return list(models.detector(gray, upsample))
+
+    scale = max_width / width
+    with stage('detect'):
+        small = cv2.resize(gray, (max_width, round(height * scale)), interpolation=cv2.INTER_AREA)
+        faces = models.detector(small, upsample)
+    return [
+        models.rectangle(
+            round(face.left() / scale), round(face.top() / scale),
+            round(face.right() / scale), round(face.bottom() / scale),
+        )
+        for face in faces
+    ]
+
+
+def decode_image(buffer):
+    # np.frombuffer only wraps the bytes, so the upload goes to cv2.imdecode without a copy
+    with stage('imdecode'):
+        frame = cv2.imdecode(np.frombuffer(buffer, np.uint8), cv2.IMREAD_COLOR)  # Decode the image into an OpenCV format
+    if frame is None:
+        raise ValueError("Could not decode the image.")
+    return frame
+
+
+def run_on_image(fn, buffer):
+    """Recognition job: decode an uploaded image and call ``fn(frame)`` on it."""
+    return fn(decode_image(buffer))
+
+
 def get_face_encoding_from_frame(frame):
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    faces = detector(gray)
+    """Return the encoding of the first face in the frame.
+
+    None if there is no face, or a RejectedFace if the face failed the
+    quality checks (the descriptor is then never computed).
+    """
+    with stage('grayscale'):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    faces = detect_faces(gray)
     
     if len(faces) == 0:
         return None
     
     # Assume we take the first face detected
     face = faces[0]
-    landmarks = predictor(gray, face)
-    encoding = np.array(face_rec_model.compute_face_descriptor(frame, landmarks))
+    with stage('quality'):
+        reason = check_face(gray, face)
+    if reason:
+        return RejectedFace(reason)
+    models = get_models()
+    with stage('landmarks'):
+        landmarks = models.predictor(gray, face)
+    with stage('quality'):
+        reason = check_pose(landmarks, gray.shape)
+    if reason:
+        return RejectedFace(reason)
+    with stage('descriptor'):
+        encoding = np.array(models.face_rec_model.compute_face_descriptor(frame, landmarks))
     return encoding
-def match_face(encoding, database_encodings, threshold=0.6):
-    best_match = None
-    min_distance = float("inf")
-    
-    for db_encoding in database_encodings:
-        distance = np.linalg.norm(encoding - np.frombuffer(db_encoding))
-        print(f"comparing encodings: Distance = {distance}, Threshold = {threshold}")
-        
-        if distance < threshold and distance < min_distance:
-            min_distance = distance
-            best_match = db_encoding
-            
-    return best_match is not None
\ No newline at end of file
+
+
+def get_face_encodings_from_frame(frame):
+    """Detect every face in the frame and return a list of (box, encoding).
+
+    All descriptors are computed in a single batched dlib call. Faces that
+    fail the quality checks get a RejectedFace instead of an encoding.
+    ``box`` is a plain (left, top, right, bottom) tuple so results can be
+    returned from a recognition worker process.
+    """
+    with stage('grayscale'):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    faces = detect_faces(gray)
+
+    if len(faces) == 0:
+        return []
+
+    models = get_models()
+    results = [None] * len(faces)
+    accepted = []
+    shapes = models.full_object_detections()
+    for i, face in enumerate(faces):
+        with stage('quality'):
+            reason = check_face(gray, face)
+        if not reason:
+            with stage('landmarks'):
+                shape = models.predictor(gray, face)
+            with stage('quality'):
+                reason = check_pose(shape, gray.shape)
+        if reason:
+            results[i] = RejectedFace(reason)
+        else:
+            accepted.append(i)
+            shapes.append(shape)
+    if accepted:
+        with stage('descriptor'):
+            descriptors = models.face_rec_model.compute_face_descriptor(frame, shapes)
+        for i, descriptor in zip(accepted, descriptors):
+            results[i] = np.array(descriptor)
+    return [
+        ((face.left(), face.top(), face.right(), face.bottom()), result)
+        for face, result in zip(faces, results)
+    ]
+
+
+def match_face(encoding, database_encodings=None, threshold=MATCH_THRESHOLD):
+    # Without explicit encodings, search the process-wide student gallery
+    if database_encodings is None:
+        student_id, _ = get_gallery().match(encoding, threshold)
+        return student_id is not None
+
+    encodings = [decode_encoding(db_encoding) for db_encoding in database_encodings]
+    encodings = [e for e in encodings if e is not None]
+    if not encodings:
+        return False
+    rows, _ = best_match(encoding, np.vstack(encodings), threshold)
+    return bool(rows[0] >= 0)
@@ -1,76 +1,366 @@
 from django.shortcuts import render, redirect
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.conf import settings
+from asgiref.sync import sync_to_async
 from django.views.decorators.csrf import csrf_exempt
+import asyncio
 import base64
 import json
+import logging
+import zipfile
 from django.contrib import messages
-from .models import Student, Attendance, Teacher, Subject
+from .models import Student, Attendance, Teacher, Subject, DailyAttendanceSummary
 from .forms import TeacherLoginForm, StudentRegistrationForm
 from datetime import timedelta, date
-from .utils import get_face_encoding_from_frame, match_face
-import cv2
+from .utils import get_face_encoding_from_frame, get_face_encodings_from_frame, match_face, run_on_image
+from .gallery import get_gallery
+from .rollups import create_attendance, term_start
+from .pagination import InvalidCursor, filter_window, history_window, keyset_page, parse_date
+from .export import EXPORT_FORMATS, export_rows
+from .enrollment import encode_photo, enroll_students, rows_from_zip
+from .capture_cache import get_frame_cache, get_marked_cache, image_digest
+from .quality import RejectedFace, record_results
+from .metrics import instrumented, render as render_metrics, stage
+from .recognition import RecognitionBusy, RecognitionTimeout, get_recognition_pool
 import numpy as np
-from collections import defaultdict
+from django.db.models import Exists, OuterRef, Sum
 from django.contrib.auth.decorators import login_required
 
 
+logger = logging.getLogger(__name__)
+
+
+def decode_data_url(image_data):
+    # Decode the Base64 image data
+    with stage('base64_decode'):
+        return base64.b64decode(image_data.split(',')[1])  # Ignore the "data:image/jpeg;base64," part
+
+
+def image_from_request(request):
+    """Return the encoded image bytes of a POST, or None if it carries no image.
+
+    Accepts a raw ``image/*`` body (what capture.html sends with canvas.toBlob),
+    a multipart form with an ``image`` file, or the legacy JSON body holding a
+    base64 data URL.
+    """
+    if request.content_type.startswith('image/'):
+        buffer = request.body
+    elif request.content_type == 'multipart/form-data':
+        upload = request.FILES.get('image')
+        if upload is None:
+            return None
+        # Small uploads are held in a BytesIO whose buffer can be shared directly
+        buffer = upload.file.getbuffer() if hasattr(upload.file, 'getbuffer') else upload.read()
+    elif not request.body:
+        return None
+    else:
+        # Parse the JSON data from the request body
+        data = json.loads(request.body)
+        image_data = data.get('image')  # Get the image data from the JSON payload
+        if not image_data:
+            return None
+        buffer = decode_data_url(image_data)
+
+    if not len(buffer):
+        return None
+    return buffer
+
+
+def recognition_busy_response():
+    response = JsonResponse({'message': "The server is busy recognising other faces. Please retry in a moment."}, status=429)
+    response['Retry-After'] = '1'
+    return response
+
+
+def recognition_timeout_response():
+    return JsonResponse({'message': "Face recognition timed out. Please retry."}, status=503)
+
+
+_MISSING = object()
+
+
+def frame_cache_key(kind, data):
+    with stage('image_digest'):
+        return kind, image_digest(data)
+
+
+def recognise(kind, fn, data):
+    """Run ``fn`` on the decoded image on the recognition pool, unless the same upload was just recognised.
+
+    The image is decoded in the job too: worker processes get the compressed
+    upload rather than the full frame.
+    """
+    cache = get_frame_cache()
+    key = frame_cache_key(kind, data)
+    result = cache.get(key, _MISSING)
+    if result is _MISSING:
+        pool = get_recognition_pool()
+        result = pool.run(run_on_image, fn, bytes(data) if pool.workers else data)
+        record_results(result)
+        cache.put(key, result)
+    return result
+
+
+async def arecognise(kind, fn, data):
+    # Hashing, decoding and recognition all stay off the event loop thread
+    cache = get_frame_cache()
+    key = await asyncio.to_thread(frame_cache_key, kind, data)
+    result = cache.get(key, _MISSING)
+    if result is _MISSING:
+        pool = get_recognition_pool()
+        result = await pool.arun(run_on_image, fn, bytes(data) if pool.workers else data)
+        record_results(result)
+        cache.put(key, result)
+    return result
+
+
+def unmarked_students(student_ids, subject, day):
+    # Students not known (from this process's recent captures) to be marked already
+    marked = get_marked_cache()
+    return {student_id for student_id in student_ids if not marked.get((student_id, subject.id, day))}
+
+
+def remember_marked(student_ids, subject, day):
+    marked = get_marked_cache()
+    for student_id in student_ids:
+        marked.put((student_id, subject.id, day), True)
+
+
+def mark_present(student_ids, subject, day):
+    """Mark the given students present; return the ids that were newly marked."""
+    to_check = unmarked_students(student_ids, subject, day)
+    to_mark = set()
+    if to_check:
+        with stage('attendance_write'):
+            marked = create_attendance(
+                [Attendance(student_id=student_id, subject=subject, date=day, status='Present') for student_id in to_check],
+            )
+        to_mark = {attendance.student_id for attendance in marked}
+        remember_marked(to_check, subject, day)
+    return to_mark
+
+
+@instrumented
 def capture_face(request):
     if request.method == 'GET':
         return render(request, 'capture.html')
     
     if request.method == 'POST':
         try:
-            # Parse the JSON data from the request body
-            data = json.loads(request.body)
-            image_data = data.get('image')  # Get the image data from the JSON payload
-
-            if not image_data:
+            data = image_from_request(request)
+            if data is None:
                 return JsonResponse({'message': 'No image data provided.'})
 
-            # Decode the Base64 image data
-            image_bytes = base64.b64decode(image_data.split(',')[1])  # Ignore the "data:image/jpeg;base64," part
-            np_arr = np.frombuffer(image_bytes, np.uint8)
-            frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)  # Decode the image into an OpenCV format
-            
             # Process the image to get encoding
-            encoding = get_face_encoding_from_frame(frame)
+            encoding = recognise('single', get_face_encoding_from_frame, data)
             if encoding is None:
                 return JsonResponse({'message': "No face detected. Please retry."})
+            if isinstance(encoding, RejectedFace):
+                return JsonResponse({'message': encoding.message, 'reason': encoding.reason})
 
-            # Check in database for a match
-            database_students = Student.objects.all()
-            matched_student = None
-            min_distance = float("inf")
-            
-            for student in database_students:
-                db_encoding = np.frombuffer(student.facial_encoding)  # Get stored encoding from database
-                if db_encoding.size == 0:  # Skip invalid or empty encodings
-                    continue
-                
-                # Compare the encodings
-                distance = np.linalg.norm(encoding - db_encoding)
-                if distance < 0.6 and distance < min_distance:
-                    min_distance = distance
-                    matched_student = student
+            # Only students enrolled in the session's subject can be marked, so
+            # search just that subject's partition of the gallery
+            subject = Subject.objects.filter(name=request.session.get('subject')).first()
+            if subject is None and not settings.FACE_MATCH_GLOBAL_FALLBACK:
+                return JsonResponse({'message': "No subject selected. Please log in again."})
+
+            with stage('gallery_match'):
+                student_id, distance = get_gallery().match(encoding, subject_id=subject.id if subject else None)
+            matched_student = Student.objects.filter(pk=student_id).first() if student_id is not None else None
+
+            if matched_student and subject is None:
+                return JsonResponse({'message': f"Recognised {matched_student.name}, but no subject is selected to mark attendance for."})
 
             if matched_student:
-                # Mark attendance
-                today = date.today()
-                attendance, created = Attendance.objects.get_or_create(student=matched_student, date=today)
-                if created:
-                    attendance.status = 'Present'
-                    attendance.save()
+                # Mark attendance (repeat captures of a student marked moments ago skip the database)
+                mark_present([matched_student.id], subject, date.today())
                 return JsonResponse({'message': f"Attendance Done for {matched_student.name}!"})
 
             return JsonResponse({'message': "Unknown Face! Can't find in database."})
+        except RecognitionBusy:
+            return recognition_busy_response()
+        except RecognitionTimeout:
+            return recognition_timeout_response()
         except Exception as e:
-            print("Error processing image:", e)
+            logger.exception("Error processing image")
             return JsonResponse({'message': f"An error occurred during processing: {str(e)}"})
         
     return JsonResponse({'message': "Invalid request method."})
 
 
+def split_rejected(faces):
+    # (accepted, rejected) lists of the (box, encoding) pairs from get_face_encodings_from_frame
+    accepted = [face for face in faces if not isinstance(face[1], RejectedFace)]
+    rejected = [face for face in faces if isinstance(face[1], RejectedFace)]
+    return accepted, rejected
+
+
+def batch_response(faces, student_ids, distances, names, marked, rejected=()):
+    results = []
+    for (box, _), student_id, distance in zip(faces, student_ids, distances):
+        result = {
+            'box': dict(zip(('left', 'top', 'right', 'bottom'), box)),
+            'student_id': student_id,
+            'name': names.get(student_id),
+            'distance': distance if np.isfinite(distance) else None,
+        }
+        if student_id is None:
+            result['status'] = 'unknown'
+        elif student_id in marked:
+            result['status'] = 'marked'
+        else:
+            result['status'] = 'already_marked'
+        results.append(result)
+    for box, rejection in rejected:
+        results.append({
+            'box': dict(zip(('left', 'top', 'right', 'bottom'), box)),
+            'student_id': None,
+            'name': None,
+            'distance': None,
+            'status': 'rejected',
+            'reason': rejection.reason,
+        })
+
+    return JsonResponse({
+        'message': f"Attendance marked for {len(marked)} of {len(faces) + len(rejected)} detected faces.",
+        'faces': results,
+    })
+
+
+@instrumented
+def capture_faces_batch(request):
+    """Recognise every face in one classroom photo and mark them all present."""
+    if request.method != 'POST':
+        return JsonResponse({'message': "Invalid request method."}, status=405)
+
+    subject = Subject.objects.filter(name=request.session.get('subject')).first()
+    if subject is None:
+        return JsonResponse({'message': "No subject selected. Please log in again."}, status=400)
+
+    try:
+        data = image_from_request(request)
+        if data is None:
+            return JsonResponse({'message': 'No image data provided.'}, status=400)
+
+        faces = recognise('batch', get_face_encodings_from_frame, data)
+        if not faces:
+            return JsonResponse({'message': "No face detected. Please retry.", 'faces': []})
+        faces, rejected = split_rejected(faces)
+        if not faces:
+            return batch_response([], [], [], {}, set(), rejected)
+
+        # One matrix operation for every face in the photo
+        with stage('gallery_match'):
+            student_ids, distances = get_gallery().match_many([encoding for _, encoding in faces], subject_id=subject.id)
+        matched_ids = {student_id for student_id in student_ids if student_id is not None}
+        names = dict(Student.objects.filter(pk__in=matched_ids).values_list('id', 'name'))
+
+        to_mark = mark_present(matched_ids, subject, date.today())
+        return batch_response(faces, student_ids, distances, names, to_mark, rejected)
+    except RecognitionBusy:
+        return recognition_busy_response()
+    except RecognitionTimeout:
+        return recognition_timeout_response()
+    except Exception as e:
+        logger.exception("Error processing image")
+        return JsonResponse({'message': f"An error occurred during processing: {str(e)}"}, status=500)
+
+
+# Async variants of the capture views for ASGI deployments (uvicorn/daphne with
+# attendance_system.asgi). Recognition is awaited on the worker pool and the
+# ORM is used through its async API, so one process can hold many captures in
+# flight while dlib runs.
+
+@instrumented
+async def capture_face_async(request):
+    if request.method == 'GET':
+        return await sync_to_async(render)(request, 'capture.html')
+
+    if request.method != 'POST':
+        return JsonResponse({'message': "Invalid request method."})
+
+    try:
+        data = await asyncio.to_thread(image_from_request, request)
+        if data is None:
+            return JsonResponse({'message': 'No image data provided.'})
+
+        encoding = await arecognise('single', get_face_encoding_from_frame, data)
+        if encoding is None:
+            return JsonResponse({'message': "No face detected. Please retry."})
+        if isinstance(encoding, RejectedFace):
+            return JsonResponse({'message': encoding.message, 'reason': encoding.reason})
+
+        subject = await Subject.objects.filter(name=await request.session.aget('subject')).afirst()
+        if subject is None and not settings.FACE_MATCH_GLOBAL_FALLBACK:
+            return JsonResponse({'message': "No subject selected. Please log in again."})
+
+        with stage('gallery_match'):
+            student_id, distance = await sync_to_async(get_gallery().match)(encoding, subject_id=subject.id if subject else None)
+        matched_student = await Student.objects.filter(pk=student_id).afirst() if student_id is not None else None
+
+        if matched_student and subject is None:
+            return JsonResponse({'message': f"Recognised {matched_student.name}, but no subject is selected to mark attendance for."})
+
+        if matched_student:
+            await sync_to_async(mark_present)([matched_student.id], subject, date.today())
+            return JsonResponse({'message': f"Attendance Done for {matched_student.name}!"})
+
+        return JsonResponse({'message': "Unknown Face! Can't find in database."})
+    except RecognitionBusy:
+        return recognition_busy_response()
+    except RecognitionTimeout:
+        return recognition_timeout_response()
+    except Exception as e:
+        logger.exception("Error processing image")
+        return JsonResponse({'message': f"An error occurred during processing: {str(e)}"})
+
 
+@instrumented
+async def capture_faces_batch_async(request):
+    if request.method != 'POST':
+        return JsonResponse({'message': "Invalid request method."}, status=405)
+
+    subject = await Subject.objects.filter(name=await request.session.aget('subject')).afirst()
+    if subject is None:
+        return JsonResponse({'message': "No subject selected. Please log in again."}, status=400)
+
+    try:
+        data = await asyncio.to_thread(image_from_request, request)
+        if data is None:
+            return JsonResponse({'message': 'No image data provided.'}, status=400)
+
+        faces = await arecognise('batch', get_face_encodings_from_frame, data)
+        if not faces:
+            return JsonResponse({'message': "No face detected. Please retry.", 'faces': []})
+        faces, rejected = split_rejected(faces)
+        if not faces:
+            return batch_response([], [], [], {}, set(), rejected)
+
+        with stage('gallery_match'):
+            student_ids, distances = await sync_to_async(get_gallery().match_many)(
+                [encoding for _, encoding in faces], subject_id=subject.id,
+            )
+        matched_ids = {student_id for student_id in student_ids if student_id is not None}
+        names = {pk: name async for pk, name in Student.objects.filter(pk__in=matched_ids).values_list('id', 'name')}
+
+        to_mark = await sync_to_async(mark_present)(matched_ids, subject, date.today())
+
+        return batch_response(faces, student_ids, distances, names, to_mark, rejected)
+    except RecognitionBusy:
+        return recognition_busy_response()
+    except RecognitionTimeout:
+        return recognition_timeout_response()
+    except Exception as e:
+        logger.exception("Error processing image")
+        return JsonResponse({'message': f"An error occurred during processing: {str(e)}"}, status=500)
+
+
+
+
+
+def metrics(request):
+    """Prometheus scrape endpoint for this server process."""
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 def teacher_login(request):
@@ -120,7 +410,26 @@ def teacher_dashboard(request):
     # Get students enrolled in any of the teacher's subjects
     students = Student.objects.filter(subjects__in=subjects_taught).distinct()
 
-    return render(request, 'teacher_dashboard.html', {'teacher': teacher, 'students': students})
+    # Attendance rate per subject this term, from one rollup row per day
+    this_term = term_start(date.today())
+    subject_totals = (
+        DailyAttendanceSummary.objects
+        .filter(subject__in=subjects_taught, date__gte=this_term)
+        .values('subject__name')
+        .annotate(present=Sum('present'), absent=Sum('absent'))
+        .order_by('subject__name')
+    )
+    attendance_rates = [
+        {**row, 'rate': round(100 * row['present'] / (row['present'] + row['absent'])) if row['present'] + row['absent'] else None}
+        for row in subject_totals
+    ]
+
+    return render(request, 'teacher_dashboard.html', {
+        'teacher': teacher,
+        'students': students,
+        'term_start': this_term,
+        'attendance_rates': attendance_rates,
+    })
 
 
 def register_student(request):
@@ -136,17 +445,30 @@ def register_student(request):
         if form.is_valid():
             rollno = form.cleaned_data.get('rollno')  # Get roll number from form
             try:
-                # Check if the student already exists
-                student, created = Student.objects.get_or_create(rollno=rollno, defaults=form.cleaned_data)
-                if not created:
+                student = Student.objects.filter(rollno=rollno).first()
+                if student is not None:
                     messages.info(request, f"Student {student.name} already exists. Adding the subjects.")
+                else:
+                    # Compute the face encoding now; without it the student can never be recognised
+                    photo = form.cleaned_data['photo']
+                    photo.seek(0)
+                    encoding = get_recognition_pool().run(encode_photo, photo.read())
+                    photo.seek(0)
+                    student = form.save(commit=False)
+                    student.facial_encoding = encoding
+                    student.save()
+            except ValueError as e:
+                messages.error(request, f"{e} Please upload a clear photo of the student's face.")
+                return redirect('register_student')
+            except (RecognitionBusy, RecognitionTimeout):
+                messages.error(request, "The server is busy. Please try again in a moment.")
+                return redirect('register_student')
             except Exception as e:
                 messages.error(request, f"Error while checking/creating student: {str(e)}")
                 return redirect('register_student')
 
             # Add the teacher's subjects to the student's subjects
             student.subjects.add(*teacher.subjects.all())  # Add all subjects
-            student.save()  # Save again to update ManyToMany relationship
 
             messages.success(request, f"Student {student.name} has been successfully registered under the teacher's subjects!")
             return redirect('teacher_dashboard')  # Redirect to the teacher dashboard
@@ -165,9 +487,34 @@ def register_student(request):
 
 
 
+def history_context(request, next_cursor, date_from, date_to):
+    # Template context shared by the paginated attendance history pages
+    next_query = None
+    if next_cursor:
+        params = request.GET.copy()
+        params['from'] = date_from.isoformat()
+        params['cursor'] = next_cursor
+        next_query = params.urlencode()
+    return {
+        'date_from': date_from,
+        'date_to': date_to,
+        'next_query': next_query,
+        'is_first_page': not request.GET.get('cursor'),
+    }
+
+
+def paginate_history(request, queryset):
+    date_from, date_to = history_window(request.GET)
+    queryset = filter_window(queryset, date_from, date_to)
+    try:
+        records, next_cursor = keyset_page(queryset, request.GET.get('cursor'))
+    except InvalidCursor:
+        records, next_cursor = keyset_page(queryset)
+    return records, history_context(request, next_cursor, date_from, date_to)
+
+
 def view_attendance(request):
     teacher_id = request.session.get('teacher_id')  # Fetch the logged-in teacher's ID
-    print(teacher_id)
     if not teacher_id:
         return redirect('teacher_login')
 
@@ -179,47 +526,175 @@ def view_attendance(request):
     # Get students enrolled in any of the teacher's subjects
     students = Student.objects.filter(subjects__in=subjects_taught).distinct()
 
-    # Fetch attendance records for these students
-    attendance_records = Attendance.objects.filter(student__in=students).order_by('-date')
+    # Fetch one page of attendance records for these students
+    attendance_records, context = paginate_history(
+        request, Attendance.objects.filter(student__in=students).select_related('student'),
+    )
+
+    context.update({'attendance_records': attendance_records, 'teacher': teacher})
+    return render(request, 'view_attendance.html', context)
+
+
+def attendance_api(request):
+    """JSON attendance history for the logged-in teacher, with the same cursor as the pages.
+
+    Query parameters: ``from``/``to`` (YYYY-MM-DD), ``subject`` (name),
+    ``cursor`` (the ``next`` value of the previous response) and ``limit``.
+    """
+    teacher_id = request.session.get('teacher_id')
+    if not teacher_id:
+        return JsonResponse({'message': "Not logged in."}, status=403)
+
+    queryset = teacher_attendance_records(teacher_id)
+    if request.GET.get('subject'):
+        queryset = queryset.filter(subject__name=request.GET['subject'])
+    date_from, date_to = history_window(request.GET)
+    queryset = filter_window(queryset, date_from, date_to)
+
+    try:
+        limit = min(int(request.GET.get('limit', settings.ATTENDANCE_PAGE_SIZE)), settings.ATTENDANCE_API_MAX_PAGE_SIZE)
+        records, next_cursor = keyset_page(queryset, request.GET.get('cursor'), max(limit, 1))
+    except (ValueError, InvalidCursor) as e:
+        return JsonResponse({'message': str(e)}, status=400)
+
+    return JsonResponse({
+        'from': date_from.isoformat(),
+        'to': date_to.isoformat() if date_to else None,
+        'results': [
+            {
+                'id': record.id,
+                'student_id': record.student_id,
+                'student': record.student.name,
+                'subject': record.subject.name,
+                'date': record.date.isoformat(),
+                'status': record.status,
+            }
+            for record in records
+        ],
+        'next': next_cursor,
+    })
+
+
+def enroll_students_bulk(request):
+    """Enroll a class at once from a ZIP of photos and a CSV roster (rollno,name[,photo])."""
+    teacher_id = request.session.get('teacher_id')
+    if not teacher_id:
+        return redirect('teacher_login')
+
+    report = None
+    if request.method == 'POST':
+        photos = request.FILES.get('photos')
+        roster = request.FILES.get('roster')
+        if photos is None or roster is None:
+            messages.error(request, "Upload both a ZIP of photos and a CSV roster.")
+            return redirect('enroll_students')
+        try:
+            with zipfile.ZipFile(photos) as archive:
+                rows = rows_from_zip(archive, roster.read().decode('utf-8-sig'))
+        except (zipfile.BadZipFile, UnicodeDecodeError) as e:
+            messages.error(request, f"Could not read the upload: {e}")
+            return redirect('enroll_students')
+
+        teacher = Teacher.objects.get(id=teacher_id)
+        try:
+            # Shares the bounded recognition pool with the capture views
+            report = enroll_students(rows, list(teacher.subjects.all()), pool=get_recognition_pool())
+        except RecognitionBusy:
+            messages.error(request, "The server is busy recognising faces. Please retry the upload in a moment.")
+            return render(request, 'enroll_students.html', {'report': None}, status=429)
+        except RecognitionTimeout:
+            messages.error(request, "Encoding the photos timed out. Please retry with fewer photos.")
+            return render(request, 'enroll_students.html', {'report': None}, status=503)
+        enrolled = sum(entry['status'] == 'enrolled' for entry in report)
+        messages.success(request, f"Enrolled {enrolled} of {len(report)} students.")
+
+    return render(request, 'enroll_students.html', {'report': report})
+
+
+def export_attendance(request):
+    """Stream attendance as CSV or XLSX (``?format=xlsx``).
+
+    Teachers get the records of their own subjects; staff users may export
+    any teacher's. Optional filters: ``subject``, ``teacher``, ``from``, ``to``.
+    """
+    teacher_id = request.session.get('teacher_id')
+    if request.user.is_staff:
+        teacher_id = request.GET.get('teacher') or None
+    elif not teacher_id:
+        return redirect('teacher_login')
+
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return JsonResponse({'message': f"Unknown export format {export_format!r}."}, status=400)
+    stream, content_type = EXPORT_FORMATS[export_format]
+
+    rows = export_rows(
+        subject=request.GET.get('subject'),
+        teacher=teacher_id,
+        date_from=parse_date(request.GET.get('from')),
+        date_to=parse_date(request.GET.get('to')),
+    )
+    response = StreamingHttpResponse(stream(rows), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="attendance.{export_format}"'
+    return response
+
+
+def teacher_attendance_records(teacher_id):
+    """Attendance of enrolled students across all of a teacher's subjects.
+
+    One query: the student and subject of each record are joined in, so the
+    template and ``Attendance.__str__`` never hit the database per row.
+    """
+    enrolled = Student.subjects.through.objects.filter(
+        student_id=OuterRef('student_id'), subject_id=OuterRef('subject_id'),
+    )
+    return (
+        Attendance.objects
+        .filter(subject__in=Subject.objects.filter(teachers=teacher_id))
+        .filter(Exists(enrolled))
+        .select_related('student', 'subject')
+        .order_by('subject__name', '-date')
+    )
 
-    return render(request, 'view_attendance.html', {'attendance_records': attendance_records, 'teacher': teacher})
 
 @login_required
 def view_attendance_by_subject(request):
     # Fetch the logged-in teacher's ID from the session
     teacher_id = request.session.get('teacher_id')
-    print(teacher_id)
     if not teacher_id:
         return redirect('teacher_login')  # Redirect to login if teacher is not logged in
 
     # Get the Teacher instance based on the teacher_id
     teacher = Teacher.objects.get(id=teacher_id)
 
-    # Get the subjects taught by the teacher
-    subjects_taught = teacher.subjects.all()
-    print(subjects_taught)
-
-    # Initialize a dictionary to hold attendance by subject and date
-    attendance_by_subject = defaultdict(lambda: defaultdict(list))
-
-    # Iterate over subjects and group attendance records by subject and date
-    for subject in subjects_taught:
-        # Get the students who are enrolled in this subject
-        students = Student.objects.filter(subjects=subject)
-        print(students)
-        # Get the attendance records for those students, ordered by date
-        attendance_records = Attendance.objects.filter(student__in=students, subject=subject).order_by('-date')
-        print(attendance_records)
-
-        # Group the attendance records by subject and date
-        for record in attendance_records:
-            attendance_by_subject[subject.name][record.date].append(record)
-        print(attendance_by_subject)
+    # One page of records, newest first
+    records, context = paginate_history(request, teacher_attendance_records(teacher.id))
+
+    # Day totals for the subjects and dates on this page come from the rollup
+    summaries = {
+        (summary.subject_id, summary.date): summary
+        for summary in DailyAttendanceSummary.objects.filter(
+            subject_id__in={record.subject_id for record in records},
+            date__in={record.date for record in records},
+        )
+    }
+
+    # Group the page by subject and date in a single pass. Plain dicts, because
+    # the template's ".items" lookup would create an "items" key on a defaultdict.
+    attendance_by_subject = {}
+    for record in records:
+        day = attendance_by_subject.setdefault(record.subject.name, {}).setdefault(record.date, {
+            'records': [],
+            'summary': summaries.get((record.subject_id, record.date)),
+        })
+        day['records'].append(record)
+    attendance_by_subject = dict(sorted(attendance_by_subject.items()))
 
     # Pass the attendance data to the template
-    return render(request, 'attendance_by_subject.html', {
+    context.update({
         'teacher': teacher,
         'attendance_by_subject': attendance_by_subject,
     })
+    return render(request, 'attendance_by_subject.html', context)
 
         
\ No newline at end of file
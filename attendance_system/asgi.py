@@ -13,4 +13,20 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'attendance_system.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402
+from attendance.streaming import STREAM_PATH, capture_stream  # noqa: E402
+
+
+async def application(scope, receive, send):
+    # Django only speaks HTTP; the streaming check-in WebSocket is served by
+    # a plain ASGI handler next to it
+    if scope['type'] == 'websocket' and scope['path'] == STREAM_PATH:
+        return await capture_stream(scope, receive, send)
+    return await django_application(scope, receive, send)
+
+
+if settings.FACE_MODELS_WARMUP:
+    from attendance.utils import warm_up
+    warm_up()
@@ -13,12 +13,111 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 from pathlib import Path
 import os
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 SHAPE_PREDICTOR_PATH = os.path.join(BASE_DIR, 'attendance', 'resources', 'shape_predictor_68_face_landmarks.dat')
 FACE_REC_MODEL_PATH = os.path.join(BASE_DIR, 'attendance', 'resources', 'dlib_face_recognition_resnet_model_v1.dat')
 
+# The dlib models are loaded on the first recognition call. Set this to load
+# them when the WSGI/ASGI application starts instead; combined with
+# `gunicorn --preload` they are loaded once in the master and shared by all
+# forked workers.
+FACE_MODELS_WARMUP = os.environ.get('FACE_MODELS_WARMUP', '') == '1'
+
+# Replace the dlib models with cheap deterministic stubs (attendance.stub_models)
+# so benchmarks and tests run on machines without dlib or the .dat files.
+# Never enable this in production: the stubs do not recognise faces.
+FACE_MODELS_STUB = os.environ.get('FACE_MODELS_STUB', '') == '1'
+
+# HOG face detection runs on frames shrunk to at most this width (None = full
+# resolution); landmarks and descriptors still use the full-resolution frame.
+# Upsampling finds smaller faces at roughly 4x the cost per step.
+FACE_DETECTION_MAX_WIDTH = 640
+FACE_DETECTION_UPSAMPLE = 0
+
+# dlib detection/recognition runs in a pool of RECOGNITION_WORKERS processes
+# (0 = inline on the request thread). At most RECOGNITION_QUEUE_SIZE further
+# jobs may wait; beyond that captures are rejected with HTTP 429, and jobs
+# that take longer than RECOGNITION_TIMEOUT seconds get HTTP 503.
+RECOGNITION_WORKERS = int(os.environ.get('RECOGNITION_WORKERS', 0))
+RECOGNITION_QUEUE_SIZE = int(os.environ.get('RECOGNITION_QUEUE_SIZE', 8))
+RECOGNITION_TIMEOUT = 10
+
+# Face quality gate, between detection and the (expensive) descriptor. Faces
+# narrower than FACE_QUALITY_MIN_SIZE px (in a frame FACE_QUALITY_REFERENCE_WIDTH
+# px wide; scaled down for narrower frames such as the 320 px stream, so a
+# face at the same distance passes either way), with a mean grey level outside
+# FACE_QUALITY_BRIGHTNESS, blurrier than FACE_QUALITY_MIN_SHARPNESS (variance
+# of the Laplacian of the face scaled to 96 px), or turned more than
+# FACE_QUALITY_MAX_YAW / FACE_QUALITY_MAX_PITCH degrees away from the camera
+# are rejected with a reason instead of being matched. FACE_QUALITY_CHECKS=0
+# turns the gate off.
+FACE_QUALITY_CHECKS = os.environ.get('FACE_QUALITY_CHECKS', '1') == '1'
+FACE_QUALITY_MIN_SIZE = 60
+FACE_QUALITY_REFERENCE_WIDTH = 640
+FACE_QUALITY_BRIGHTNESS = (60, 200)
+FACE_QUALITY_MIN_SHARPNESS = 30
+FACE_QUALITY_MAX_YAW = 35
+FACE_QUALITY_MAX_PITCH = 25
+
+# Capture short-circuits. An upload byte-identical to one seen in the last
+# CAPTURE_FRAME_CACHE_TTL seconds reuses that frame's recognition result
+# (repeat clicks, kiosks resending the same picture). A student marked present
+# for a subject today is remembered for CAPTURE_MARKED_CACHE_TTL seconds, so
+# repeats skip the database. Sizes bound each cache's entries; 0 disables it.
+CAPTURE_FRAME_CACHE_SIZE = 256
+CAPTURE_FRAME_CACHE_TTL = 5
+CAPTURE_MARKED_CACHE_SIZE = 10000
+CAPTURE_MARKED_CACHE_TTL = 300
+
+# Streaming check-in (WebSocket /ws/capture/). The face detector runs on every
+# STREAM_DETECT_EVERY-th frame; in between, faces are followed by correlation
+# trackers, and a track whose tracker confidence falls below
+# STREAM_TRACK_MIN_CONFIDENCE is dropped until the next detection. Streams are
+# processed in the server process (their trackers can't move between workers),
+# so at most STREAM_MAX_ACTIVE may be open at once; further connections are
+# closed with code 1013 (try again later). Frames are also dropped while the
+# recognition pool is full, so streams back off along with the HTTP captures.
+STREAM_DETECT_EVERY = int(os.environ.get('STREAM_DETECT_EVERY', 5))
+STREAM_TRACK_MIN_CONFIDENCE = 7
+STREAM_MAX_ACTIVE = int(os.environ.get('STREAM_MAX_ACTIVE', 4))
+
+# The enroll_students command computes face encodings in ENROLLMENT_WORKERS
+# processes (default: one per CPU core; 1 = inline). Web uploads use the
+# recognition pool instead, one photo per worker at a time.
+ENROLLMENT_WORKERS = int(os.environ.get('ENROLLMENT_WORKERS', os.cpu_count() or 1))
+
+# Student.facial_encoding storage format for new encodings: 'float32'
+# (524 bytes stored: a 12-byte header + 512, exact) or 'int8' (140 bytes: header
+# + 128, quantised). Both can be read back.
+FACE_ENCODING_FORMAT = os.environ.get('FACE_ENCODING_FORMAT', 'float32')
+
+# Face matching index: 'exact' scans every encoding, 'ivf' only scans the
+# FACE_INDEX_NPROBE nearest of FACE_INDEX_NLIST k-means clusters (None = sqrt(N)).
+# The IVF quantizer is trained by `manage.py build_face_index` and saved at
+# FACE_INDEX_PATH; servers load it on startup and search exactly without it.
+FACE_INDEX_BACKEND = os.environ.get('FACE_INDEX_BACKEND', 'exact')
+FACE_INDEX_PATH = os.path.join(BASE_DIR, 'face_index.npz')
+FACE_INDEX_NLIST = None
+FACE_INDEX_NPROBE = 8
+
+# Captures are matched only against students enrolled in the teacher's session
+# subject. Without a subject in the session, fall back to searching everyone
+# (the student is identified but no attendance is marked) or refuse outright.
+FACE_MATCH_GLOBAL_FALLBACK = True
+
+# Attendance history pages show ATTENDANCE_PAGE_SIZE records per page and,
+# unless a start date is given, only the last ATTENDANCE_HISTORY_DAYS days.
+ATTENDANCE_PAGE_SIZE = 100
+ATTENDANCE_API_MAX_PAGE_SIZE = 1000
+ATTENDANCE_HISTORY_DAYS = 30
+
+# Months in which a term starts; per-student attendance rollups are kept per term.
+ATTENDANCE_TERM_START_MONTHS = (1, 7)
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
 
@@ -77,11 +176,72 @@ WSGI_APPLICATION = 'attendance_system.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# PostgreSQL is configured from the environment (DATABASE_ENGINE=postgresql
+# plus DATABASE_NAME/USER/PASSWORD/HOST/PORT). Connections come from Django's
+# pool (psycopg 3 with psycopg-pool) unless DATABASE_POOL=0, in which case
+# each worker keeps a persistent connection for DATABASE_CONN_MAX_AGE seconds.
+# Either way connections are health-checked before reuse.
+#
+# Without it the project runs on SQLite, tuned for the check-in burst: WAL lets
+# readers work while a capture writes, busy_timeout (``timeout``) makes writers
+# wait for the lock instead of failing with "database is locked", write
+# transactions take the lock up front (IMMEDIATE) so they never deadlock on
+# upgrade, and synchronous=NORMAL only syncs at checkpoints, which is safe in WAL mode.
+DATABASE_ENGINE = os.environ.get('DATABASE_ENGINE', 'sqlite')
+
+if DATABASE_ENGINE == 'postgresql':
+    DATABASE_POOL = os.environ.get('DATABASE_POOL', '1') == '1'
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DATABASE_NAME', 'attendance'),
+            'USER': os.environ.get('DATABASE_USER', ''),
+            'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+            'HOST': os.environ.get('DATABASE_HOST', ''),
+            'PORT': os.environ.get('DATABASE_PORT', ''),
+            # The pool manages connection lifetime itself; Django requires 0 with it
+            'CONN_MAX_AGE': 0 if DATABASE_POOL else int(os.environ.get('DATABASE_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'pool': {
+                    'min_size': int(os.environ.get('DATABASE_POOL_MIN_SIZE', 2)),
+                    'max_size': int(os.environ.get('DATABASE_POOL_MAX_SIZE', 20)),
+                    'timeout': 10,
+                },
+            } if DATABASE_POOL else {},
+        }
+    }
+elif DATABASE_ENGINE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DATABASE_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+                'timeout': 20,
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
     }
+else:
+    raise ImproperlyConfigured(f"Unsupported DATABASE_ENGINE {DATABASE_ENGINE!r}; use 'sqlite' or 'postgresql'.")
+
+
+# Capture views log one JSON line per request (logger attendance.requests)
+# with the time spent in each pipeline stage; set ATTENDANCE_LOG_LEVEL=WARNING
+# to turn it off. The same timings are exported as histograms on /metrics/.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'attendance': {
+            'handlers': ['console'],
+            'level': os.environ.get('ATTENDANCE_LOG_LEVEL', 'INFO'),
+        },
+    },
 }
 
 
@@ -21,9 +21,16 @@ from attendance import views
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('capture/', views.capture_face, name='capture_face'),
+    path('capture/batch/', views.capture_faces_batch, name='capture_faces_batch'),
+    path('capture/async/', views.capture_face_async, name='capture_face_async'),
+    path('capture/batch/async/', views.capture_faces_batch_async, name='capture_faces_batch_async'),
     path('', views.teacher_login, name='teacher_login'),
     path('dashboard/', views.teacher_dashboard, name='teacher_dashboard'),
     path('register_student/', views.register_student, name='register_student'),
+    path('register_student/bulk/', views.enroll_students_bulk, name='enroll_students'),
     # path('attendance/', views.view_attendance, name='view_attendance'),
     path('attendance/', views.view_attendance_by_subject, name='attendance_by_subject'),
+    path('api/attendance/', views.attendance_api, name='attendance_api'),
+    path('metrics/', views.metrics, name='metrics'),
+    path('export/attendance/', views.export_attendance, name='export_attendance'),
 ]